@@ -0,0 +1,436 @@
+from multiprocessing import Process, Queue
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from coco import COCO_FILES, group_annotations, write_coco_stream
+from geometry import SegmentGrid
+from info import InfoManager
+from objects import Annotation, BoundingBox, Label, Polygon, Segment
+from operations import check_inside_polygon, points_in_polygon, vertices_to_rle
+
+
+# Peak resident set size of the current process in bytes (Linux reports kilobytes, macOS bytes)
+def peak_rss() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def make_fields(annotation_count: int, annotations_per_image: int = 10):
+    image_count = max(annotation_count // annotations_per_image, 1)
+    images = [{"id": image_id,
+               "width": 1920,
+               "height": 1080,
+               "file_name": f"{image_id:08}.jpg",
+               "license": None,
+               "date_captured": "2021:01:01 00:00:00"} for image_id in range(image_count)]
+    annotations = [{"id": annotation_id,
+                    "image_id": annotation_id % image_count,
+                    "category_id": annotation_id % 5,
+                    "segmentation": [10, 10, 60, 10, 60, 40, 35, 55, 10, 40],
+                    "area": 1500,
+                    "bbox": [10, 10, 50, 45],
+                    "iscrowd": False} for annotation_id in range(annotation_count)]
+    categories = [{"id": category_id, "name": f"label {category_id}", "supercategory": None}
+                  for category_id in range(5)]
+
+    return {"info": {}, "licenses": [], "categories": categories, "images": images, "annotations": annotations}
+
+
+# The way coco.json was written before it was streamed, kept to measure against
+def write_coco_whole(path: str, coco: dict):
+    with open(path, "w") as coco_file:
+        coco_file.write(json.dumps(coco))
+
+
+def run_write(writer: str, annotation_count: int, compression, results: Queue):
+    coco = make_fields(annotation_count)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, COCO_FILES[compression])
+        rss_before = peak_rss()
+        start = time.perf_counter()
+        if writer == "whole":
+            write_coco_whole(path, coco)
+        else:
+            write_coco_stream(path, coco["info"], coco["licenses"], coco["categories"], coco["images"],
+                              group_annotations(coco["annotations"]))
+        seconds = time.perf_counter() - start
+
+        results.put({"writer": writer,
+                     "compression": compression,
+                     "annotations": annotation_count,
+                     "seconds": seconds,
+                     "peak_rss_delta": peak_rss() - rss_before,
+                     "file_bytes": os.path.getsize(path)})
+
+
+# Each run gets its own process, so that peak memory from one writer can't hide behind another
+def bench_write_coco(annotation_count: int, compression=None) -> list:
+    results = []
+    for writer in ("whole", "stream"):
+        if writer == "whole" and compression:
+            continue
+
+        queue = Queue()
+        process = Process(target=run_write, args=(writer, annotation_count, compression, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+
+    return results
+
+
+# The way annotations were held in memory before they were slotted and array backed, kept to measure against: plain
+# objects, a list of vertices and a Segment object, with its own canvas reference, for every edge
+class LegacySegment:
+    def __init__(self, canvas, colour: str, x: int, y: int):
+        self.canvas = canvas
+        self.colour = colour
+        self.start_x = x
+        self.start_y = y
+        self.end_x = x
+        self.end_y = y
+        self.line_object = None
+
+
+class LegacyPolygon:
+    def __init__(self, canvas, colour: str, vertices: list):
+        self.canvas = canvas
+        self.colour = colour
+        self.segments = []
+        self.segment = None
+        self.grid = SegmentGrid()
+        self.vertices = []
+        for i in range(0, len(vertices), 2):
+            x, y = vertices[i], vertices[i + 1]
+            segment = LegacySegment(canvas, colour, x, y)
+            segment.end_x, segment.end_y = vertices[(i + 2) % len(vertices)], vertices[(i + 3) % len(vertices)]
+            self.segments.append(segment)
+            self.grid.add((segment.start_x, segment.start_y), (segment.end_x, segment.end_y))
+            self.vertices.append(x)
+            self.vertices.append(y)
+
+
+class LegacyBoundingBox:
+    def __init__(self, canvas, coords: list, label, colour: str):
+        self.canvas = canvas
+        self.start_x, self.start_y, self.end_x, self.end_y = coords
+        self.label_ref = label
+        self.colour = colour
+        self.box_object = None
+        self.label_object = None
+
+
+class LegacyAnnotation:
+    def __init__(self, canvas, state_manager):
+        self.canvas = canvas
+        self.state_manager = state_manager
+        self.label_ref = None
+        self.colour = None
+        self.bbox = None
+        self.poly = None
+        self.segment = None
+        self.polygons = []
+        self.rle = None
+
+
+# An octagon inside its box, shifted a little for each annotation so that no two share their ints
+def make_polygon_vertices(index: int) -> list:
+    x, y = index % 1000, index % 700
+    return [x + 10, y, x + 20, y, x + 30, y + 10, x + 30, y + 20, x + 20, y + 30, x + 10, y + 30, x, y + 20, x, y + 10]
+
+
+def run_memory(model: str, polygon_count: int, results: Queue):
+    label = Label("label 0", "label0")
+    tracemalloc.start()
+    annotations = []
+    start = time.perf_counter()
+    for index in range(polygon_count):
+        vertices = make_polygon_vertices(index)
+        coords = [vertices[12], vertices[1], vertices[4], vertices[9]]
+        if model == "legacy":
+            annotation = LegacyAnnotation(None, None)
+            annotation.bbox = LegacyBoundingBox(None, coords, label, "blue")
+            annotation.polygons.append(LegacyPolygon(None, "blue", vertices))
+        else:
+            annotation = Annotation(None, None)
+            annotation.set_label(label, "blue")
+            annotation.set_bbox(BoundingBox(None, coords, label, "blue"))
+            annotation.polygons.append(Polygon.from_vertices(None, "blue", vertices))
+        annotations.append(annotation)
+    seconds = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results.put({"model": model,
+                 "polygons": polygon_count,
+                 "seconds": seconds,
+                 "traced_bytes": current,
+                 "peak_traced_bytes": peak,
+                 "bytes_per_annotation": current / polygon_count})
+
+
+# Compares the bytes held per annotation, one box and one eight vertex polygon each, between the old and new objects.
+# The old objects can run out of memory long before the new ones, so a run that dies is reported rather than waited on
+def bench_annotation_memory(polygon_count: int) -> list:
+    results = []
+    for model in ("legacy", "compact"):
+        queue = Queue()
+        process = Process(target=run_memory, args=(model, polygon_count, queue))
+        process.start()
+        process.join()
+        if process.exitcode == 0:
+            results.append(queue.get())
+        else:
+            results.append({"model": model, "polygons": polygon_count, "exitcode": process.exitcode})
+
+    return results
+
+
+# The microbenchmark suite. Each case is timed as the best of several runs, which is the figure least thrown about by
+# whatever else the machine is doing, and results are compared case by case against a stored baseline
+
+VERTEX_COUNTS = (8, 64, 512)
+# The stored baseline, written with --output from a run of the full suite
+BASELINE_FILE = "benchmark_baseline.json"
+ANNOTATION_COUNTS = (1_000, 100_000, 1_000_000)
+
+
+# Runs a function until at least min_seconds have passed or repeat runs are done, returning the fastest run
+def best_time(function, repeat: int = 5, min_seconds: float = 0.2) -> tuple:
+    times = []
+    started = time.perf_counter()
+    while len(times) < repeat or (time.perf_counter() - started < min_seconds and len(times) < 1000):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times), len(times)
+
+
+# A star shaped polygon, which never crosses itself, with its vertices spread around a circle in a box of size
+def make_star(vertex_count: int, size: int = 512, seed: int = 0) -> list:
+    generator = random.Random(seed)
+    vertices = []
+    for index in range(vertex_count):
+        angle = 2 * math.pi * index / vertex_count
+        radius = size / 2 * generator.uniform(0.5, 1)
+        vertices.append(round(size / 2 + radius * math.cos(angle)))
+        vertices.append(round(size / 2 + radius * math.sin(angle)))
+
+    return vertices
+
+
+# A polygon part way through being drawn, with every edge but the closing one as a Segment, and the closing one as
+# the segment to check
+def make_drawn_polygon(vertices: list) -> Polygon:
+    polygon = Polygon(None, "blue", vertices[0], vertices[1])
+    for index in range(2, len(vertices), 2):
+        polygon.segment.adjust_coords(vertices[index], vertices[index + 1])
+        polygon.add_segment(polygon.segment)
+        polygon.segment = Segment(None, "blue", vertices[index], vertices[index + 1])
+        polygon.add_vertex(vertices[index], vertices[index + 1])
+    polygon.segment.adjust_coords(vertices[0], vertices[1])
+
+    return polygon
+
+
+# Stands in for an EditableImage, holding real annotation objects but no canvas
+class BenchImage:
+    __slots__ = ("file_name", "width", "height", "date_captured", "annotations", "coco_annotations", "coco_id",
+                 "dirty")
+
+    def __init__(self, image_id: int, annotations: list):
+        self.file_name = f"{image_id:08}.jpg"
+        self.width = 1920
+        self.height = 1080
+        self.date_captured = None
+        self.annotations = annotations
+        self.coco_annotations = None
+        self.coco_id = None
+        self.dirty = True
+
+
+# Builds images of ten annotations each, every one a box with a polygon, and every tenth a crowd of two polygons
+def make_bench_images(annotation_count: int, annotations_per_image: int = 10) -> list:
+    labels = [Label(f"label {index}", f"label{index}") for index in range(5)]
+    images = []
+    for image_id in range(max(annotation_count // annotations_per_image, 1)):
+        annotations = []
+        for index in range(annotations_per_image):
+            number = image_id * annotations_per_image + index
+            vertices = make_polygon_vertices(number)
+            annotation = Annotation(None, None)
+            annotation.set_label(labels[number % 5], "blue")
+            annotation.set_bbox(BoundingBox(None, [vertices[12], vertices[1], vertices[4], vertices[9]],
+                                            labels[number % 5], "blue"))
+            annotation.polygons.append(Polygon.from_vertices(None, "blue", vertices))
+            if number % 10 == 9:
+                annotation.polygons.append(Polygon.from_vertices(None, "blue", [vertex + 5 for vertex in vertices]))
+            annotations.append(annotation)
+        images.append(BenchImage(image_id, annotations))
+
+    return images
+
+
+def bench_vertices_to_rle(results: dict):
+    for vertex_count in VERTEX_COUNTS:
+        vertices = make_star(vertex_count)
+        pairs = list(zip(vertices[::2], vertices[1::2]))
+        results[f"vertices_to_rle/{vertex_count}"] = best_time(lambda: vertices_to_rle([0, 0, 512, 512], pairs))
+
+
+def bench_check_inside_polygon(results: dict, point_count: int = 1000):
+    generator = random.Random(1)
+    points = [(generator.randrange(512), generator.randrange(512)) for _ in range(point_count)]
+    for vertex_count in VERTEX_COUNTS:
+        vertices = make_star(vertex_count)
+        pairs = list(zip(vertices[::2], vertices[1::2]))
+        results[f"check_inside_polygon/{vertex_count}"] = best_time(
+            lambda: [check_inside_polygon(pairs, point, 512) for point in points], repeat=3)
+        results[f"points_in_polygon/{vertex_count}"] = best_time(lambda: points_in_polygon(pairs, points, 512))
+
+
+def bench_check_invalid(results: dict):
+    for vertex_count in VERTEX_COUNTS + (4096,):
+        polygon = make_drawn_polygon(make_star(vertex_count, size=4096))
+        polygon.get_grid()
+        results[f"check_invalid/{vertex_count}"] = best_time(polygon.check_invalid)
+
+
+# Times filling the fields of freshly edited images, then writing and reading coco.json, at each annotation count
+def bench_coco_round_trip(results: dict, annotation_counts):
+    for annotation_count in annotation_counts:
+        images = make_bench_images(annotation_count)
+        with tempfile.TemporaryDirectory() as directory:
+            info_manager = InfoManager(workers=1)
+            info_manager.directory = directory
+            info_manager.valid = True
+
+            start = time.perf_counter()
+            info_manager.bulk_populate_fields(images)
+            results[f"bulk_populate_fields/{annotation_count}"] = (time.perf_counter() - start, 1)
+
+            start = time.perf_counter()
+            info_manager.write_coco()
+            results[f"write_coco/{annotation_count}"] = (time.perf_counter() - start, 1)
+            info_manager.close()
+
+            def read_coco():
+                reader = InfoManager()
+                reader.directory = directory
+                # The images only exist in the header, so there is nothing on disk to refresh them from
+                reader.refresh_images = lambda: None
+                reader.read_coco()
+                for image in reader.images:
+                    reader.coco_reader.annotations_for_image(image["id"])
+
+            results[f"read_coco/{annotation_count}"] = best_time(read_coco, repeat=1 if annotation_count > 1000 else 3)
+        del images
+
+
+def run_suite(annotation_counts) -> dict:
+    results = {}
+    bench_vertices_to_rle(results)
+    bench_check_inside_polygon(results)
+    bench_check_invalid(results)
+    bench_coco_round_trip(results, annotation_counts)
+
+    return {"meta": {"python": platform.python_version(),
+                     "numpy": np.__version__,
+                     "machine": platform.machine(),
+                     "cpus": os.cpu_count(),
+                     "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "results": {name: {"seconds": seconds, "runs": runs} for name, (seconds, runs) in results.items()}}
+
+
+# Returns (name, baseline, current, ratio) for every case that got slower than the baseline by more than the threshold
+def find_regressions(current: dict, baseline: dict, threshold: float) -> list:
+    regressions = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before = baseline["results"][name]["seconds"]
+        ratio = result["seconds"] / before if before else 1
+        if ratio > 1 + threshold:
+            regressions.append((name, before, result["seconds"], ratio))
+
+    return regressions
+
+
+def print_comparison(current: dict, baseline: dict = None):
+    for name, result in current["results"].items():
+        line = f"{name:<32}{result['seconds'] * 1000:>12.3f} ms"
+        if baseline and name in baseline["results"]:
+            before = baseline["results"][name]["seconds"]
+            line += f"{before * 1000:>12.3f} ms{result['seconds'] / before if before else 1:>8.2f}x"
+        print(line, file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark export, drawing and coco.json hot paths, or writing "
+                                                 "coco.json and holding annotations in memory")
+    parser.add_argument("--bench", choices=["suite", "write", "memory"], default="suite")
+    parser.add_argument("--annotations", type=int, default=1_000_000)
+    parser.add_argument("--polygons", type=int, default=1_000_000)
+    parser.add_argument("--compression", choices=["gzip", "lzma"], default=None)
+    parser.add_argument("--sizes", default=",".join(str(count) for count in ANNOTATION_COUNTS),
+                        help="annotation counts for the coco round trip in the suite")
+    parser.add_argument("--output", default=None, help="write the suite's results to this JSON file")
+    parser.add_argument("--baseline", default=None,
+                        help=f"compare the suite's results against this JSON file, such as {BASELINE_FILE}")
+    parser.add_argument("--threshold", type=float, default=0.2, help="how much slower a case may get, as a fraction")
+    args = parser.parse_args()
+
+    if args.bench != "suite":
+        if args.bench == "memory":
+            results = bench_annotation_memory(args.polygons)
+        else:
+            results = bench_write_coco(args.annotations, args.compression)
+        for result in results:
+            print(json.dumps(result))
+        return 0
+
+    # A baseline that was asked for but isn't there fails the run before it starts, rather than passing unchecked
+    baseline = None
+    if args.baseline:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}", file=sys.stderr)
+            return 2
+        with open(args.baseline, "r") as baseline_file:
+            baseline = json.loads(baseline_file.read())
+
+    current = run_suite([int(size) for size in args.sizes.split(",") if size])
+
+    print_comparison(current, baseline)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(json.dumps(current, indent=2))
+    else:
+        print(json.dumps(current))
+
+    if baseline:
+        missing = [name for name in current["results"] if name not in baseline["results"]]
+        if missing:
+            print(f"Not in the baseline: {', '.join(missing)}", file=sys.stderr)
+        regressions = find_regressions(current, baseline, args.threshold)
+        for name, before, after, ratio in regressions:
+            print(f"Regression in {name}: {before * 1000:.3f} ms -> {after * 1000:.3f} ms ({ratio:.2f}x)",
+                  file=sys.stderr)
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
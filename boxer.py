@@ -0,0 +1,269 @@
+from functools import partial
+import argparse
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+
+from coco import COCO_FILES, find_coco_path
+from database import get_database_path
+from geometry import check_polygon_intersections
+from info import InfoManager, open_dir
+from masks import MaskExporter
+from operations import clamp_points, polygon_areas, polygons_to_rle, rle_from_string, rle_to_string
+from pool import map_ordered
+
+SHARD_SIZE = 256
+
+
+# Stands in for an EditableImage when a directory is loaded without a window, carrying only what InfoManager reads
+class ImageRecord:
+    __slots__ = ("file_name", "width", "height", "date_captured", "coco_id", "coco_annotations", "dirty")
+
+    def __init__(self, image: dict):
+        self.file_name = image["file_name"]
+        self.width = image["width"]
+        self.height = image["height"]
+        self.date_captured = image["date_captured"]
+        self.coco_id = image["id"]
+        self.coco_annotations = None
+        self.dirty = False
+
+
+# Loads a directory's coco file or database without Tk, returning the info manager and a record for every image
+def load_headless(directory: str, backend: str = None, compression: str = None):
+    if not find_coco_path(directory) and not os.path.exists(get_database_path(directory)):
+        raise SystemExit(f"{directory} has no coco file or annotations.db")
+
+    info_manager = InfoManager(backend=backend)
+    if open_dir(info_manager, directory) != "read":
+        raise SystemExit(f"{directory} has no annotations to load")
+    info_manager.set_valid(True)
+    if compression is not None:
+        info_manager.compression = compression or None
+
+    records = [ImageRecord(image) for image in info_manager.images]
+    info_manager.bulk_populate_fields(records)
+    return info_manager, records
+
+
+# Splits the dataset into runs of whole images, each carrying the image and its annotations, read one shard at a time
+def iter_shards(info_manager: InfoManager, records: list, shard_size: int = SHARD_SIZE):
+    for start in range(0, len(records), shard_size):
+        shard = []
+        for image_id in range(start, min(start + shard_size, len(records))):
+            image = info_manager.images[image_id]
+            shard.append((image, info_manager.get_image_annotations(records[image_id])))
+        yield shard
+
+
+# Jobs, each run on one shard in a worker process
+# Returns the problems found with one annotation, checked against its image and the known categories
+def check_annotation(annotation: dict, image: dict, category_ids: set) -> list:
+    problems = []
+    if annotation["category_id"] not in category_ids:
+        problems.append(f"unknown category {annotation['category_id']}")
+
+    x, y, width, height = annotation["bbox"]
+    if width <= 0 or height <= 0:
+        problems.append("empty bbox")
+    if x < 0 or y < 0 or x + width > image["width"] or y + height > image["height"]:
+        problems.append("bbox outside the image")
+
+    segmentation = annotation["segmentation"]
+    if isinstance(segmentation, dict):
+        size = segmentation.get("size", [])
+        counts = segmentation.get("counts")
+        if isinstance(counts, str):
+            counts = rle_from_string(counts)
+        if isinstance(counts, list) and len(size) == 2:
+            if sum(counts) not in (size[0] * size[1], width * height):
+                problems.append("RLE counts don't cover the mask")
+    elif segmentation:
+        polygons = segmentation if isinstance(segmentation[0], list) else [segmentation]
+        for vertices in polygons:
+            if len(vertices) % 2 or len(vertices) < 6:
+                problems.append("polygon with fewer than three vertices")
+            elif check_polygon_intersections(vertices):
+                problems.append("self-intersecting polygon")
+
+    return problems
+
+
+# Runs check_annotation over a shard, then measures every polygon in the shard at once for ones with no area or with
+# vertices outside their image
+def validate_shard(shard: list, category_ids: set) -> list:
+    problems = []
+    polygons = []
+    owners = []
+    for image, annotations in shard:
+        for annotation in annotations:
+            for problem in check_annotation(annotation, image, category_ids):
+                problems.append({"image": image["file_name"], "annotation": annotation["id"], "problem": problem})
+
+            segmentation = annotation["segmentation"]
+            if isinstance(segmentation, list) and segmentation:
+                for vertices in segmentation if isinstance(segmentation[0], list) else [segmentation]:
+                    if len(vertices) >= 6 and not len(vertices) % 2:
+                        polygons.append(vertices)
+                        owners.append((image, annotation))
+
+    if not polygons:
+        return problems
+
+    offsets = np.cumsum([0] + [len(vertices) for vertices in polygons])
+    points = np.concatenate(polygons).reshape(-1, 2)
+    areas = polygon_areas(points, offsets)
+    bounds = np.repeat([[image["width"], image["height"]] for image, _annotation in owners], np.diff(offsets) // 2,
+                       axis=0)
+    outside = np.any(clamp_points(points, bounds[:, 0], bounds[:, 1]) != points, axis=1)
+    outside = np.add.reduceat(outside, offsets[:-1] // 2) > 0
+    for (image, annotation), area, is_outside in zip(owners, areas.tolist(), outside.tolist()):
+        if not area:
+            problems.append({"image": image["file_name"], "annotation": annotation["id"], "problem": "empty polygon"})
+        if is_outside:
+            problems.append({"image": image["file_name"], "annotation": annotation["id"],
+                             "problem": "polygon outside the image"})
+
+    return problems
+
+
+# Joins the polygons of crowd annotations, or of every annotation when everything is set, into one compressed RLE over
+# the whole image. Returns the new annotations of each image that changed, by image id
+def rle_shard(shard: list, everything: bool = False) -> list:
+    changed = []
+    for image, annotations in shard:
+        touched = False
+        for annotation in annotations:
+            segmentation = annotation["segmentation"]
+            if not segmentation or isinstance(segmentation, dict) or not (everything or annotation["iscrowd"]):
+                continue
+
+            polygons = segmentation if isinstance(segmentation[0], list) else [segmentation]
+            counts = polygons_to_rle(polygons, image["width"], image["height"])
+            annotation["segmentation"] = {"counts": rle_to_string(counts), "size": [image["height"], image["width"]]}
+            annotation["area"] = sum(counts[1::2])
+            annotation["iscrowd"] = True
+            touched = True
+
+        if touched:
+            changed.append((image["id"], annotations))
+
+    return changed
+
+
+# Commands
+def run_validate(args) -> int:
+    info_manager, records = load_headless(args.directory)
+    category_ids = {category["id"] for category in info_manager.categories}
+    job = partial(validate_shard, category_ids=category_ids)
+
+    problem_count = 0
+    for problems in map_ordered(job, iter_shards(info_manager, records, args.shard_size), args.workers):
+        for problem in problems:
+            print(json.dumps(problem))
+        problem_count += len(problems)
+
+    info_manager.close()
+    print(f"{problem_count} problems in {len(records)} images", file=sys.stderr)
+    return 1 if problem_count else 0
+
+
+def run_rle(args) -> int:
+    info_manager, records = load_headless(args.directory)
+    job = partial(rle_shard, everything=args.all)
+
+    changed_count = 0
+    for changed in map_ordered(job, iter_shards(info_manager, records, args.shard_size), args.workers):
+        for image_id, annotations in changed:
+            records[image_id].coco_annotations = annotations
+            info_manager.mark_changed(image_id)
+        changed_count += len(changed)
+
+    info_manager.save_annotations()
+    info_manager.close()
+    print(f"Regenerated RLE in {changed_count} of {len(records)} images", file=sys.stderr)
+    return 0
+
+
+def run_export(args) -> int:
+    info_manager, records = load_headless(args.directory, compression=args.compression)
+    info_manager.write_coco()
+    info_manager.close()
+    print(f"Exported {len(records)} images to {COCO_FILES[info_manager.compression]}", file=sys.stderr)
+    return 0
+
+
+# Moves a dataset between coco.json, its compressed forms and annotations.db. A database that is converted away from is
+# kept as annotations.db.bak, since the directory would otherwise go on loading it
+def run_convert(args) -> int:
+    database_path = get_database_path(args.directory)
+    if args.to == "sqlite":
+        if os.path.exists(database_path):
+            raise SystemExit(f"{args.directory} already uses annotations.db")
+        info_manager, records = load_headless(args.directory, backend="sqlite")
+        info_manager.write_database()
+    else:
+        info_manager, records = load_headless(args.directory, compression="" if args.to == "json" else args.to)
+        info_manager.write_coco()
+    info_manager.close()
+
+    if args.to != "sqlite" and os.path.exists(database_path):
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(database_path + suffix):
+                os.remove(database_path + suffix)
+        shutil.move(database_path, database_path + ".bak")
+
+    print(f"Converted {len(records)} images to {args.to}", file=sys.stderr)
+    return 0
+
+
+def run_masks(args) -> int:
+    info_manager, records = load_headless(args.directory)
+    written = MaskExporter(info_manager, args.output, args.workers).export()
+    info_manager.close()
+    print(f"Wrote masks for {written} of {len(records)} images", file=sys.stderr)
+    return 0
+
+
+def run_stats(args) -> int:
+    info_manager, records = load_headless(args.directory)
+    print(json.dumps(info_manager.get_dataset_stats(records), indent=2))
+    info_manager.close()
+    return 0
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="boxer", description="Batch jobs over a boxer directory, without the window")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    validate_parser = subparsers.add_parser("validate", help="check every annotation, printing problems as JSON lines")
+    validate_parser.set_defaults(run=run_validate)
+    rle_parser = subparsers.add_parser("rle", help="regenerate crowd RLE from polygon segmentations")
+    rle_parser.add_argument("--all", action="store_true", help="convert every polygon annotation to RLE")
+    rle_parser.set_defaults(run=run_rle)
+    export_parser = subparsers.add_parser("export", help="write coco.json again, from coco.json or annotations.db")
+    export_parser.add_argument("--compression", choices=["gzip", "lzma"], default=None)
+    export_parser.set_defaults(run=run_export)
+    convert_parser = subparsers.add_parser("convert", help="move the dataset to another format")
+    convert_parser.add_argument("--to", choices=["json", "gzip", "lzma", "sqlite"], required=True)
+    convert_parser.set_defaults(run=run_convert)
+    masks_parser = subparsers.add_parser("masks", help="write instance and class mask PNGs for changed images")
+    masks_parser.add_argument("--output", default=None, help="where to write the masks, .masks by default")
+    masks_parser.set_defaults(run=run_masks)
+    stats_parser = subparsers.add_parser("stats", help="print aggregate counts and sizes")
+    stats_parser.set_defaults(run=run_stats)
+
+    for subparser in (validate_parser, rle_parser, export_parser, convert_parser, masks_parser, stats_parser):
+        subparser.add_argument("directory")
+        subparser.add_argument("--workers", type=int, default=None, help="worker processes, one per core by default")
+        subparser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="images per shard")
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
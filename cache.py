@@ -0,0 +1,222 @@
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+
+# Estimates how many bytes a decoded image holds in memory
+def image_bytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+# Decodes an image from disk, ready to be handed to the canvas
+def decode_image(image_path: str) -> Image.Image:
+    with Image.open(image_path) as image:
+        image.load()
+        return image.copy()
+
+
+# Least recently used cache of decoded images, bounded by the bytes they use rather than how many there are
+class ImageCache:
+    def __init__(self, max_bytes: int = 512 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.images = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def __contains__(self, image_path: str) -> bool:
+        return image_path in self.images
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def get(self, image_path: str) -> Image.Image:
+        image = self.images.get(image_path)
+        if image is not None:
+            self.hits += 1
+            self.images.move_to_end(image_path)
+            return image
+
+        self.misses += 1
+        image = decode_image(image_path)
+        self.put(image_path, image)
+        return image
+
+    def put(self, image_path: str, image: Image.Image):
+        if image_path in self.images:
+            self.current_bytes -= image_bytes(self.images.pop(image_path))
+
+        self.images[image_path] = image
+        self.current_bytes += image_bytes(image)
+        self.evict()
+
+    # Drops the least recently used images until the budget is met, always keeping the most recent one
+    def evict(self):
+        while self.current_bytes > self.max_bytes and len(self.images) > 1:
+            _path, image = self.images.popitem(last=False)
+            size = image_bytes(image)
+            self.current_bytes -= size
+            self.evictions += 1
+            self.evicted_bytes += size
+
+    def resize(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.evict()
+
+    def clear(self):
+        self.images.clear()
+        self.current_bytes = 0
+
+    def get_stats(self) -> dict:
+        return {"images": len(self.images),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes}
+
+
+# Decodes the images around the active one on worker threads, so that Prev / Next rarely has to wait on a decode.
+# Finished images are moved into the cache on the Tk main thread by polling with `after`
+class DecodePrefetcher:
+    def __init__(self, widget, image_cache: ImageCache, ahead: int = 3, behind: int = 1, workers: int = 2,
+                 poll_ms: int = 25):
+        self.widget = widget
+        self.image_cache = image_cache
+        self.ahead = ahead
+        self.behind = behind
+        self.poll_ms = poll_ms
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode")
+        self.jobs = {}
+        self.wanted = set()
+        self.polling = False
+
+        self.lookups = 0
+        self.hits = 0
+
+    # Queues decodes for the images the user is moving towards, and cancels any that are no longer wanted. Images that
+    # are never decoded whole, such as those shown through a tile pyramid, are passed as None and skipped
+    def schedule(self, image_paths: list, pointer: int, direction: int = 1):
+        direction = -1 if direction < 0 else 1
+        wanted = []
+        for step in range(1, self.ahead + 1):
+            wanted.append(pointer + step * direction)
+        for step in range(1, self.behind + 1):
+            wanted.append(pointer - step * direction)
+        wanted = [image_paths[index] for index in wanted if 0 <= index < len(image_paths) and image_paths[index]]
+
+        for image_path, future in list(self.jobs.items()):
+            if image_path not in wanted and future.cancel():
+                del self.jobs[image_path]
+
+        for image_path in wanted:
+            if image_path not in self.jobs and image_path not in self.image_cache:
+                self.jobs[image_path] = self.executor.submit(decode_image, image_path)
+
+        self.wanted = set(wanted)
+        if self.jobs and not self.polling:
+            self.polling = True
+            self.widget.after(self.poll_ms, self.poll)
+
+    def poll(self):
+        for image_path, future in list(self.jobs.items()):
+            if future.done():
+                del self.jobs[image_path]
+                if not future.cancelled() and future.exception() is None and image_path in self.wanted:
+                    self.image_cache.put(image_path, future.result())
+
+        if self.jobs:
+            self.widget.after(self.poll_ms, self.poll)
+        else:
+            self.polling = False
+
+    # Makes sure an image that is about to be shown is in the cache, waiting on its decode if one is in flight
+    def claim(self, image_path: str):
+        self.lookups += 1
+        if image_path in self.image_cache:
+            self.hits += 1
+            return
+
+        future = self.jobs.pop(image_path, None)
+        if future and not future.cancel():
+            try:
+                self.image_cache.put(image_path, future.result())
+                self.hits += 1
+            except OSError:
+                pass
+
+    def cancel(self):
+        for future in self.jobs.values():
+            future.cancel()
+        self.jobs = {}
+        self.wanted = set()
+
+    def hit_rate(self) -> float:
+        if not self.lookups:
+            return 0.0
+        return self.hits / self.lookups
+
+
+# Keeps canvas items alive between images, hidden rather than deleted, so that drawing the next image reconfigures
+# items that already exist instead of creating and destroying thousands of them. Items are pooled by type, and every
+# item the pool hands out carries its tag, so all of them can be hidden in one call
+class CanvasPool:
+    # Options that drawing doesn't always set, put back to their defaults when an item is reused
+    RESET = {"rectangle": {"dash": ""}, "line": {"dash": ""}}
+
+    def __init__(self, canvas, tag: str):
+        self.canvas = canvas
+        self.tag = tag
+        self.kinds = {}
+        self.shown = set()
+        self.free = defaultdict(list)
+
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, kind: str, coords, options: dict) -> int:
+        options = dict(options, tags=tuple(options.get("tags", ())) + (self.tag,))
+        if self.free[kind]:
+            item = self.free[kind].pop()
+            self.canvas.coords(item, *coords)
+            self.canvas.itemconfigure(item, state="normal", **dict(self.RESET.get(kind, {}), **options))
+            self.reused += 1
+        else:
+            item = getattr(self.canvas, f"create_{kind}")(*coords, **options)
+            self.kinds[item] = kind
+            self.created += 1
+
+        self.shown.add(item)
+        return item
+
+    def release(self, item):
+        if item not in self.shown:
+            return
+
+        self.canvas.itemconfigure(item, state="hidden", tags=(self.tag,))
+        self.shown.discard(item)
+        self.free[self.kinds[item]].append(item)
+
+    def release_all(self):
+        if self.shown:
+            self.canvas.itemconfigure(self.tag, state="hidden", tags=(self.tag,))
+        for item in self.shown:
+            self.free[self.kinds[item]].append(item)
+        self.shown = set()
+
+    # Drops track of every item, once the canvas has deleted them itself
+    def forget(self):
+        self.kinds = {}
+        self.shown = set()
+        self.free = defaultdict(list)
+
+    def get_stats(self) -> dict:
+        return {"shown": len(self.shown),
+                "hidden": sum(len(items) for items in self.free.values()),
+                "created": self.created,
+                "reused": self.reused}
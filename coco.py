@@ -0,0 +1,436 @@
+import gzip
+import json
+import lzma
+import os
+import stat
+import tempfile
+
+COCO_FILES = {None: "coco.json",
+              "gzip": "coco.json.gz",
+              "lzma": "coco.json.xz"}
+# What a header section reads as when a coco file written by another tool leaves it out
+HEADER_DEFAULTS = {"info": {}, "licenses": [], "categories": [], "images": []}
+
+
+# Returns the path of whichever coco file a directory holds, preferring the uncompressed one
+def find_coco_path(directory: str):
+    for file_name in COCO_FILES.values():
+        path = os.path.join(directory, file_name)
+        if os.path.exists(path):
+            return path
+
+    return None
+
+
+# Identifies the coco file a directory holds as saved, so that edits journaled against it can tell whether a later save
+# has replaced it. A replaced file is a new inode, which tells the two apart even when mtime and size match
+def coco_signature(directory: str):
+    path = find_coco_path(directory)
+    if not path:
+        return None
+
+    file_stat = os.stat(path)
+    return [file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size]
+
+
+def get_compression(path: str):
+    for compression, file_name in COCO_FILES.items():
+        if path.endswith(file_name):
+            return compression
+
+    return None
+
+
+# Wraps a binary file so that whatever is written to it is compressed to match the coco file name
+def compress_stream(raw_file, compression):
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw_file, mode="wb")
+    elif compression == "lzma":
+        return lzma.LZMAFile(raw_file, mode="wb")
+    else:
+        return raw_file
+
+
+def open_coco(path: str):
+    compression = get_compression(path)
+    if compression == "gzip":
+        return gzip.open(path, "rb")
+    elif compression == "lzma":
+        return lzma.open(path, "rb")
+    else:
+        return open(path, "rb")
+
+
+# Counts the bytes written through it, so that byte offsets can be recorded while streaming
+class CountingStream:
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = 0
+
+    def write(self, data: bytes):
+        self.stream.write(data)
+        self.position += len(data)
+
+    # Writes a value and returns the byte range it occupies
+    def write_range(self, data: bytes) -> list:
+        start = self.position
+        self.write(data)
+        return [start, self.position]
+
+
+# Writes a JSON array one slice at a time, so the whole array is never held as a single string
+def write_array(stream: CountingStream, items, chunk_size: int) -> list:
+    start = stream.position
+    stream.write(b"[")
+    chunk = []
+    separator = b""
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            stream.write(separator + json.dumps(chunk)[1:-1].encode())
+            chunk = []
+            separator = b", "
+    if chunk:
+        stream.write(separator + json.dumps(chunk)[1:-1].encode())
+    stream.write(b"]")
+
+    return [start, stream.position]
+
+
+# Writes the annotations array one image at a time, returning the byte range of each image's annotations
+def write_annotation_groups(stream: CountingStream, annotation_groups) -> dict:
+    ranges = {}
+    stream.write(b"[")
+    separator = b""
+    for image_id, annotations in annotation_groups:
+        if not annotations:
+            continue
+        stream.write(separator)
+        ranges[image_id] = stream.write_range(json.dumps(annotations)[1:-1].encode())
+        separator = b", "
+    stream.write(b"]")
+
+    return ranges
+
+
+# Groups a flat list of annotations by image, for writers that take annotations one image at a time
+def group_annotations(annotations: list) -> list:
+    groups = {}
+    for annotation in annotations:
+        groups.setdefault(annotation["image_id"], []).append(annotation)
+
+    return list(groups.items())
+
+
+def get_index_path(path: str) -> str:
+    return os.path.join(os.path.dirname(path), ".coco_index.json")
+
+
+# The temporary file is made owner-only, so the file it replaces keeps its own mode, and a new one gets the usual mode
+# for the umask
+def get_file_mode(path: str) -> int:
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+# Writes a coco file one chunk of images and one image's annotations at a time into a temporary file, which is synced
+# and then renamed over the old one, so a crash part way through never leaves a half written file behind.
+# Uncompressed files get a `.coco_index.json` sidecar holding the byte range of every section and of each image's
+# annotations, which CocoReader uses to load images without parsing the whole file
+def write_coco_stream(path: str, info: dict, licenses: list, categories: list, images, annotation_groups,
+                      chunk_size: int = 1000):
+    directory = os.path.dirname(path) or "."
+    compression = get_compression(path)
+    file_descriptor, temp_path = tempfile.mkstemp(prefix=".coco-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(file_descriptor, "wb") as raw_file:
+            stream = CountingStream(compress_stream(raw_file, compression))
+            sections = {}
+            stream.write(b'{"info": ')
+            sections["info"] = stream.write_range(json.dumps(info).encode())
+            stream.write(b', "licenses": ')
+            sections["licenses"] = stream.write_range(json.dumps(licenses).encode())
+            stream.write(b', "categories": ')
+            sections["categories"] = stream.write_range(json.dumps(categories).encode())
+            stream.write(b', "images": ')
+            sections["images"] = write_array(stream, images, chunk_size)
+            stream.write(b', "annotations": ')
+            annotation_ranges = write_annotation_groups(stream, annotation_groups)
+            stream.write(b"}")
+            if stream.stream is not raw_file:
+                stream.stream.close()
+
+            raw_file.flush()
+            os.fsync(raw_file.fileno())
+
+        os.chmod(temp_path, get_file_mode(path))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    sync_directory(directory)
+
+    if compression:
+        index_path = get_index_path(path)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        return None
+
+    return write_coco_index(path, os.stat(path), sections, annotation_ranges)
+
+
+# Writes the index of an uncompressed coco file, stamped with the size and mtime the file had when it was read or
+# written
+def write_coco_index(path: str, file_stat: os.stat_result, sections: dict, annotation_ranges: dict) -> dict:
+    index = {"size": file_stat.st_size,
+             "mtime": file_stat.st_mtime_ns,
+             "sections": sections,
+             "annotations": annotation_ranges}
+    with open(get_index_path(path), "w") as index_file:
+        index_file.write(json.dumps(index))
+
+    return index
+
+
+# Makes the rename itself durable, where the platform allows directories to be opened
+def sync_directory(directory: str):
+    try:
+        directory_descriptor = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(directory_descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(directory_descriptor)
+
+
+# Reads the index written alongside an uncompressed coco file, if it still matches the file
+def read_coco_index(path: str):
+    index_path = get_index_path(path)
+    if get_compression(path) or not os.path.exists(index_path):
+        return None
+
+    with open(index_path, "r") as index_file:
+        try:
+            index = json.loads(index_file.read())
+        except ValueError:
+            return None
+
+    stat = os.stat(path)
+    if index["size"] != stat.st_size or index["mtime"] != stat.st_mtime_ns:
+        return None
+
+    return index
+
+
+# Reads a coco file lazily through its index: the header and image list up front, each image's annotations on demand.
+# The file is opened per read, so nothing holds it open while a new version is renamed over it
+class CocoReader:
+    def __init__(self, path: str, index: dict):
+        self.path = path
+        self.sections = index["sections"]
+        self.annotation_ranges = {int(image_id): byte_range for image_id, byte_range in index["annotations"].items()}
+
+    def read_range(self, byte_range: list) -> bytes:
+        with open(self.path, "rb") as coco_file:
+            coco_file.seek(byte_range[0])
+            return coco_file.read(byte_range[1] - byte_range[0])
+
+    def read_header(self) -> dict:
+        return {section: json.loads(self.read_range(self.sections[section])) if section in self.sections else default
+                for section, default in HEADER_DEFAULTS.items()}
+
+    # An image's annotations are one byte range when they sit together in the file, as they do in files written here,
+    # and a list of ranges when another tool spread them out
+    def annotations_for_image(self, image_id: int) -> list:
+        byte_ranges = self.annotation_ranges.get(image_id)
+        if not byte_ranges:
+            return []
+        if not isinstance(byte_ranges[0], list):
+            byte_ranges = [byte_ranges]
+
+        with open(self.path, "rb") as coco_file:
+            parts = []
+            for start, end in byte_ranges:
+                coco_file.seek(start)
+                parts.append(coco_file.read(end - start))
+
+        return json.loads(b"[" + b", ".join(parts) + b"]")
+
+
+# Holds the annotations of a compressed coco file as the JSON text of each image's annotations, which can't be read
+# back from the file without decompressing it again. They are only parsed once their image is asked for
+class MemoryCocoReader:
+    def __init__(self, header: dict, annotation_texts: dict):
+        self.header = header
+        self.annotation_texts = annotation_texts
+
+    def read_header(self) -> dict:
+        return self.header
+
+    def annotations_for_image(self, image_id: int) -> list:
+        parts = self.annotation_texts.get(image_id)
+        if not parts:
+            return []
+
+        return json.loads(b"[" + b", ".join(parts) + b"]")
+
+
+# Walks a coco file once without parsing it whole, finding the byte range of each top level section and of every
+# annotation, which are gathered by image into runs of neighbouring annotations. The file is read in chunks decoded as
+# latin-1, which keeps every character at the byte offset it came from, and each value is parsed with the C decoder
+# as it is reached, so memory stays flat however large the file is. With keep_text the bytes of every section and
+# annotation are kept as well, for files that can't be read from again by offset
+class CocoScanner:
+    def __init__(self, stream, chunk_size: int = 1 << 24, keep_text: bool = False):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.keep_text = keep_text
+        self.decoder = json.JSONDecoder()
+        self.section_texts = {}
+        self.annotation_texts = {}
+
+        self.buffer = ""
+        self.offset = 0
+        self.position = 0
+        self.at_end = False
+
+    # Drops what has been consumed and reads more, at least as much again as is held so a long value is read in few
+    # passes. Returns False at the end of the file
+    def fill(self) -> bool:
+        data = self.stream.read(max(self.chunk_size, len(self.buffer) - self.position))
+        if not data:
+            self.at_end = True
+            return False
+
+        self.offset += self.position
+        self.buffer = self.buffer[self.position:] + data.decode("latin-1")
+        self.position = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in " \t\r\n":
+                self.position += 1
+            if self.position < len(self.buffer) or not self.fill():
+                break
+
+        return self.buffer[self.position:self.position + 1]
+
+    def expect(self, character: str):
+        if self.peek() != character:
+            raise ValueError(f"Expected {character!r} at byte {self.offset + self.position} of the coco file")
+        self.position += 1
+
+    # Parses the next value, returning it with its byte range. A value that runs into the end of the buffer may be cut
+    # short, so it is parsed again once more has been read
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                if end < len(self.buffer) or self.at_end:
+                    break
+            except json.JSONDecodeError:
+                if self.at_end:
+                    raise
+            if not self.fill():
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                break
+
+        byte_range = [self.offset + self.position, self.offset + end]
+        self.position = end
+        return value, byte_range
+
+    # The bytes of the value just parsed, which are still in the buffer until more is read
+    def text(self, byte_range: list) -> bytes:
+        return self.buffer[byte_range[0] - self.offset:byte_range[1] - self.offset].encode("latin-1")
+
+    # Runs over the annotations array, yielding (image_id, byte_range) for each annotation
+    def iter_annotations(self):
+        self.expect("[")
+        if self.peek() == "]":
+            self.position += 1
+            return
+        while True:
+            annotation, byte_range = self.value()
+            yield annotation["image_id"], byte_range
+            if self.peek() == "]":
+                self.position += 1
+                return
+            self.expect(",")
+
+    # Returns the byte range of every section, and the byte ranges of each image's annotations by image id. An image
+    # whose annotations all sit together has a single range
+    def scan(self):
+        sections = {}
+        annotation_ranges = {}
+        self.expect("{")
+        while self.peek() != "}":
+            key, _key_range = self.value()
+            self.expect(":")
+            if key == "annotations":
+                last_image_id = None
+                for image_id, byte_range in self.iter_annotations():
+                    ranges = annotation_ranges.setdefault(image_id, [])
+                    if image_id == last_image_id:
+                        ranges[-1][1] = byte_range[1]
+                    else:
+                        ranges.append(byte_range)
+                    last_image_id = image_id
+                    if self.keep_text:
+                        self.annotation_texts.setdefault(image_id, []).append(self.text(byte_range))
+            else:
+                _value, sections[key] = self.value()
+                if self.keep_text:
+                    self.section_texts[key] = self.text(sections[key])
+            if self.peek() == ",":
+                self.position += 1
+
+        annotation_ranges = {image_id: ranges[0] if len(ranges) == 1 else ranges
+                             for image_id, ranges in annotation_ranges.items()}
+        return sections, annotation_ranges
+
+
+# Scans a compressed coco file into a MemoryCocoReader as it is decompressed. The header sections are parsed again from
+# their own bytes, since the scanner reads text as latin-1 and only the annotation image ids are taken from what it
+# parsed
+def read_compressed_coco(path: str) -> MemoryCocoReader:
+    with open_coco(path) as coco_file:
+        scanner = CocoScanner(coco_file, keep_text=True)
+        scanner.scan()
+
+    header = {section: json.loads(scanner.section_texts[section]) if section in scanner.section_texts else default
+              for section, default in HEADER_DEFAULTS.items()}
+    return MemoryCocoReader(header, scanner.annotation_texts)
+
+
+# Opens a coco file through its index. An uncompressed file without one, such as one written by another tool, is
+# scanned once and indexed there and then, so only its first open reads the whole file
+def open_coco_reader(path: str):
+    if get_compression(path):
+        return read_compressed_coco(path)
+
+    index = read_coco_index(path)
+    if index:
+        return CocoReader(path, index)
+
+    file_stat = os.stat(path)
+    with open(path, "rb") as coco_file:
+        sections, annotation_ranges = CocoScanner(coco_file).scan()
+    index = {"sections": sections, "annotations": annotation_ranges}
+    if os.stat(path).st_mtime_ns == file_stat.st_mtime_ns:
+        try:
+            index = write_coco_index(path, file_stat, sections, annotation_ranges)
+        except OSError:
+            pass
+
+    return CocoReader(path, index)
@@ -0,0 +1,153 @@
+from contextlib import contextmanager
+import json
+import os
+import sqlite3
+
+DATABASE_FILE = "annotations.db"
+KNOWN_FIELDS = {"id", "image_id", "category_id", "segmentation", "area", "bbox", "iscrowd"}
+
+# The bbox and area columns are left untyped so that SQLite keeps ints as ints and floats as floats
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS header (section TEXT PRIMARY KEY, content TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS images (id INTEGER PRIMARY KEY, file_name TEXT NOT NULL, width INTEGER, height INTEGER,
+                                   license, date_captured TEXT);
+CREATE TABLE IF NOT EXISTS categories (id INTEGER PRIMARY KEY, name TEXT NOT NULL, supercategory TEXT);
+CREATE TABLE IF NOT EXISTS annotations (id INTEGER PRIMARY KEY, image_id INTEGER NOT NULL, category_id INTEGER NOT NULL,
+                                        segmentation TEXT NOT NULL, area, x, y, width, height,
+                                        iscrowd INTEGER NOT NULL, extra TEXT);
+CREATE INDEX IF NOT EXISTS annotations_image ON annotations (image_id);
+CREATE INDEX IF NOT EXISTS annotations_category ON annotations (category_id);
+"""
+
+
+def get_database_path(directory: str) -> str:
+    return os.path.join(directory, DATABASE_FILE)
+
+
+def annotation_to_row(image_id: int, annotation: dict) -> tuple:
+    extra = {key: value for key, value in annotation.items() if key not in KNOWN_FIELDS}
+    return (image_id, annotation["category_id"], json.dumps(annotation["segmentation"]), annotation["area"],
+            *annotation["bbox"], int(annotation["iscrowd"]), json.dumps(extra) if extra else None)
+
+
+def row_to_annotation(row: tuple) -> dict:
+    annotation_id, image_id, category_id, segmentation, area, x, y, width, height, iscrowd, extra = row
+    annotation = {"id": annotation_id,
+                  "image_id": image_id,
+                  "category_id": category_id,
+                  "segmentation": json.loads(segmentation),
+                  "area": area,
+                  "bbox": [x, y, width, height],
+                  "iscrowd": bool(iscrowd)}
+    if extra:
+        annotation.update(json.loads(extra))
+
+    return annotation
+
+
+ANNOTATION_COLUMNS = "id, image_id, category_id, segmentation, area, x, y, width, height, iscrowd, extra"
+
+
+# Keeps a dataset in `annotations.db` instead of one coco.json, for datasets too large to rewrite on every save. The
+# database runs in WAL mode so that reads carry on while a save is being written, and each image's annotations are
+# replaced in a transaction of their own. It has the same read_header / annotations_for_image interface as the coco
+# readers, and coco.json is only written from it as an export
+class AnnotationDatabase:
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    @contextmanager
+    def transaction(self):
+        with self.connection:
+            yield self.connection
+
+    def is_empty(self) -> bool:
+        return self.connection.execute("SELECT NOT EXISTS (SELECT 1 FROM images)").fetchone()[0] == 1
+
+    def read_header(self) -> dict:
+        header = {"info": {}, "licenses": []}
+        for section, content in self.connection.execute("SELECT section, content FROM header"):
+            header[section] = json.loads(content)
+
+        categories = self.connection.execute("SELECT id, name, supercategory FROM categories ORDER BY id")
+        header["categories"] = [{"id": category_id, "name": name, "supercategory": supercategory}
+                                for category_id, name, supercategory in categories]
+        header["images"] = [{"id": image_id,
+                             "width": width,
+                             "height": height,
+                             "file_name": file_name,
+                             "license": license_id,
+                             "date_captured": date_captured}
+                            for image_id, file_name, width, height, license_id, date_captured
+                            in self.connection.execute("SELECT id, file_name, width, height, license, date_captured "
+                                                       "FROM images ORDER BY id")]
+
+        return header
+
+    # Replaces the info, licenses, categories and image list in one transaction
+    def write_header(self, info: dict, licenses: list, categories: list, images: list):
+        with self.transaction() as connection:
+            connection.executemany("INSERT OR REPLACE INTO header VALUES (?, ?)",
+                                   [("info", json.dumps(info)), ("licenses", json.dumps(licenses))])
+            connection.execute("DELETE FROM categories")
+            connection.executemany("INSERT INTO categories VALUES (?, ?, ?)",
+                                   [(category["id"], category["name"], category["supercategory"])
+                                    for category in categories])
+            connection.execute("DELETE FROM images WHERE id >= ?", (len(images),))
+            connection.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)",
+                                   [(image["id"], image["file_name"], image["width"], image["height"],
+                                     image["license"], image["date_captured"]) for image in images])
+
+    def annotations_for_image(self, image_id: int) -> list:
+        rows = self.connection.execute(f"SELECT {ANNOTATION_COLUMNS} FROM annotations WHERE image_id = ? ORDER BY id",
+                                       (image_id,))
+        return [row_to_annotation(row) for row in rows]
+
+    # Swaps out every annotation of one image, as a single transaction
+    def replace_image_annotations(self, image_id: int, annotations: list):
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM annotations WHERE image_id = ?", (image_id,))
+            connection.executemany("INSERT INTO annotations (image_id, category_id, segmentation, area, x, y, width, "
+                                   "height, iscrowd, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   [annotation_to_row(image_id, annotation) for annotation in annotations])
+
+    # Points every annotation of a merged category at the category it was merged into
+    def merge_category(self, old_id: int, new_id: int):
+        with self.transaction() as connection:
+            connection.execute("UPDATE annotations SET category_id = ? WHERE category_id = ?", (new_id, old_id))
+
+    def category_ids(self) -> list:
+        return [row[0] for row in self.connection.execute("SELECT DISTINCT category_id FROM annotations")]
+
+    def count_annotations(self, image_id: int = None, category_id: int = None) -> int:
+        query = ("SELECT COUNT(*) FROM annotations "
+                 "WHERE (?1 IS NULL OR image_id = ?1) AND (?2 IS NULL OR category_id = ?2)")
+        return self.connection.execute(query, (image_id, category_id)).fetchone()[0]
+
+    # Yields (image_id, annotations) for every image with annotations, in image order, reading a batch of rows at a
+    # time so the table is never loaded whole
+    def iter_annotation_groups(self, batch_size: int = 10000):
+        cursor = self.connection.execute(f"SELECT {ANNOTATION_COLUMNS} FROM annotations ORDER BY image_id, id")
+        image_id = None
+        annotations = []
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                if row[1] != image_id:
+                    if annotations:
+                        yield image_id, annotations
+                    image_id = row[1]
+                    annotations = []
+                annotations.append(row_to_annotation(row))
+
+        if annotations:
+            yield image_id, annotations
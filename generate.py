@@ -0,0 +1,222 @@
+from PIL import Image, ImageDraw
+import argparse
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+from coco import COCO_FILES, write_coco_stream
+from geometry import check_polygon_intersections
+from masks import make_category_colours
+from operations import polygon_area, polygons_to_rle, rle_to_string
+from pool import iter_chunks, map_ordered
+
+# The editor's own five colours come first, so that small datasets look as they would have been drawn in it
+COLOURS = ("blue", "lime green", "yellow", "red", "deep pink", "orange", "cyan", "purple", "dark green", "saddle brown",
+           "gold", "navy", "turquoise", "magenta", "olive drab", "salmon", "slate gray", "dark orange", "orchid",
+           "steel blue")
+
+# Every image and the dataset itself carry the same fixed date, so that the same seed always writes the same files
+DATE = "2020-01-01"
+
+
+# Reads "8" as (8, 8) and "8-64" as (8, 64)
+def parse_range(text: str) -> tuple:
+    low, _separator, high = text.partition("-")
+    low = int(low)
+    high = int(high) if high else low
+    if low < 0 or high < low:
+        raise argparse.ArgumentTypeError(f"{text} is not a count or a low-high range")
+
+    return low, high
+
+
+def make_categories(category_count: int) -> list:
+    return [{"id": category_id, "name": f"category {category_id}", "supercategory": None}
+            for category_id in range(category_count)]
+
+
+# Maps colour to label as .colour_map.json does. Categories past the end of the palette are left to the default colour
+def make_colour_map(categories: list) -> dict:
+    return {colour: category["name"] for colour, category in zip(COLOURS, categories)}
+
+
+# A star shaped polygon inside the image, with one vertex in each of vertex_count equal slices around its centre so
+# that it never crosses itself. Rounding to whole pixels can still fold a tight one over, so those are drawn again,
+# with less jitter each time, until the validator would pass them
+def make_polygon(generator, radius: float, vertex_count: int, width: int, height: int) -> list:
+    radius = min(max(radius, vertex_count / 2), (min(width, height) - 1) / 2)
+    centre_x = generator.uniform(radius, width - radius)
+    centre_y = generator.uniform(radius, height - radius)
+    for jitter in (0.8, 0.4, 0.1, 0):
+        angles = 2 * math.pi * (np.arange(vertex_count) + jitter * generator.random(vertex_count)) / vertex_count
+        radii = radius * (1 - jitter * 0.6 * generator.random(vertex_count))
+        points = np.rint(np.column_stack((centre_x + radii * np.cos(angles), centre_y + radii * np.sin(angles))))
+        points = points[np.any(points != np.roll(points, 1, axis=0), axis=1)]
+        vertices = points.astype(np.int64).ravel().tolist()
+        if len(points) >= 3 and not check_polygon_intersections(vertices):
+            break
+
+    return vertices
+
+
+def polygons_bbox(polygons: list) -> list:
+    xs = [x for vertices in polygons for x in vertices[::2]]
+    ys = [y for vertices in polygons for y in vertices[1::2]]
+    return [min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys)]
+
+
+# Makes the annotations of one image from its own generator, seeded by the dataset seed and the image id, so that an
+# image comes out the same whichever worker makes it. Crowds are two or three polygons joined into one RLE mask, the
+# way the editor saves an annotation with several polygons
+def make_annotations(generator, settings: dict) -> list:
+    width, height = settings["width"], settings["height"]
+    annotations = []
+    for _index in range(generator.integers(settings["annotations"][0], settings["annotations"][1] + 1)):
+        is_crowd = bool(generator.random() < settings["crowd_ratio"])
+        radius = generator.uniform(0.03, 0.2) * min(width, height)
+        polygons = []
+        for _polygon in range(generator.integers(2, 4) if is_crowd else 1):
+            vertex_count = int(generator.integers(max(settings["vertices"][0], 3), max(settings["vertices"][1], 3) + 1))
+            polygons.append(make_polygon(generator, radius, vertex_count, width, height))
+
+        if is_crowd:
+            counts = polygons_to_rle(polygons, width, height)
+            segmentation = {"counts": rle_to_string(counts), "size": [height, width]}
+            area = sum(counts[1::2])
+        else:
+            segmentation = polygons[0]
+            area = polygon_area(polygons[0])
+
+        annotations.append({"id": None,
+                            "image_id": None,
+                            "category_id": int(generator.integers(settings["categories"])),
+                            "segmentation": segmentation,
+                            "area": area,
+                            "bbox": polygons_bbox(polygons),
+                            "iscrowd": is_crowd,
+                            "polygons": polygons})
+
+    return annotations
+
+
+# Paints a smooth background, upscaled from a few random pixels, with every annotation's polygons filled in its
+# category's colour on top
+def draw_image(generator, annotations: list, settings: dict, path: str):
+    width, height = settings["width"], settings["height"]
+    background = generator.integers(96, 224, (4, 4, 3), dtype=np.uint8)
+    image = Image.fromarray(background, mode="RGB").resize((width, height), Image.BILINEAR)
+    draw = ImageDraw.Draw(image)
+    for annotation in annotations:
+        colour = settings["colours"][annotation["category_id"]]
+        for vertices in annotation["polygons"]:
+            draw.polygon(vertices, fill=colour, outline=(0, 0, 0))
+    image.save(path, quality=85)
+
+
+# Makes and draws one image, returning its annotations. Takes and returns plain values so that it can run in a worker
+def generate_image(image_id: int, settings: dict) -> list:
+    generator = np.random.default_rng([settings["seed"], image_id])
+    annotations = make_annotations(generator, settings)
+    draw_image(generator, annotations, settings, os.path.join(settings["directory"], image_file_name(image_id)))
+    for annotation in annotations:
+        del annotation["polygons"]
+
+    return annotations
+
+
+def generate_chunk(job: tuple) -> list:
+    image_ids, settings = job
+    return [generate_image(image_id, settings) for image_id in image_ids]
+
+
+def image_file_name(image_id: int) -> str:
+    return f"{image_id:08}.jpg"
+
+
+# Writes a synthetic dataset into a directory: the drawn images, coco.json (or a compressed form of it) and
+# .colour_map.json, laid out as the editor reads them. Images are drawn across a process pool and their annotations
+# streamed into the coco file in image order, so memory stays flat however large the dataset is. Returns how many
+# annotations were written
+def generate_dataset(directory: str, image_count: int, width: int = 640, height: int = 480,
+                     annotations: tuple = (5, 15), vertices: tuple = (8, 32), crowd_ratio: float = 0.1,
+                     category_count: int = 5, seed: int = 0, compression: str = None, workers: int = None,
+                     chunk_size: int = 16) -> int:
+    os.makedirs(directory, exist_ok=True)
+    categories = make_categories(category_count)
+    colour_map = make_colour_map(categories)
+    settings = {"directory": directory,
+                "width": width,
+                "height": height,
+                "annotations": annotations,
+                "vertices": vertices,
+                "crowd_ratio": crowd_ratio,
+                "categories": category_count,
+                "seed": seed,
+                "colours": make_category_colours(categories, colour_map)}
+
+    # The editor shows every field in an entry box, so they are all strings as it writes them itself
+    info = {"year": DATE[:4],
+            "version": "1.0",
+            "description": f"Synthetic dataset, seed {seed}",
+            "contributor": "generate.py",
+            "url": "",
+            "date_created": DATE}
+    images = [{"id": image_id,
+               "width": width,
+               "height": height,
+               "file_name": image_file_name(image_id),
+               "license": None,
+               "date_captured": DATE} for image_id in range(image_count)]
+
+    annotation_count = 0
+
+    def iter_groups():
+        nonlocal annotation_count
+        jobs = ((image_ids, settings) for image_ids in iter_chunks(range(image_count), chunk_size))
+        image_id = 0
+        for chunk in map_ordered(generate_chunk, jobs, workers):
+            for image_annotations in chunk:
+                for annotation in image_annotations:
+                    annotation["id"] = annotation_count
+                    annotation["image_id"] = image_id
+                    annotation_count += 1
+                yield image_id, image_annotations
+                image_id += 1
+
+    write_coco_stream(os.path.join(directory, COCO_FILES[compression]), info, [], categories, images, iter_groups())
+    with open(os.path.join(directory, ".colour_map.json"), "w") as colour_file:
+        colour_file.write(json.dumps(colour_map))
+
+    return annotation_count
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Write a synthetic dataset of drawn images and their annotations")
+    parser.add_argument("directory")
+    parser.add_argument("--images", type=int, default=1000)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--annotations", type=parse_range, default=(5, 15), help="per image, as N or LOW-HIGH")
+    parser.add_argument("--vertices", type=parse_range, default=(8, 32), help="per polygon, as N or LOW-HIGH")
+    parser.add_argument("--crowd-ratio", type=float, default=0.1, help="fraction of annotations that are crowds")
+    parser.add_argument("--categories", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compression", choices=["gzip", "lzma"], default=None)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, one per core by default")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(os.path.join(args.directory, "annotations.db")):
+        raise SystemExit(f"{args.directory} already uses annotations.db, which would be loaded instead")
+
+    annotation_count = generate_dataset(args.directory, args.images, args.width, args.height, args.annotations,
+                                        args.vertices, args.crowd_ratio, args.categories, args.seed, args.compression,
+                                        args.workers)
+    print(f"Wrote {args.images} images and {annotation_count} annotations to {args.directory}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
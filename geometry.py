@@ -0,0 +1,333 @@
+from collections import defaultdict
+
+from operations import check_intersection
+
+
+# Two segments that continue on from one another share a vertex, which isn't a self-intersection
+def is_connected(p1, p2, p3, p4) -> bool:
+    return p1 == p4 or p2 == p3
+
+
+# Yields the grid cells that a segment passes through, one column of cells at a time
+def segment_cells(p1, p2, cell_size: int):
+    (x_1, y_1), (x_2, y_2) = sorted((p1, p2))
+    first_column = int(x_1 // cell_size)
+    last_column = int(x_2 // cell_size)
+    for column in range(first_column, last_column + 1):
+        if x_1 == x_2:
+            low_y, high_y = min(y_1, y_2), max(y_1, y_2)
+        else:
+            left = max(x_1, column * cell_size)
+            right = min(x_2, (column + 1) * cell_size)
+            left_y = y_1 + (left - x_1) * (y_2 - y_1) / (x_2 - x_1)
+            right_y = y_1 + (right - x_1) * (y_2 - y_1) / (x_2 - x_1)
+            low_y, high_y = min(left_y, right_y), max(left_y, right_y)
+
+        for row in range(int(low_y // cell_size), int(high_y // cell_size) + 1):
+            yield column, row
+
+
+# Indexes the segments of a polygon that is being drawn in a uniform grid, so that checking a new segment only looks at
+# the segments that share a cell with it. Segments are added and removed in stack order, following undo / redo
+class SegmentGrid:
+    def __init__(self, cell_size: int = 32):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        self.segments = []
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def add(self, p1, p2):
+        p1, p2 = tuple(p1), tuple(p2)
+        cells = list(segment_cells(p1, p2, self.cell_size))
+        for cell in cells:
+            self.cells[cell].append(len(self.segments))
+        self.segments.append((p1, p2, cells))
+
+    def pop(self):
+        p1, p2, cells = self.segments.pop()
+        for cell in cells:
+            self.cells[cell].pop()
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def candidates(self, p1, p2) -> set:
+        found = set()
+        for cell in segment_cells(tuple(p1), tuple(p2), self.cell_size):
+            found.update(self.cells.get(cell, ()))
+
+        return found
+
+    # Checks a segment against the indexed ones with the same rules as Polygon.check_invalid always used
+    def intersects(self, p1, p2) -> bool:
+        p1, p2 = tuple(p1), tuple(p2)
+        for index in self.candidates(p1, p2):
+            p3, p4, _cells = self.segments[index]
+            if not is_connected(p1, p2, p3, p4) and check_intersection(p1, p2, p3, p4):
+                return True
+
+        return False
+
+
+# Compares where two segments cross the vertical line at x, exactly, breaking ties by slope. Segments are stored left
+# to right, with vertical ones ordered by their lower end and treated as steeper than any other
+def compare_at(a, b, x: int) -> int:
+    (ax_1, ay_1), (ax_2, ay_2) = a
+    (bx_1, by_1), (bx_2, by_2) = b
+    a_dx, b_dx = ax_2 - ax_1, bx_2 - bx_1
+    a_num = ay_1 * a_dx + (x - ax_1) * (ay_2 - ay_1) if a_dx else min(ay_1, ay_2)
+    b_num = by_1 * b_dx + (x - bx_1) * (by_2 - by_1) if b_dx else min(by_1, by_2)
+    a_den, b_den = a_dx or 1, b_dx or 1
+
+    difference = a_num * b_den - b_num * a_den
+    if difference:
+        return 1 if difference > 0 else -1
+
+    if not a_dx or not b_dx:
+        return (not a_dx) - (not b_dx)
+    slope_difference = (ay_2 - ay_1) * b_dx - (by_2 - by_1) * a_dx
+    return (slope_difference > 0) - (slope_difference < 0)
+
+
+# Keeps the edges that cross the sweep line in order, split into short sorted blocks so that adding or removing one only
+# moves the rest of its block rather than every edge above it. Each edge is linked to its neighbours and remembers its
+# block, so removing one takes no comparisons
+class SweepStatus:
+    def __init__(self, block_size: int = 256):
+        self.block_size = block_size
+        self.blocks = []
+        self.block_of = {}
+        self.below = {}
+        self.above = {}
+
+    def __len__(self) -> int:
+        return len(self.block_of)
+
+    # Places an edge before the first one that compare(other) does not put below it, as a bisect over the whole order
+    # would, and links it between its neighbours
+    def insert(self, edge, compare):
+        if self.blocks:
+            block_number = max(self.bisect(self.blocks, lambda block: compare(block[0])) - 1, 0)
+            block = self.blocks[block_number]
+            position = self.bisect(block, compare)
+        else:
+            block_number, block, position = 0, [], 0
+            self.blocks.append(block)
+        block.insert(position, edge)
+        self.block_of[edge] = block
+
+        if position > 0:
+            below = block[position - 1]
+        else:
+            below = self.blocks[block_number - 1][-1] if block_number > 0 else None
+        if position + 1 < len(block):
+            above = block[position + 1]
+        else:
+            above = self.blocks[block_number + 1][0] if block_number + 1 < len(self.blocks) else None
+        self.link(below, edge)
+        self.link(edge, above)
+
+        if len(block) > 2 * self.block_size:
+            split = block[self.block_size:]
+            del block[self.block_size:]
+            self.blocks.insert(block_number + 1, split)
+            for moved in split:
+                self.block_of[moved] = split
+
+    # Takes an edge out of the order, returning the neighbours that now sit next to each other
+    def remove(self, edge) -> tuple:
+        block = self.block_of.pop(edge)
+        block.remove(edge)
+        if not block:
+            self.blocks = [other for other in self.blocks if other is not block]
+
+        below, above = self.below.pop(edge), self.above.pop(edge)
+        self.link(below, above)
+        return below, above
+
+    def link(self, below, above):
+        if below is not None:
+            self.above[below] = above
+        if above is not None:
+            self.below[above] = below
+
+    @staticmethod
+    def bisect(items: list, compare) -> int:
+        low, high = 0, len(items)
+        while low < high:
+            middle = (low + high) // 2
+            if compare(items[middle]) < 0:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+# Finds whether any two edges of a closed polygon cross, with a Shamos-Hoey sweep in O(N log N) comparisons.
+# Edges are swept left to right and only checked against their neighbours in the sweep order, stopping at the first hit.
+# It follows the same rules as Polygon.check_invalid, where edges that continue on from one another never cross
+def check_polygon_intersections(vertices: list) -> bool:
+    points = list(zip(vertices[::2], vertices[1::2]))
+    if len(points) < 4:
+        return False
+
+    edges = [(points[i], points[(i + 1) % len(points)]) for i in range(len(points))]
+    ordered = [tuple(sorted(edge)) for edge in edges]
+
+    events = []
+    for index, (left, right) in enumerate(ordered):
+        events.append((left[0], 0, left[1], index))
+        events.append((right[0], 1, right[1], index))
+    events.sort()
+
+    def connected(a: int, b: int) -> bool:
+        return is_connected(edges[a][0], edges[a][1], edges[b][0], edges[b][1])
+
+    def crosses(a: int, b: int) -> bool:
+        return not connected(a, b) and check_intersection(edges[a][0], edges[a][1], edges[b][0], edges[b][1])
+
+    # Edges that are connected to one another or overlap along the same line can hide a crossing behind them, so the
+    # walk out from a neighbour carries on past any edge that does either with the one it started from
+    def walk(neighbour, links: dict, origin: int, x: int):
+        while neighbour is not None:
+            yield neighbour
+            if not connected(origin, neighbour) and compare_at(ordered[origin], ordered[neighbour], x):
+                return
+            neighbour = links[neighbour]
+
+    status = SweepStatus()
+    for x, is_removal, _y, index in events:
+        if not is_removal:
+            status.insert(index, lambda other: compare_at(ordered[other], ordered[index], x))
+            below, above = status.below[index], status.above[index]
+            for neighbour in list(walk(below, status.below, index, x)) + list(walk(above, status.above, index, x)):
+                if crosses(index, neighbour):
+                    return True
+        else:
+            below, above = status.remove(index)
+            if below is not None and above is not None:
+                for neighbour in walk(above, status.above, below, x):
+                    if crosses(below, neighbour):
+                        return True
+                for neighbour in walk(below, status.below, above, x):
+                    if crosses(above, neighbour):
+                        return True
+
+    return False
+
+
+# Checks every polygon of a dataset, returning the positions of the ones that cross themselves
+def validate_all_polygons(polygons) -> list:
+    return [index for index, vertices in enumerate(polygons) if check_polygon_intersections(vertices)]
+
+
+# Yields the grid cells covered by an extent of [min_x, min_y, max_x, max_y]
+def extent_cells(extent: list, cell_size: int):
+    for column in range(int(extent[0] // cell_size), int(extent[2] // cell_size) + 1):
+        for row in range(int(extent[1] // cell_size), int(extent[3] // cell_size) + 1):
+            yield column, row
+
+
+# Orders the corners of a box so that its start is always the top left
+def normalise_extent(coords: list) -> list:
+    return [min(coords[0], coords[2]), min(coords[1], coords[3]), max(coords[0], coords[2]), max(coords[1], coords[3])]
+
+
+# Indexes the extents of the annotations on an image in a uniform grid, so that finding what is under the cursor only
+# looks at the annotations sharing a cell with it. Annotations added later sit on top of earlier ones, as on the canvas
+class SpatialIndex:
+    def __init__(self, cell_size: int = 64):
+        self.cell_size = cell_size
+        self.cells = defaultdict(set)
+        self.entries = {}
+        self.counter = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self.entries
+
+    def insert(self, key, coords: list):
+        if key in self.entries:
+            self.update(key, coords)
+            return
+
+        extent = normalise_extent(coords)
+        for cell in extent_cells(extent, self.cell_size):
+            self.cells[cell].add(key)
+        self.entries[key] = (extent, self.counter)
+        self.counter += 1
+
+    def remove(self, key):
+        extent, _order = self.entries.pop(key)
+        for cell in extent_cells(extent, self.cell_size):
+            self.cells[cell].discard(key)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    # Moves an entry to a new extent, keeping its place in the stacking order
+    def update(self, key, coords: list):
+        _extent, order = self.entries[key]
+        self.remove(key)
+        extent = normalise_extent(coords)
+        for cell in extent_cells(extent, self.cell_size):
+            self.cells[cell].add(key)
+        self.entries[key] = (extent, order)
+
+    def clear(self):
+        self.cells = defaultdict(set)
+        self.entries = {}
+
+    # Returns the keys whose extent holds the point, within a tolerance, topmost first
+    def query_point(self, x: int, y: int, tolerance: int = 0) -> list:
+        candidates = set()
+        for cell in extent_cells([x - tolerance, y - tolerance, x + tolerance, y + tolerance], self.cell_size):
+            candidates.update(self.cells.get(cell, ()))
+
+        found = []
+        for key in candidates:
+            extent, order = self.entries[key]
+            min_x, min_y, max_x, max_y = extent
+            if min_x - tolerance <= x <= max_x + tolerance and min_y - tolerance <= y <= max_y + tolerance:
+                found.append((order, key))
+        found.sort(key=lambda item: item[0], reverse=True)
+
+        return [key for _order, key in found]
+
+
+# Maps full resolution image coordinates to canvas coordinates and back, for a zoom and a pan. Annotations are kept in
+# image space and only pass through the transform on their way to and from the canvas
+class ViewTransform:
+    def __init__(self, scale: float = 1.0, offset_x: float = 0.0, offset_y: float = 0.0):
+        self.scale = scale
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+
+    def copy(self):
+        return ViewTransform(self.scale, self.offset_x, self.offset_y)
+
+    def to_canvas(self, x: float, y: float) -> tuple:
+        return x * self.scale - self.offset_x, y * self.scale - self.offset_y
+
+    def to_image(self, x: float, y: float) -> tuple:
+        return (x + self.offset_x) / self.scale, (y + self.offset_y) / self.scale
+
+    # Transforms a flat list of x, y coordinates
+    def coords_to_canvas(self, coords) -> list:
+        return [value * self.scale - (self.offset_y if i % 2 else self.offset_x) for i, value in enumerate(coords)]
+
+    def coords_to_image(self, coords) -> list:
+        return [(value + (self.offset_y if i % 2 else self.offset_x)) / self.scale for i, value in enumerate(coords)]
+
+    # Zooms by a factor while keeping the image point under the canvas point (x, y) where it is
+    def zoom_at(self, factor: float, x: float, y: float):
+        image_x, image_y = self.to_image(x, y)
+        self.scale *= factor
+        self.offset_x = image_x * self.scale - x
+        self.offset_y = image_y * self.scale - y
+
+    def pan(self, delta_x: float, delta_y: float):
+        self.offset_x -= delta_x
+        self.offset_y -= delta_y
@@ -1,22 +1,54 @@
-from tkinter import filedialog
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date
 import json
 import os
 
-from operations import vertices_to_rle
+import numpy as np
 
+from coco import COCO_FILES, coco_signature, find_coco_path, get_compression, open_coco_reader, write_coco_stream
+from database import AnnotationDatabase, get_database_path
+from journal import AnnotationJournal
+from metadata import MetadataIndex
+from operations import encode_crowd_annotations, polygon_areas, rle_from_string
+from scanner import find_images, HeaderScanner
+from store import AnnotationStore
 
+
+# Annotations are saved to coco.json, or with the "sqlite" backend to annotations.db, which coco.json is then only
+# exported from. A directory that already has annotations.db always uses it
 class InfoManager:
-    def __init__(self):
+    def __init__(self, compression: str = None, backend: str = None, workers: int = None):
         self.directory = None
         self.valid = False
         self.colour_map = {}
+        self.metadata_index = None
+        self.journal = None
+        self.compression = compression
+        self.backend = backend
+        self.database = None
+        self.category_index = {}
+        self.category_aliases = {}
+        self.next_category_id = 0
+
+        # Annotations are never held for the whole dataset as objects. Until the first save, untouched images are read
+        # from the opened coco file through the reader. From then on they are held as columns in the store, and
+        # everything else comes from the editable images passed to bulk_populate_fields
+        self.coco_reader = None
+        self.store = None
+        self.exported_images = []
+        self.changed_images = set()
+        self.unstored_images = set()
+        # Images whose annotations changed since the store was built, whose rows in it can't be reused
+        self.unstored_images = set()
+
+        # Crowd RLE is encoded across this pool when many images need it at once, started on first use
+        self.workers = workers
+        self.executor = None
 
         self.info = {}
         self.licenses = []
         self.categories = []
         self.images = []
-        self.annotations = []
 
     def set_valid(self, valid: bool):
         self.valid = valid
@@ -26,11 +58,41 @@ class InfoManager:
         self.licenses = []
         self.categories = []
         self.images = []
-        self.annotations = []
+        self.exported_images = []
+        self.changed_images = set()
 
     def activate(self, directory: str):
         self.directory = directory
         self.clear_fields()
+        self.coco_reader = None
+        self.store = None
+        self.category_index = {}
+        self.category_aliases = {}
+        self.next_category_id = 0
+        self.metadata_index = MetadataIndex(directory)
+        self.metadata_index.read()
+        if self.database:
+            self.database.close()
+            self.database = None
+        database_path = get_database_path(directory)
+        if self.backend == "sqlite" or os.path.exists(database_path):
+            self.database = AnnotationDatabase(database_path)
+
+        # The database saves each image in a transaction of its own rather than replacing one file, so only the coco
+        # file is signed
+        if self.journal:
+            self.journal.close()
+        signature = None if self.database else lambda: coco_signature(directory)
+        self.journal = AnnotationJournal(directory, signature=signature)
+
+    def close(self):
+        if self.journal:
+            self.journal.close()
+        if self.database:
+            self.database.close()
+        if self.executor:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
 
     def populate_info(self, year: int, version: str, description: str, contributor: str, url: str):
         self.info = {"year": year,
@@ -43,66 +105,199 @@ class InfoManager:
     # TODO: Handle annotation iscrowd
     # TODO: Handle category supercategory
 
-    # Fills all possible fields based on accessible information
-    def bulk_populate_fields(self, editable_images: list):
-        self.clear_fields()
-        image_counter = 0
-        annotation_counter = 0
-        category_counter = 0
-
-        present_categories = []
-        category_id_map = {}
-
-        for editable_image in editable_images:
-            for annotation in editable_image.annotations:
-                coords = annotation.bbox.get_coords()
-                bbox = [coords[0], coords[1], coords[2]-coords[0], coords[3]-coords[1]]
-                area = bbox[2] * bbox[3]
-
-                if annotation.label not in present_categories:
-                    present_categories.append(annotation.label)
-                    category_id_map[annotation.label] = category_counter
-                    self.categories.append({"id": category_counter,
-                                            "name": annotation.label,
-                                            "supercategory": None})
-                    category_counter += 1
-
-                # FIXME: This is a naive interpretation of iscrowd, as a non-crowd object can have multiple polygons too
-                if len(annotation.polygons) > 1:
-                    is_crowd = True
-                    size = [editable_image.width, editable_image.height]
-                    counts = []
-                    for polygon in annotation.polygons:
-                        poly_coords = polygon.get_coords()
-                        vertices = list(zip(poly_coords[::2], poly_coords[1::2]))
-                        counts += vertices_to_rle(bbox, vertices)
-
-                    segmentation = {"counts": counts, "size": size}
+    # Returns the id of a label's category, adding the category if the label hasn't been seen before
+    def get_category_id(self, label: str) -> int:
+        category = self.category_index.get(label)
+        if not category:
+            category = {"id": self.next_category_id,
+                        "name": label,
+                        "supercategory": None}
+            self.category_index[label] = category
+            self.next_category_id += 1
+
+        return category["id"]
+
+    # Renames a category in place. If the new label already has a category the two are merged, with the old id
+    # aliased to the surviving one so that cached annotations don't need rebuilding
+    def rename_category(self, old_label: str, new_label: str):
+        if old_label not in self.category_index or old_label == new_label:
+            return
+
+        category = self.category_index.pop(old_label)
+        if new_label in self.category_index:
+            self.category_aliases[category["id"]] = self.category_index[new_label]["id"]
+        else:
+            category["name"] = new_label
+            self.category_index[new_label] = category
+
+    def resolve_category_id(self, category_id: int) -> int:
+        while category_id in self.category_aliases:
+            category_id = self.category_aliases[category_id]
+
+        return category_id
+
+    def index_categories(self):
+        self.category_index = {category["name"]: category for category in self.categories}
+        self.category_aliases = {}
+        self.next_category_id = max((category["id"] for category in self.categories), default=-1) + 1
+
+    # Builds the COCO annotations of a single image, leaving the ids to be filled in when they are assembled. Crowd
+    # annotations are encoded here unless a list is passed to collect them in, as (size, polygons) pairs in the same
+    # order as the annotations, for their counts and areas to be filled in once they have been encoded elsewhere.
+    # Areas are those of the segmentation where there is one, with all of an image's polygons measured at once
+    def build_annotations(self, editable_image, crowds: list = None) -> list:
+        coco_annotations = []
+        polygon_annotations = []
+        for annotation in editable_image.annotations:
+            coords = annotation.bbox.get_coords()
+            bbox = [coords[0], coords[1], coords[2]-coords[0], coords[3]-coords[1]]
+            area = bbox[2] * bbox[3]
+
+            # FIXME: This is a naive interpretation of iscrowd, as a non-crowd object can have multiple polygons too
+            if len(annotation.polygons) > 1:
+                is_crowd = True
+                # The polygons are joined into one mask over the whole image, as compressed COCO RLE
+                size = [editable_image.height, editable_image.width]
+                polygons = [polygon.get_coords() for polygon in annotation.polygons]
+
+                if crowds is None:
+                    counts, area = encode_crowd_annotations([(size, polygons)])[0]
                 else:
-                    is_crowd = False
-                    segmentation = annotation.polygons[0].get_coords()
-
-                self.annotations.append({"id": annotation_counter,
-                                         "image_id": image_counter,
-                                         "category_id": category_id_map[annotation.label],
-                                         "segmentation": segmentation,
-                                         "area": area,
-                                         "bbox": bbox,
-                                         "iscrowd": is_crowd})
-                annotation_counter += 1
-
-            self.images.append({"id": image_counter,
+                    counts = None
+                    crowds.append((size, polygons))
+                segmentation = {"counts": counts, "size": size}
+            elif annotation.polygons:
+                is_crowd = False
+                segmentation = annotation.polygons[0].get_coords()
+                polygon_annotations.append(len(coco_annotations))
+            elif annotation.rle:
+                is_crowd = True
+                segmentation = annotation.rle
+                # The area is that of the mask, not of its box
+                counts = segmentation["counts"]
+                area = sum((rle_from_string(counts) if isinstance(counts, str) else counts)[1::2])
+            else:
+                is_crowd = False
+                segmentation = []
+
+            coco_annotations.append({"id": None,
+                                     "image_id": None,
+                                     "category_id": self.get_category_id(annotation.label),
+                                     "segmentation": segmentation,
+                                     "area": area,
+                                     "bbox": bbox,
+                                     "iscrowd": is_crowd})
+
+        if polygon_annotations:
+            polygons = [coco_annotations[index]["segmentation"] for index in polygon_annotations]
+            offsets = np.cumsum([0] + [len(vertices) for vertices in polygons])
+            areas = polygon_areas(np.concatenate(polygons), offsets)
+            for index, area in zip(polygon_annotations, areas.tolist()):
+                coco_annotations[index]["area"] = area
+
+        return coco_annotations
+
+    # Fills all possible fields based on accessible information. Only images that were edited since the last call have
+    # their annotations rebuilt, the rest reuse the COCO fragments cached on each image or read them from the coco file
+    # as they are written out. Crowd RLE for the rebuilt images is encoded afterwards, reporting progress through
+    # progress(done, total) if it is given
+    def bulk_populate_fields(self, editable_images: list, progress=None):
+        self.images = []
+        self.exported_images = editable_images
+
+        pending = []
+        for image_id, editable_image in enumerate(editable_images):
+            if editable_image.dirty:
+                crowds = []
+                editable_image.coco_annotations = self.build_annotations(editable_image, crowds)
+                editable_image.dirty = False
+                self.mark_changed(image_id)
+                if crowds:
+                    pending.append((editable_image.coco_annotations, crowds))
+
+            self.images.append({"id": image_id,
                                 "width": editable_image.width,
                                 "height": editable_image.height,
                                 "file_name": editable_image.file_name,
                                 "license": None,
                                 "date_captured": editable_image.date_captured})
-            image_counter += 1
+
+        self.categories = list(self.category_index.values())
+        self.encode_crowds(pending, progress)
+
+    # Records that an image's annotations no longer match what was last saved, by its position among the exported images
+    def mark_changed(self, image_id: int):
+        self.changed_images.add(image_id)
+        self.unstored_images.add(image_id)
+
+    # The categories in use by the given category ids, for writing out. Ones that no annotation uses any more, such as a
+    # label that was renamed onto another, are left out
+    def used_categories(self, category_ids) -> list:
+        used = set(np.unique(np.asarray(category_ids, dtype=np.int64)).tolist())
+        return [category for category in self.category_index.values() if category["id"] in used]
+
+    # Encodes the crowd annotations collected by build_annotations, one image per task. A few images are encoded in
+    # place, as starting the pool would cost more than it saves. Beyond that images are sent to the pool in chunks and
+    # their results come back in order, with progress reported after each chunk
+    def encode_crowds(self, pending: list, progress=None, parallel_threshold: int = 4):
+        if len(pending) < parallel_threshold:
+            results = map(encode_crowd_annotations, [crowds for _annotations, crowds in pending])
+            chunk_size = 1
+        else:
+            if not self.executor:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            workers = self.workers or os.cpu_count() or 1
+            chunk_size = max(len(pending) // (workers * 16), 1)
+            results = self.executor.map(encode_crowd_annotations, [crowds for _annotations, crowds in pending],
+                                        chunksize=chunk_size)
+
+        for done, ((annotations, _crowds), encoded) in enumerate(zip(pending, results), 1):
+            crowd_annotations = [annotation for annotation in annotations
+                                 if isinstance(annotation["segmentation"], dict)
+                                 and annotation["segmentation"]["counts"] is None]
+            for annotation, (counts, area) in zip(crowd_annotations, encoded):
+                annotation["segmentation"]["counts"] = counts
+                annotation["area"] = area
+            if progress and (done % chunk_size == 0 or done == len(pending)):
+                progress(done, len(pending))
+
+    def get_image_annotations(self, editable_image) -> list:
+        if editable_image.coco_annotations is not None:
+            return editable_image.coco_annotations
+        if self.store is not None and editable_image.coco_id is not None:
+            return self.store.annotations_for_image(editable_image.coco_id)
+        if self.coco_reader and editable_image.coco_id is not None:
+            return self.coco_reader.annotations_for_image(editable_image.coco_id)
+
+        return []
+
+    # Yields each exported image's annotations with their ids assigned, one image at a time, for every image or only the
+    # ones given
+    def iter_annotation_groups(self, image_ids=None):
+        annotation_id = 0
+        if image_ids is None:
+            image_ids = range(len(self.exported_images))
+        for image_id in image_ids:
+            annotations = self.get_image_annotations(self.exported_images[image_id])
+            for annotation in annotations:
+                annotation["id"] = annotation_id
+                annotation["image_id"] = image_id
+                if annotation["category_id"] in self.category_aliases:
+                    annotation["category_id"] = self.resolve_category_id(annotation["category_id"])
+                annotation_id += 1
+
+            yield image_id, annotations
+
+    def iter_annotations(self):
+        for _image_id, annotations in self.iter_annotation_groups():
+            yield from annotations
 
     def make_id_category_map(self):
         id_category_map = {}
-        for category in self.categories:
+        for category in self.category_index.values():
             id_category_map[category["id"]] = category["name"]
+        for category_id in self.category_aliases:
+            id_category_map[category_id] = id_category_map[self.resolve_category_id(category_id)]
 
         return id_category_map
 
@@ -113,29 +308,167 @@ class InfoManager:
 
         return id_colour_map
 
+    # Gathers every exported image's annotations into the columnar store, which then stands in for the coco file.
+    # Once there is a store, images that haven't changed since keep their rows in it and only the rest are read again.
+    # Images are found at their new ids from then on, so the store has to be complete before any of them move
+    def build_store(self) -> AnnotationStore:
+        if self.store is None:
+            self.store = AnnotationStore.from_groups(self.iter_annotation_groups())
+        else:
+            reused = {image_id: editable_image.coco_id for image_id, editable_image in enumerate(self.exported_images)
+                      if editable_image.coco_id is not None and image_id not in self.unstored_images}
+            image_ids = [image_id for image_id in range(len(self.exported_images)) if image_id not in reused]
+            category_map = {category_id: self.resolve_category_id(category_id) for category_id in self.category_aliases}
+            self.store = self.store.rebuild(reused, self.iter_annotation_groups(image_ids), category_map)
+        for image_id, editable_image in enumerate(self.exported_images):
+            editable_image.coco_id = image_id
+        self.unstored_images = set()
+        if not self.database:
+            self.coco_reader = None
+
+        return self.store
+
+    # Returns the store for queries, rebuilding it if any image was edited or added since it was last built
+    def get_store(self, editable_images: list) -> AnnotationStore:
+        if (self.store is None or len(editable_images) != len(self.exported_images)
+                or any(editable_image.dirty for editable_image in editable_images)):
+            self.bulk_populate_fields(editable_images)
+            self.build_store()
+
+        return self.store
+
+    # Finds annotations by label and size, e.g. query_annotations(images, labels=["car"], max_side=32) for every car
+    # box under 32px, returning (file name, annotation) pairs
+    def query_annotations(self, editable_images: list, labels: list = None, **filters) -> list:
+        store = self.get_store(editable_images)
+        if labels is not None:
+            filters["category_ids"] = [self.category_index[label]["id"] for label in labels
+                                       if label in self.category_index]
+
+        return [(editable_images[store.image_id[row]].file_name, store.annotation(row))
+                for row in store.select(**filters).tolist()]
+
+    def find_unannotated_images(self, editable_images: list) -> list:
+        store = self.get_store(editable_images)
+        return [editable_images[image_id].file_name
+                for image_id in store.images_without_annotations(len(editable_images)).tolist()]
+
+    # Aggregate counts and sizes over the whole dataset, with categories keyed by label
+    def get_dataset_stats(self, editable_images: list) -> dict:
+        stats = self.get_store(editable_images).get_stats(len(editable_images))
+        id_category_map = self.make_id_category_map()
+        stats["categories"] = {id_category_map.get(category_id, category_id): category_stats
+                               for category_id, category_stats in stats["categories"].items()}
+
+        return stats
+
+    def save_annotations(self):
+        if self.database:
+            self.write_database()
+        else:
+            self.write_coco()
+
+    # Saves to the database, replacing the annotations of each image edited since the last save in a transaction of
+    # its own. The first save into an empty database brings in every image, which is how a coco.json is converted
+    def write_database(self):
+        if not (self.directory and self.valid):
+            return
+
+        if self.database.is_empty():
+            image_ids = range(len(self.exported_images))
+        else:
+            image_ids = sorted(self.changed_images)
+        groups = self.iter_annotation_groups(image_ids)
+
+        for old_id in self.category_aliases:
+            self.database.merge_category(old_id, self.resolve_category_id(old_id))
+        for image_id, annotations in groups:
+            self.database.replace_image_annotations(image_id, annotations)
+        categories = self.used_categories(self.database.category_ids())
+        self.database.write_header(self.info, self.licenses, categories, self.images)
+
+        for image_id, editable_image in enumerate(self.exported_images):
+            editable_image.coco_id = image_id
+        self.coco_reader = self.database
+        self.changed_images = set()
+
+    # Streams the database's annotations out with fresh ids, for exporting it to coco.json
+    def iter_database_groups(self):
+        annotation_id = 0
+        for image_id, annotations in self.database.iter_annotation_groups():
+            for annotation in annotations:
+                annotation["id"] = annotation_id
+                annotation_id += 1
+
+            yield image_id, annotations
+
+    # Writes coco.json, straight from the editable images and the store, or as an export out of the database
     def write_coco(self):
         if self.directory and self.valid:
-            path = os.path.join(self.directory, "coco.json")
-            coco = {"info": self.info,
-                    "licenses": self.licenses,
-                    "categories": self.categories,
-                    "images": self.images,
-                    "annotations": self.annotations}
-
-            with open(path, "w") as coco_file:
-                coco_file.write(json.dumps(coco))
-
+            path = os.path.join(self.directory, COCO_FILES[self.compression])
+            if self.database:
+                self.write_database()
+                categories = self.used_categories(self.database.category_ids())
+                annotation_groups = self.iter_database_groups()
+            else:
+                store = self.build_store()
+                categories = self.used_categories(store.category_id)
+                annotation_groups = store.iter_groups()
+            write_coco_stream(path, self.info, self.licenses, categories, self.images, annotation_groups)
+
+            # Only one coco file is kept, so a change of compression doesn't leave a stale copy to be read next time
+            for file_name in COCO_FILES.values():
+                other_path = os.path.join(self.directory, file_name)
+                if other_path != path and os.path.exists(other_path):
+                    os.remove(other_path)
+
+    # Reads the header and image list of the coco file. Annotations are only read per image, when they are needed
     def read_coco(self):
         if self.directory:
-            path = os.path.join(self.directory, "coco.json")
-            with open(path, "r") as coco_file:
-                content = json.loads(coco_file.read())
+            path = find_coco_path(self.directory)
+            self.compression = get_compression(path)
+            self.read_header(open_coco_reader(path))
 
-                self.info = content["info"]
-                self.licenses = content["licenses"]
-                self.categories = content["categories"]
-                self.images = content["images"]
-                self.annotations = content["annotations"]
+    def read_database(self):
+        if self.directory:
+            self.read_header(self.database)
+
+    def read_header(self, reader):
+        self.coco_reader = reader
+        content = self.coco_reader.read_header()
+
+        self.info = content["info"]
+        self.licenses = content["licenses"]
+        self.categories = content["categories"]
+        self.images = content["images"]
+
+        self.index_categories()
+        self.refresh_images()
+
+    # Re-reads the header of every image that changed on disk since the metadata index last saw it
+    def refresh_images(self):
+        image_paths = [os.path.join(self.directory, image["file_name"]) for image in self.images]
+        known, stale = self.metadata_index.partition(image_paths)
+        if not stale:
+            return
+
+        # Only the images that are still there are read again, the rest keep what the coco file says
+        scanner = HeaderScanner(stale)
+        scanner.start()
+        headers = dict(scanner.drain())
+        for image, image_path in zip(self.images, image_paths):
+            if image_path not in headers:
+                continue
+
+            header = headers[image_path]
+            image["width"] = header["width"]
+            image["height"] = header["height"]
+            image["date_captured"] = header["date_captured"] or image["date_captured"]
+            self.metadata_index.update(image_path, header)
+
+    def write_metadata_index(self):
+        if self.directory and self.valid and self.metadata_index:
+            self.metadata_index.write()
 
     def write_colour_map(self):
         if self.directory and self.valid:
@@ -146,22 +479,41 @@ class InfoManager:
     def read_colour_map(self):
         if self.directory:
             path = os.path.join(self.directory, ".colour_map.json")
+            # Datasets written by other tools come without one
+            if not os.path.exists(path) or not os.path.getsize(path):
+                return
+
             with open(path, "r") as colour_file:
                 content = json.loads(colour_file.read())
 
                 self.colour_map = content
 
 
+# Tk is only imported once a directory is picked through the window, so that the batch CLI runs where it isn't installed
 def load_dir(info_manager: InfoManager):
+    from tkinter import filedialog
+
     directory = filedialog.askdirectory()
-    if directory:
-        info_manager.activate(directory)
-    else:
+    if not directory:
         return "cancelled"
 
-    coco_path = os.path.join(directory, "coco.json")
+    return open_dir(info_manager, directory)
+
+
+def open_dir(info_manager: InfoManager, directory: str):
+    info_manager.activate(directory)
+
+    coco_path = find_coco_path(directory)
     colour_map_path = os.path.join(directory, ".colour_map.json")
-    if os.path.exists(coco_path):
+
+    if info_manager.database and not info_manager.database.is_empty():
+        info_manager.read_database()
+        info_manager.read_colour_map()
+
+        return "read"
+
+    # An empty coco.json is only a placeholder, left when nothing was saved in a new directory
+    if coco_path and os.path.getsize(coco_path):
         info_manager.read_coco()
         info_manager.read_colour_map()
 
@@ -173,16 +525,14 @@ def load_dir(info_manager: InfoManager):
                                    "red": "red",
                                    "deep pink": "deep pink"}
 
-        image_types = [".jpg", ".png", ".bmp"]
-        valid_images = []
-        for file in os.listdir(directory):
-            if os.path.splitext(file)[1] in image_types:
-                valid_images.append(os.path.join(directory, file))
+        valid_images = find_images(directory)
 
         if not valid_images:
             return "invalid"
 
-        open(coco_path, "x")
-        open(colour_map_path, "x")
+        if not coco_path and not info_manager.database:
+            open(os.path.join(directory, "coco.json"), "x")
+        if not os.path.exists(colour_map_path):
+            open(colour_map_path, "x")
 
         return valid_images
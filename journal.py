@@ -0,0 +1,149 @@
+import json
+import os
+import queue
+import threading
+import time
+
+
+# An append-only log of annotation edits kept next to coco.json. Edits are queued from the Tk thread and written in
+# batches by a background thread, so a crash loses at most the last batch rather than the whole session. Once the
+# edits have been folded into coco.json the journal is compacted, which empties it.
+# The journal opens with a header holding signature(), taken from the saved annotations the edits apply to. A crash
+# between a save replacing them and the compaction leaves edits that are already saved, which the changed signature
+# gives away, so they are dropped rather than replayed a second time. Without a signature every edit is replayed
+class AnnotationJournal:
+    def __init__(self, directory: str, batch_size: int = 256, flush_interval: float = 0.5, signature=None):
+        self.path = os.path.join(directory, ".journal.jsonl")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.signature = signature or (lambda: None)
+
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pending = False
+
+        self.saved = self.signature()
+        if self.is_stale():
+            os.remove(self.path)
+
+    def start(self):
+        if not self.thread:
+            self.thread = threading.Thread(target=self.run, name="journal", daemon=True)
+            self.thread.start()
+
+    def record(self, op: dict):
+        self.start()
+        self.pending = True
+        self.queue.put(op)
+
+    # Whether any edit is waiting to be folded into coco.json, including ones left over from a session that crashed
+    def has_ops(self) -> bool:
+        return self.pending or os.path.exists(self.path)
+
+    # Records the creation of a bounding box
+    def record_bbox(self, file_name: str, coords: list, label: str, colour: str):
+        self.record({"op": "bbox", "image": file_name, "coords": coords, "label": label, "colour": colour})
+
+    # Records a polygon segment being added, from its start to its end point
+    def record_segment(self, file_name: str, start: list, end: list):
+        self.record({"op": "segment", "image": file_name, "coords": start + end})
+
+    def record_undo(self, file_name: str):
+        self.record({"op": "undo", "image": file_name})
+
+    def record_redo(self, file_name: str):
+        self.record({"op": "redo", "image": file_name})
+
+    # Records an existing annotation being moved or deleted, by its position among the image's annotations
+    def record_move(self, file_name: str, position: int, delta: list):
+        self.record({"op": "move", "image": file_name, "position": position, "delta": delta})
+
+    def record_delete(self, file_name: str, position: int):
+        self.record({"op": "delete", "image": file_name, "position": position})
+
+    def record_rename(self, colour: str, old_label: str, new_label: str):
+        self.record({"op": "rename", "colour": colour, "old": old_label, "new": new_label})
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            ops = [op for op in batch if op is not None]
+            if ops:
+                self.write(ops)
+            for _op in batch:
+                self.queue.task_done()
+
+            if batch[-1] is None:
+                return
+
+    def write(self, ops: list):
+        lines = "".join(json.dumps(op, separators=(",", ":")) + "\n" for op in ops)
+        with self.lock:
+            if not os.path.exists(self.path):
+                lines = json.dumps({"op": "header", "saved": self.saved}, separators=(",", ":")) + "\n" + lines
+            with open(self.path, "a") as journal_file:
+                journal_file.write(lines)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    # Blocks until every queued edit is on disk
+    def flush(self):
+        if self.thread:
+            self.queue.join()
+
+    def read_ops(self) -> list:
+        if not os.path.exists(self.path) or self.is_stale():
+            return []
+
+        ops = []
+        with open(self.path, "r") as journal_file:
+            for line in journal_file:
+                # A crash can leave the last line half written, which is dropped along with anything after it
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    break
+                if op["op"] != "header":
+                    ops.append(op)
+
+        return ops
+
+    # Whether the journal was recorded against saved annotations that have since been replaced. Journals written
+    # before there was a header are taken as current
+    def is_stale(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+
+        with open(self.path, "r") as journal_file:
+            try:
+                header = json.loads(journal_file.readline())
+            except ValueError:
+                return False
+
+        return header["op"] == "header" and header["saved"] != self.saved
+
+    # Empties the journal, once everything in it has been written to coco.json, which later edits then apply to
+    def compact(self):
+        self.flush()
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.pending = False
+            self.saved = self.signature()
+
+    def close(self):
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
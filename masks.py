@@ -0,0 +1,192 @@
+from PIL import Image, ImageColor
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+
+from operations import polygon_mask, rle_from_string, rle_to_mask
+from pool import iter_chunks, map_ordered
+
+MASK_DIR = ".masks"
+
+
+# Tk colour names are written with spaces, where Pillow's have none. Labels without a colour, or with a colour Pillow
+# doesn't know, get one made up from their name so that it stays the same between exports
+def colour_to_rgb(colour: str, fallback: str) -> tuple:
+    if colour:
+        try:
+            return ImageColor.getrgb(colour.replace(" ", ""))[:3]
+        except ValueError:
+            pass
+
+    return tuple(hashlib.sha1(fallback.encode()).digest()[:3])
+
+
+# Maps every category id to the RGB of the colour its label is drawn in
+def make_category_colours(categories: list, colour_map: dict) -> dict:
+    label_colours = {label: colour for colour, label in colour_map.items()}
+    return {category["id"]: colour_to_rgb(label_colours.get(category["name"]), category["name"])
+            for category in categories}
+
+
+# Rasterizes one annotation, returning its mask and the top left corner the mask sits at. Polygons are only filled over
+# their own extent, clipped to the image. RLE covers either the whole image or the bbox, and anything else in it falls
+# back to filling the bbox
+def annotation_mask(annotation: dict, width: int, height: int):
+    segmentation = annotation["segmentation"]
+    x, y, box_width, box_height = annotation["bbox"]
+    if isinstance(segmentation, dict):
+        counts = segmentation["counts"]
+        if isinstance(counts, str):
+            counts = rle_from_string(counts)
+        total = sum(counts) if isinstance(counts, list) else 0
+        if total == width * height:
+            return rle_to_mask(counts, height, width), (0, 0)
+        if total and total == box_width * box_height:
+            return rle_to_mask(counts, int(box_height), int(box_width)), (x, y)
+        return np.ones((math.ceil(box_height), math.ceil(box_width)), dtype=bool), (math.floor(x), math.floor(y))
+
+    if not segmentation:
+        return None, (0, 0)
+
+    polygons = segmentation if isinstance(segmentation[0], list) else [segmentation]
+    points = np.concatenate([np.asarray(vertices, dtype=np.float64) for vertices in polygons]).reshape(-1, 2)
+    left, top = max(math.floor(points[:, 0].min()), 0), max(math.floor(points[:, 1].min()), 0)
+    right, bottom = min(math.ceil(points[:, 0].max()), width), min(math.ceil(points[:, 1].max()), height)
+    if right <= left or bottom <= top:
+        return None, (0, 0)
+
+    mask = np.zeros((bottom - top, right - left), dtype=bool)
+    for vertices in polygons:
+        mask |= polygon_mask(vertices, right - left, bottom - top, rel_x=left, rel_y=top)
+    return mask, (left, top)
+
+
+# Paints every annotation of an image into an instance map, numbered from 1 in annotation order, and a class map of
+# category id + 1. Later annotations cover earlier ones, as they do on the canvas, and 0 is left as background
+def rasterize_image(annotations: list, width: int, height: int):
+    top_category = max((annotation["category_id"] for annotation in annotations), default=0)
+    instance_type = np.uint8 if len(annotations) < 256 else np.uint16
+    class_type = np.uint8 if top_category < 255 else np.uint16
+    instances = np.zeros((height, width), dtype=instance_type)
+    classes = np.zeros((height, width), dtype=class_type)
+
+    for index, annotation in enumerate(annotations, 1):
+        mask, (left, top) = annotation_mask(annotation, width, height)
+        if mask is None:
+            continue
+
+        # Masks can reach past the image, so both the region and the mask are clipped to it
+        left, top = int(left), int(top)
+        region = (slice(max(top, 0), min(top + mask.shape[0], height)),
+                  slice(max(left, 0), min(left + mask.shape[1], width)))
+        mask = mask[region[0].start - top:region[0].stop - top, region[1].start - left:region[1].stop - left]
+        instances[region][mask] = index
+        classes[region][mask] = annotation["category_id"] + 1
+
+    return instances, classes
+
+
+# Saves a label map as an indexed PNG with the given palette entries, or as a 16 bit greyscale PNG when it holds more
+# values than a palette can
+def save_label_map(labels: np.ndarray, palette: dict, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if labels.dtype != np.uint8:
+        Image.fromarray(labels.astype(np.uint16)).save(path)
+        return
+
+    flat_palette = [0] * 768
+    for index, rgb in palette.items():
+        flat_palette[index * 3:index * 3 + 3] = rgb
+    image = Image.fromarray(labels, mode="P")
+    image.putpalette(flat_palette)
+    image.save(path, optimize=False)
+
+
+# Writes the instance and class masks of one image. Takes and returns plain values so that it can run in a worker
+def write_image_masks(job: tuple) -> str:
+    file_name, width, height, annotations, category_colours, output_dir = job
+    instances, classes = rasterize_image(annotations, width, height)
+    mask_name = os.path.splitext(file_name)[0] + ".png"
+
+    instance_palette = {index: category_colours.get(annotation["category_id"], (255, 255, 255))
+                        for index, annotation in enumerate(annotations, 1)}
+    class_palette = {category_id + 1: rgb for category_id, rgb in category_colours.items() if category_id < 255}
+    save_label_map(instances, instance_palette, os.path.join(output_dir, "instances", mask_name))
+    save_label_map(classes, class_palette, os.path.join(output_dir, "classes", mask_name))
+
+    return file_name
+
+
+def write_mask_chunk(jobs: list) -> list:
+    return [write_image_masks(job) for job in jobs]
+
+
+# A digest of everything that ends up in an image's masks, which ids are left out of as they change on every save
+def fingerprint_image(width: int, height: int, annotations: list, category_colours: dict) -> str:
+    content = [width, height, [[annotation["category_id"], annotation["bbox"], annotation["segmentation"],
+                                category_colours.get(annotation["category_id"])] for annotation in annotations]]
+    return hashlib.sha1(json.dumps(content).encode()).hexdigest()
+
+
+# Writes an instance mask and a class mask for every image into `.masks/instances` and `.masks/classes`, mirroring
+# the image paths. A manifest of each image's fingerprint is kept alongside them, and images whose annotations and
+# colours haven't changed since they were last exported are skipped. Images are rasterized across a process pool
+class MaskExporter:
+    def __init__(self, info_manager, output_dir: str = None, workers: int = None):
+        self.info_manager = info_manager
+        self.output_dir = output_dir or os.path.join(info_manager.directory, MASK_DIR)
+        self.manifest_path = os.path.join(self.output_dir, "manifest.json")
+        self.workers = workers
+
+    def read_manifest(self) -> dict:
+        if not os.path.exists(self.manifest_path):
+            return {}
+
+        with open(self.manifest_path, "r") as manifest_file:
+            try:
+                return json.loads(manifest_file.read())
+            except ValueError:
+                return {}
+
+    def write_manifest(self, manifest: dict):
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(self.manifest_path, "w") as manifest_file:
+            manifest_file.write(json.dumps(manifest))
+
+    # Yields a job for every image whose masks are out of date, recording its new fingerprint in the manifest
+    def iter_jobs(self, editable_images: list, category_colours: dict, images: dict):
+        for editable_image in editable_images:
+            annotations = self.info_manager.get_image_annotations(editable_image)
+            fingerprint = fingerprint_image(editable_image.width, editable_image.height, annotations, category_colours)
+            mask_name = os.path.splitext(editable_image.file_name)[0] + ".png"
+            if (images.get(editable_image.file_name) == fingerprint
+                    and os.path.exists(os.path.join(self.output_dir, "classes", mask_name))):
+                continue
+
+            images[editable_image.file_name] = fingerprint
+            yield (editable_image.file_name, editable_image.width, editable_image.height, annotations,
+                   category_colours, self.output_dir)
+
+    # Exports the masks of the images last passed to bulk_populate_fields, returning how many were written. Progress
+    # is reported through progress(done) after each chunk of images
+    def export(self, progress=None, chunk_size: int = 16) -> int:
+        info_manager = self.info_manager
+        category_colours = make_category_colours(info_manager.categories, info_manager.colour_map)
+        manifest = self.read_manifest()
+        images = manifest.get("images", {})
+        jobs = self.iter_jobs(info_manager.exported_images, category_colours, images)
+
+        written = 0
+        for file_names in map_ordered(write_mask_chunk, iter_chunks(jobs, chunk_size), self.workers):
+            written += len(file_names)
+            if progress:
+                progress(written)
+
+        live = {editable_image.file_name for editable_image in info_manager.exported_images}
+        classes = {category["id"] + 1: category["name"] for category in info_manager.categories}
+        self.write_manifest({"classes": classes, "images": {name: fingerprint for name, fingerprint in images.items()
+                                                             if name in live}})
+        return written
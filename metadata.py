@@ -0,0 +1,122 @@
+from PIL import Image
+import hashlib
+import json
+import os
+
+THUMBNAIL_SIZE = (128, 128)
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+# Remembers the header of every image in a directory, keyed by relative path and checked against mtime and size, so
+# that reopening a directory only has to read the files that changed. Small thumbnails are kept in `.thumbnails`
+class MetadataIndex:
+    def __init__(self, directory: str, content_hash: bool = False):
+        self.directory = directory
+        self.content_hash = content_hash
+        self.path = os.path.join(directory, ".metadata_index.json")
+        self.thumbnail_dir = os.path.join(directory, ".thumbnails")
+
+        self.entries = {}
+        self.changed = False
+
+    def read(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r") as index_file:
+                self.entries = json.loads(index_file.read())
+
+    def write(self):
+        if self.changed:
+            with open(self.path, "w") as index_file:
+                index_file.write(json.dumps(self.entries))
+            self.changed = False
+
+    # Returns the stored header for an image if the file is unchanged since it was recorded, otherwise None. Images
+    # that were moved or deleted since are dropped from the index
+    def lookup(self, image_path: str):
+        file_name = os.path.relpath(image_path, self.directory)
+        entry = self.entries.get(file_name)
+        if not entry:
+            return None
+
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            del self.entries[file_name]
+            self.changed = True
+            return None
+
+        if entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return entry
+
+        if self.content_hash and entry.get("hash") == hash_file(image_path):
+            entry["mtime"] = stat.st_mtime_ns
+            entry["size"] = stat.st_size
+            self.changed = True
+            return entry
+
+        return None
+
+    def update(self, image_path: str, header: dict):
+        file_name = os.path.relpath(image_path, self.directory)
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+
+        entry = {"mtime": stat.st_mtime_ns,
+                 "size": stat.st_size,
+                 "width": header["width"],
+                 "height": header["height"],
+                 "date_captured": header["date_captured"],
+                 "thumbnail": None}
+        if self.content_hash:
+            entry["hash"] = hash_file(image_path)
+
+        self.entries[file_name] = entry
+        self.changed = True
+        return entry
+
+    # Splits image paths into those with a valid stored header and those that need their header read again. Paths
+    # that no longer exist are in neither, as there is nothing to read
+    def partition(self, image_paths: list):
+        known = {}
+        stale = []
+        for image_path in image_paths:
+            entry = self.lookup(image_path)
+            if entry:
+                known[image_path] = entry
+            elif os.path.exists(image_path):
+                stale.append(image_path)
+
+        return known, stale
+
+    # Saves a thumbnail from an image that has already been decoded, if there isn't one yet
+    def add_thumbnail(self, image_path: str, image: Image.Image):
+        file_name = os.path.relpath(image_path, self.directory)
+        entry = self.entries.get(file_name)
+        if not entry or entry["thumbnail"]:
+            return
+
+        thumbnail_name = hashlib.sha1(file_name.encode()).hexdigest() + ".png"
+        os.makedirs(self.thumbnail_dir, exist_ok=True)
+        thumbnail = image.copy()
+        thumbnail.thumbnail(THUMBNAIL_SIZE)
+        thumbnail.save(os.path.join(self.thumbnail_dir, thumbnail_name))
+
+        entry["thumbnail"] = thumbnail_name
+        self.changed = True
+
+    def get_thumbnail(self, image_path: str):
+        entry = self.entries.get(os.path.relpath(image_path, self.directory))
+        if not entry or not entry["thumbnail"]:
+            return None
+
+        return Image.open(os.path.join(self.thumbnail_dir, entry["thumbnail"]))
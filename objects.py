@@ -1,9 +1,12 @@
 import tkinter as tk
-from PIL import ImageTk, Image
+from array import array
 import os
 from datetime import date
 
-from operations import check_intersection
+from cache import CanvasPool, ImageCache
+from geometry import SegmentGrid, SpatialIndex, ViewTransform
+from pyramid import TileLayer, make_tile_source
+from scanner import read_header
 
 
 def find_object_ref(canvas: tk.Canvas, coords: list):
@@ -24,9 +27,97 @@ def find_label_refs(canvas: tk.Canvas, label: str):
     return ref_list
 
 
+# Puts a canvas behind a view transform, so that objects draw and move themselves in full resolution image coordinates.
+# Items come from a pool tagged "annotation", so that a change of view can rescale them all in two calls, and deleting
+# an item only hides it until it is drawn again for this image or the next
+class ViewCanvas:
+    def __init__(self, canvas: tk.Canvas, view: ViewTransform):
+        self.canvas = canvas
+        self.view = view
+        self.pool = CanvasPool(canvas, "annotation")
+
+    def __getattr__(self, name: str):
+        return getattr(self.canvas, name)
+
+    def create_rectangle(self, *coords, **options):
+        return self.pool.acquire("rectangle", self.view.coords_to_canvas(coords), options)
+
+    def create_line(self, *coords, **options):
+        return self.pool.acquire("line", self.view.coords_to_canvas(coords), options)
+
+    def create_text(self, *coords, **options):
+        return self.pool.acquire("text", self.view.coords_to_canvas(coords), options)
+
+    def delete(self, item):
+        self.pool.release(item)
+
+    def release_all(self):
+        self.pool.release_all()
+
+    def coords(self, item, *coords):
+        if not coords:
+            return self.view.coords_to_image(self.canvas.coords(item))
+        return self.canvas.coords(item, *self.view.coords_to_canvas(coords))
+
+    def move(self, item, delta_x: float, delta_y: float):
+        self.canvas.move(item, delta_x * self.view.scale, delta_y * self.view.scale)
+
+    # Converts a distance on screen, such as how close a click has to be to snap, into image pixels
+    def image_distance(self, distance: float) -> float:
+        return distance / self.view.scale
+
+    # Moves every annotation item from where the old view put it to where the current view does
+    def apply_view(self, old: ViewTransform):
+        ratio = self.view.scale / old.scale
+        self.canvas.scale("annotation", 0, 0, ratio, ratio)
+        self.canvas.move("annotation", old.offset_x * ratio - self.view.offset_x,
+                         old.offset_y * ratio - self.view.offset_y)
+
+
+# A label shared by every box drawn with it, so that renaming it is a single assignment. Its canvas items carry the
+# label's tag, alongside "bbox" or "label" for the item type
+class Label:
+    __slots__ = ("name", "tag")
+
+    def __init__(self, name: str, tag: str):
+        self.name = name
+        self.tag = tag
+
+
+# Maps label names to the shared Label objects. Two labels can end up with the same name after a rename, in which case
+# they are kept together and renamed together from then on
+class LabelIndex:
+    def __init__(self):
+        self.labels = {}
+        self.tag_counter = 0
+
+    def get(self, name: str) -> Label:
+        if name not in self.labels:
+            self.labels[name] = [Label(name, f"label{self.tag_counter}")]
+            self.tag_counter += 1
+
+        return self.labels[name][0]
+
+    # Renames every label with the old name, updating the text of their items on the canvas through their tags
+    def rename(self, old_name: str, new_name: str, canvas: tk.Canvas):
+        labels = self.labels.pop(old_name, [])
+        for label in labels:
+            label.name = new_name
+            if canvas:
+                canvas.itemconfigure(f"{label.tag}&&label", text=new_name)
+
+        if labels:
+            self.labels.setdefault(new_name, []).extend(labels)
+
+    def clear(self):
+        self.labels = {}
+
+
 # Represents a box-label pair on the canvas
 class BoundingBox:
-    def __init__(self, canvas: tk.Canvas, coords: list, label: str, colour: str):
+    __slots__ = ("canvas", "start_x", "start_y", "end_x", "end_y", "label_ref", "colour", "box_object", "label_object")
+
+    def __init__(self, canvas: tk.Canvas, coords: list, label: Label, colour: str):
         self.canvas = canvas
 
         self.start_x: int = coords[0]
@@ -34,17 +125,22 @@ class BoundingBox:
         self.end_x: int = coords[2]
         self.end_y: int = coords[3]
 
-        self.label: str = label
+        self.label_ref: Label = label
         self.colour: str = colour
 
         self.box_object = None
         self.label_object = None
 
+    @property
+    def label(self) -> str:
+        return self.label_ref.name
+
     def draw(self):
         self.box_object = self.canvas.create_rectangle(self.start_x, self.start_y, self.end_x, self.end_y, width=3,
-                                                       outline=self.colour)
+                                                       outline=self.colour, tags=(self.label_ref.tag, "bbox"))
         self.label_object = self.canvas.create_text((self.start_x + self.end_x) / 2, self.end_y + 15, text=self.label,
-                                                    fill=self.colour, font="Helvetica 15 bold")
+                                                    fill=self.colour, font="Helvetica 15 bold",
+                                                    tags=(self.label_ref.tag, "label"))
 
     def adjust(self, x: int, y: int):
         self.end_x = x
@@ -53,17 +149,27 @@ class BoundingBox:
         self.canvas.coords(self.box_object, self.start_x, self.start_y, x, y)
         self.canvas.coords(self.label_object, (self.start_x + x)/2, y+15)
 
+    def move(self, delta_x: int, delta_y: int):
+        self.start_x += delta_x
+        self.start_y += delta_y
+        self.end_x += delta_x
+        self.end_y += delta_y
+
+        if self.box_object:
+            self.canvas.move(self.box_object, delta_x, delta_y)
+            self.canvas.move(self.label_object, delta_x, delta_y)
+
+    # Thickens the outline while the box is under the cursor, and dashes it while it is selected
+    def highlight(self, hovered: bool = False, selected: bool = False):
+        if self.box_object:
+            self.canvas.itemconfigure(self.box_object, width=5 if hovered else 3, dash=(6, 4) if selected else "")
+
     def delete(self):
         self.canvas.delete(self.box_object)
         self.canvas.delete(self.label_object)
         self.box_object = None
         self.label_object = None
 
-    def change_label(self, label: str):
-        self.label = label
-        if self.label_object:
-            self.canvas.itemconfigure(self.label_object, text=label)
-
     def get_coords(self) -> list:
         return [self.start_x, self.start_y, self.end_x, self.end_y]
 
@@ -73,6 +179,8 @@ class BoundingBox:
 
 # Represents an edge of a segmentation polygon (a line) on the canvas
 class Segment:
+    __slots__ = ("canvas", "colour", "start_x", "start_y", "end_x", "end_y", "line_object")
+
     def __init__(self, canvas: tk.Canvas, colour: str, x: int, y: int):
         self.canvas = canvas
         self.colour = colour
@@ -89,10 +197,21 @@ class Segment:
                                                    fill=self.colour)
 
     def adjust(self, x: int, y: int):
+        self.adjust_coords(x, y)
+        self.canvas.coords(self.line_object, self.start_x, self.start_y, self.end_x, self.end_y)
+
+    def adjust_coords(self, x: int, y: int):
         self.end_x = x
         self.end_y = y
 
-        self.canvas.coords(self.line_object, self.start_x, self.start_y, self.end_x, self.end_y)
+    def move(self, delta_x: int, delta_y: int):
+        self.start_x += delta_x
+        self.start_y += delta_y
+        self.end_x += delta_x
+        self.end_y += delta_y
+
+        if self.line_object:
+            self.canvas.move(self.line_object, delta_x, delta_y)
 
     def delete(self):
         self.canvas.delete(self.line_object)
@@ -112,18 +231,31 @@ def distance(x_1, y_1, x_2, y_2):
     return ((delta_x ** 2) + (delta_y ** 2)) ** 0.5
 
 
-# Represents a segmentation polygon on the canvas
+# Represents a segmentation polygon on the canvas, with its vertices in a flat int array. While a polygon is drawn each
+# of its edges is a Segment on the undo stack. A finished polygon read from a coco file is a single item on the undo
+# stack instead, drawn as one closed line, with its edges derived from the vertices whenever they are needed
 class Polygon:
+    __slots__ = ("canvas", "colour", "segments", "segment", "grid", "vertices", "line_object")
+
     def __init__(self, canvas: tk.Canvas, colour: str, x: int, y: int):
         self.canvas = canvas
         self.colour = colour
 
         self.segments = []
         self.segment = Segment(canvas, colour, x, y)
+        # Only built once a new segment has to be checked against the others, then kept in step with the segments
+        self.grid = None
+
+        self.vertices = array("i")
+        self.add_vertex(x, y)
+        self.line_object = None
 
-        self.vertices = []
-        self.vertices.append(x)
-        self.vertices.append(y)
+    def add_vertex(self, x, y):
+        self.vertices.append(round(x))
+        self.vertices.append(round(y))
+
+    def pop_vertex(self):
+        del self.vertices[-2:]
 
     def draw_segment(self):
         self.segment.draw()
@@ -134,9 +266,10 @@ class Polygon:
     def end_segment(self) -> bool:
         coords = self.segment.get_coords()
 
-        if len(self.vertices) >= 6 and distance(coords[0], coords[1], self.vertices[0], self.vertices[1]) <= 8:
+        snap = self.canvas.image_distance(8)
+        if len(self.vertices) >= 6 and distance(coords[0], coords[1], self.vertices[0], self.vertices[1]) <= snap:
             self.segment.adjust(self.vertices[0], self.vertices[1])
-            self.segments.append(self.segment)
+            self.add_segment(self.segment)
 
             return True
 
@@ -145,10 +278,9 @@ class Polygon:
     def resume_segment(self, x: int, y: int) -> bool:
         if len(self.segments) - 1 >= 0:
             last_x, last_y = self.segments[len(self.segments)-1].get_coords()
-            if distance(x, y, last_x, last_y) <= 8:
+            if distance(x, y, last_x, last_y) <= self.canvas.image_distance(8):
                 self.segment = Segment(self.canvas, self.colour, last_x, last_y)
-                self.vertices.append(last_x)
-                self.vertices.append(last_y)
+                self.add_vertex(last_x, last_y)
                 self.draw_segment()
 
                 return True
@@ -156,27 +288,64 @@ class Polygon:
         return False
 
     def get_coords(self) -> list:
-        return self.vertices
+        return self.vertices.tolist()
 
-    def check_invalid(self):
-        p1 = self.segment.get_start()
-        p2 = self.segment.get_coords()
+    # Segments go through these so that the grid used by check_invalid follows every add and undo
+    def add_segment(self, segment: Segment):
+        self.segments.append(segment)
+        if self.grid is not None:
+            self.grid.add(segment.get_start(), segment.get_coords())
+
+    def pop_segment(self) -> Segment:
+        if self.grid is not None:
+            self.grid.pop()
+        return self.segments.pop()
+
+    def get_grid(self) -> SegmentGrid:
+        if self.grid is None:
+            self.grid = SegmentGrid()
+            for segment in self.segments:
+                self.grid.add(segment.get_start(), segment.get_coords())
+
+        return self.grid
+
+    def move(self, delta_x: int, delta_y: int):
+        self.vertices = array("i", (vertex + (delta_y if i % 2 else delta_x) for i, vertex in enumerate(self.vertices)))
         for segment in self.segments:
-            p3 = segment.get_start()
-            p4 = segment.get_coords()
+            segment.move(delta_x, delta_y)
+        if self.line_object:
+            self.canvas.move(self.line_object, delta_x, delta_y)
+        self.grid = None
 
-            if p1 != p4 and p2 != p3:
-                if check_intersection(p1, p2, p3, p4):
-                    return True
+    # Builds a finished polygon from a flat list of vertices, without drawing it or making any Segments
+    @classmethod
+    def from_vertices(cls, canvas: tk.Canvas, colour: str, vertices: list):
+        polygon = cls(canvas, colour, vertices[0], vertices[1])
+        polygon.segment = None
+        polygon.vertices = array("i", (round(vertex) for vertex in vertices))
 
-        return False
+        return polygon
+
+    # Drawing and deleting apply to finished polygons that sit on the undo stack as a whole
+    def draw(self):
+        self.line_object = self.canvas.create_line(*self.vertices, self.vertices[0], self.vertices[1], width=3,
+                                                   fill=self.colour)
+
+    def delete(self):
+        self.canvas.delete(self.line_object)
+        self.line_object = None
+
+    def check_invalid(self):
+        return self.get_grid().intersects(self.segment.get_start(), self.segment.get_coords())
 
 
 class Annotation:
+    __slots__ = ("canvas", "state_manager", "label_ref", "colour", "bbox", "poly", "segment", "polygons", "rle")
+
     def __init__(self, canvas: tk.Canvas, state_manager):
         self.canvas = canvas
         self.state_manager = state_manager
-        self.label = None
+        self.label_ref = None
         self.colour = None
 
         self.bbox = None
@@ -184,8 +353,15 @@ class Annotation:
         self.segment = None
         self.polygons = []
 
-    def set_label(self, label: str, colour: str):
-        self.label = label
+        # A crowd segmentation read from a coco file, kept as is since its polygons can't be recovered
+        self.rle = None
+
+    @property
+    def label(self) -> str:
+        return self.label_ref.name if self.label_ref else None
+
+    def set_label(self, label: Label, colour: str):
+        self.label_ref = label
         self.colour = colour
 
     # Bounding box specific methods
@@ -231,46 +407,38 @@ class Annotation:
             self.poly = None
             self.canvas.unbind("<Motion>")
         elif not self.poly.check_invalid():
-            self.poly.segments.append(self.segment)
-            self.poly.vertices.append(coords[0])
-            self.poly.vertices.append(coords[1])
+            self.poly.add_segment(self.segment)
+            self.poly.add_vertex(coords[0], coords[1])
             self.poly.segment = Segment(self.canvas, self.colour, coords[0], coords[1])
             self.poly.draw_segment()
 
     def resume_polygon(self, x: int, y: int) -> bool:
         return self.poly.resume_segment(x, y)
 
-    # Undo / redo checks
-    def update_annotation_after_undo(self):
-        if not self.poly and self.polygons:
+    # Undo checks. A polygon read from a coco file is undone as a whole, drawn ones one segment at a time
+    def update_annotation_after_undo(self, undo=None):
+        if type(undo) == Polygon:
+            self.polygons.remove(undo)
+        elif not self.poly and self.polygons:
             self.poly = self.polygons.pop()
-            self.poly.segments.pop()
+            self.poly.pop_segment()
             self.poly.segment = None
-            self.poly.vertices.pop()
-            self.poly.vertices.pop()
+            self.poly.pop_vertex()
         elif self.poly:
             if self.poly.segments:
-                self.poly.vertices.pop()
-                self.poly.vertices.pop()
-                self.poly.segments.pop()
+                self.poly.pop_vertex()
+                self.poly.pop_segment()
             else:
                 self.poly = None
                 self.update_annotation_after_undo()
         else:
             self.bbox = None
 
-    def update_annotation_after_redo(self, redo):
-        if type(redo) == BoundingBox:
-            self.bbox = redo
-        elif type(redo) == Segment:
-            if self.poly:
-                self.poly.segment = redo
-                self.end_polygon_segment()
-                if self.poly:
-                    self.poly.segment = None
-            else:
-                self.poly = Polygon(self.canvas, self.colour, 0, 0)
-                self.poly.segment = redo
+    # Moves the box along with every polygon drawn in it
+    def move(self, delta_x: int, delta_y: int):
+        self.bbox.move(delta_x, delta_y)
+        for polygon in self.polygons + ([self.poly] if self.poly else []):
+            polygon.move(delta_x, delta_y)
 
     # General methods
     def get_bbox(self) -> BoundingBox:
@@ -286,61 +454,244 @@ class Annotation:
         return self.colour
 
 
-# Represents each instance of an image that can be edited
+# Represents each instance of an image that can be edited. Only metadata is read up front, the pixels are drawn as
+# tiles when the image becomes active, through the image cache or a tile pyramid for very large images
 class EditableImage:
-    def __init__(self, image_path, canvas: tk.Canvas, state_manager):
+    def __init__(self, image_path, canvas: tk.Canvas, state_manager, image_cache: ImageCache,
+                 label_index: LabelIndex, header: dict = None):
         self.image_path = image_path
         self.canvas = canvas
-
-        self.image = Image.open(image_path)
-        self.image_render = ImageTk.PhotoImage(self.image)
-        self.image_object = None
+        self.state_manager = state_manager
+        self.image_cache = image_cache
+        self.label_index = label_index
 
         self.annotation = Annotation(canvas, state_manager)
         self.annotations = []
         self.undo_stack = []
         self.redo_stack = []
 
-        self.width = self.image.width
-        self.height = self.image.height
-        self.file_name = os.path.basename(image_path)
-        self.date_captured = self.get_date_captured()
+        # Annotations whose box was undone, by the box, so that redoing the box brings back the same annotation
+        self.undone_annotations = {}
+
+        # Finds the annotations under the cursor. It follows self.annotations, which follows the boxes on the undo stack
+        self.spatial_index = SpatialIndex()
 
-    def get_date_captured(self):
-        exif_data = self.image.getexif()
-        for tag_id in exif_data:
-            if tag_id == 36867:
-                return exif_data.get(tag_id)
+        # The COCO annotations last exported for this image, rebuilt only after an edit. Images read from a coco file
+        # leave them as None, with the id to read them by, until the image is hydrated
+        self.coco_annotations = []
+        self.coco_id = None
+        self.dirty = True
 
+        if not header:
+            header = read_header(image_path)
+        self.width = header["width"]
+        self.height = header["height"]
+        self.file_name = header.get("file_name") or os.path.basename(image_path)
+        self.date_captured = header["date_captured"] or self.default_date_captured()
+
+    def default_date_captured(self):
         print(f"Date_created could not be found for {self.file_name}, defaulting to {date.today()}")
-        return date.today()
+        return str(date.today())
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    # Applies an edit read back from the annotation journal to the undo / redo stacks, without drawing anything
+    def apply_journal_op(self, op: dict):
+        if op["op"] == "bbox":
+            label = self.label_index.get(op["label"])
+            self.append_undo(BoundingBox(self.canvas, op["coords"], label, op["colour"]))
+            self.redo_stack = []
+        elif op["op"] == "segment":
+            bboxes = [undo for undo in self.undo_stack if type(undo) == BoundingBox]
+            if bboxes:
+                segment = Segment(self.canvas, bboxes[-1].colour, op["coords"][0], op["coords"][1])
+                segment.adjust_coords(op["coords"][2], op["coords"][3])
+                self.append_undo(segment)
+                self.redo_stack = []
+        elif op["op"] == "undo" and self.undo_stack:
+            self.append_redo(self.pop_undo())
+        elif op["op"] == "redo" and self.redo_stack:
+            self.append_undo(self.pop_redo())
+        elif op["op"] == "move":
+            start, end = self.annotation_range(op["position"])
+            for undo in self.undo_stack[start:end]:
+                undo.move(op["delta"][0], op["delta"][1])
+            self.redo_stack = []
+        elif op["op"] == "delete":
+            start, end = self.annotation_range(op["position"])
+            del self.undo_stack[start:end]
+            self.redo_stack = []
+
+    # Rebuilds the annotations from the undo stack, following the same rules as drawing them: a box starts a new
+    # annotation, and a polygon closes once a segment returns to its first vertex. A box that already had an
+    # annotation, current or undone, gets the same one back, keeping its crowd RLE
+    def rebuild_annotations(self):
+        known = {id(annotation.bbox): annotation for annotation in self.annotations}
+        known.update((id(bbox), annotation) for bbox, annotation in self.undone_annotations.values())
+        self.annotations = []
+        self.spatial_index.clear()
+        annotation = Annotation(self.canvas, self.state_manager)
+
+        for undo in self.undo_stack:
+            if type(undo) == BoundingBox:
+                annotation = known.get(id(undo)) or Annotation(self.canvas, self.state_manager)
+                annotation.set_label(undo.label_ref, undo.colour)
+                annotation.set_bbox(undo)
+                annotation.poly = None
+                annotation.polygons = []
+                self.annotations.append(annotation)
+                self.spatial_index.insert(annotation, undo.get_coords())
+            elif type(undo) == Polygon and annotation.bbox:
+                annotation.polygons.append(undo)
+            elif annotation.bbox:
+                if not annotation.poly:
+                    annotation.poly = Polygon(self.canvas, undo.colour, undo.start_x, undo.start_y)
+                annotation.poly.add_segment(undo)
+                annotation.poly.segment = undo
+
+                x, y = undo.get_coords()
+                if len(annotation.poly.vertices) >= 6 and (round(x), round(y)) == tuple(annotation.poly.vertices[:2]):
+                    annotation.polygons.append(annotation.poly)
+                    annotation.poly = None
+                else:
+                    annotation.poly.add_vertex(x, y)
+
+        # An unfinished polygon waits to be resumed from the end of its last segment, which adds that vertex back
+        if annotation.poly:
+            annotation.poly.segment = None
+            annotation.poly.pop_vertex()
+        self.annotation = annotation
+        self.dirty = True
+
+    def is_hydrated(self) -> bool:
+        return self.coco_annotations is not None
+
+    # Rebuilds the annotation objects and undo stack of an image from its COCO annotations, without drawing them
+    def hydrate(self, coco_annotations: list, id_category_map: dict, id_colour_map: dict, default_colour: str):
+        for coco_annotation in coco_annotations:
+            x, y, width, height = coco_annotation["bbox"]
+            label = self.label_index.get(id_category_map[coco_annotation["category_id"]])
+            colour = id_colour_map.get(label.name, default_colour)
+
+            annotation = Annotation(self.canvas, self.state_manager)
+            annotation.set_label(label, colour)
+            annotation.set_bbox(BoundingBox(self.canvas, [x, y, x + width, y + height], label, colour))
+            self.undo_stack.append(annotation.bbox)
+
+            segmentation = coco_annotation["segmentation"]
+            if isinstance(segmentation, dict):
+                annotation.rle = segmentation
+            else:
+                if segmentation and not isinstance(segmentation[0], list):
+                    segmentation = [segmentation]
+                for vertices in segmentation:
+                    polygon = Polygon.from_vertices(self.canvas, colour, vertices)
+                    annotation.polygons.append(polygon)
+                    self.undo_stack.append(polygon)
+
+            self.annotations.append(annotation)
+            self.spatial_index.insert(annotation, annotation.bbox.get_coords())
+            self.annotation = annotation
+
+        self.coco_annotations = coco_annotations
+
+    # Editing existing annotations
+    # Returns the annotations whose box holds the point, topmost first
+    def find_annotations(self, x: int, y: int, tolerance: int = 0) -> list:
+        return self.spatial_index.query_point(x, y, tolerance)
+
+    # The slice of the undo stack holding an annotation: its box and every segment drawn after it, up to the next box
+    def annotation_range(self, position: int) -> tuple:
+        bbox_positions = [i for i, undo in enumerate(self.undo_stack) if type(undo) == BoundingBox]
+        start = bbox_positions[position]
+        end = bbox_positions[position + 1] if position + 1 < len(bbox_positions) else len(self.undo_stack)
+
+        return start, end
+
+    # Moves an annotation that is already on the canvas. Edits to older annotations rewrite the undo stack, so
+    # whatever was undone can no longer be redone
+    def move_annotation(self, annotation: Annotation, delta_x: int, delta_y: int):
+        annotation.move(delta_x, delta_y)
+        self.update_annotation_extent(annotation)
+
+    def update_annotation_extent(self, annotation: Annotation):
+        self.spatial_index.update(annotation, annotation.bbox.get_coords())
+        self.redo_stack = []
+        self.dirty = True
+
+    def delete_annotation(self, annotation: Annotation):
+        start, end = self.annotation_range(self.annotations.index(annotation))
+        for undo in self.undo_stack[start:end]:
+            undo.delete()
+        del self.undo_stack[start:end]
+
+        self.annotations.remove(annotation)
+        self.spatial_index.remove(annotation)
+        if self.annotation is annotation and self.annotations:
+            self.annotation = self.annotations[-1]
+        elif self.annotation is annotation:
+            self.annotation = Annotation(self.canvas, self.state_manager)
+        self.redo_stack = []
+        self.dirty = True
 
     # Undo / redo stack actions
+    # Takes the last edit off the undo stack and out of the annotation it belongs to. The last annotation always owns
+    # the top of the stack, so once its box is undone the one before it becomes current
+    def undo(self):
+        undo = self.pop_undo()
+        self.append_redo(undo)
+        self.annotation.update_annotation_after_undo(undo)
+
+        if not self.annotation.is_active_bbox():
+            self.undone_annotations[id(undo)] = (undo, self.pop_annotation())
+            self.annotation = self.annotations[-1] if self.annotations else Annotation(self.canvas, self.state_manager)
+        return undo
+
+    # Puts the last undone edit back and rebuilds the annotations from the undo stack, as replaying the journal does,
+    # so that a drawn polygon comes back from its own segments. The segment that was following the cursor is dropped
+    def redo(self):
+        redo = self.pop_redo()
+        self.append_undo(redo)
+
+        poly = self.annotation.poly
+        if poly and poly.segment and not any(undo is poly.segment for undo in self.undo_stack):
+            poly.segment.delete()
+        self.rebuild_annotations()
+        self.undone_annotations.pop(id(redo), None)
+        return redo
+
     def pop_annotation(self):
-        return self.annotations.pop()
+        self.dirty = True
+        annotation = self.annotations.pop()
+        if annotation in self.spatial_index:
+            self.spatial_index.remove(annotation)
+        return annotation
 
     def pop_undo(self):
+        self.dirty = True
         return self.undo_stack.pop()
 
     def pop_redo(self):
         return self.redo_stack.pop()
 
     def append_annotation(self, annotation):
+        self.dirty = True
         self.annotations.append(annotation)
+        self.spatial_index.insert(annotation, annotation.bbox.get_coords())
 
     def append_undo(self, undo: tuple):
+        self.dirty = True
         self.undo_stack.append(undo)
 
     def append_redo(self, redo: tuple):
         self.redo_stack.append(redo)
 
     # Image changes
-    def activate_image(self):
-        self.canvas.configure(width=self.width, height=self.height)
-        self.image_object = self.canvas.create_image(self.width/2, self.height/2, image=self.image_render,
-                                                     anchor=tk.CENTER)
+    def activate_image(self, tile_layer: TileLayer):
+        tile_layer.set_source(make_tile_source(self.image_path, self.width, self.height, self.image_cache))
         for undo in self.undo_stack:
             undo.draw()
 
     def deactivate_image(self):
-        self.canvas.delete("all")
+        self.canvas.release_all()
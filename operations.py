@@ -53,28 +53,241 @@ def adjust_point(point, width, height, rel_x=0, rel_y=0):
     return x, y
 
 
-# Encodes annotation vertices to RLE encoded list
-def vertices_to_rle(bbox: list, vertices: list):
+# Batched versions of the functions above, which give the same answers on integer inputs. Points are arrays of shape
+# (..., 2) and segments of shape (..., 4), and arrays broadcast against each other as usual
+
+def as_coordinates(values):
+    values = np.asarray(values)
+    return values if values.dtype.kind == "f" else values.astype(np.int64)
+
+
+def orientations(p1, p2, p3):
+    p1, p2, p3 = as_coordinates(p1), as_coordinates(p2), as_coordinates(p3)
+    result = ((p2[..., 1] - p1[..., 1]) * (p3[..., 0] - p2[..., 0])
+              - (p2[..., 0] - p1[..., 0]) * (p3[..., 1] - p2[..., 1]))
+    return np.sign(result).astype(np.int8)
+
+
+# Checks every segment of one array against every segment of another, returning an (n, m) array
+def segments_intersect(segments_a, segments_b):
+    segments_a = as_coordinates(segments_a).reshape(-1, 4)[:, None, :]
+    segments_b = as_coordinates(segments_b).reshape(-1, 4)[None, :, :]
+    p1, p2 = segments_a[..., 0:2], segments_a[..., 2:4]
+    p3, p4 = segments_b[..., 0:2], segments_b[..., 2:4]
+
+    return ((orientations(p1, p2, p3) != orientations(p1, p2, p4))
+            & (orientations(p3, p4, p1) != orientations(p3, p4, p2)))
+
+
+# Checks many points against one polygon, counting crossings of a ray from each point out to the given width, with the
+# same edges as check_inside_polygon
+def points_in_polygon(vertices, points, width):
+    vertices = as_coordinates(vertices).reshape(-1, 2)
+    points = as_coordinates(points).reshape(-1, 2)[:, None, :]
+    ends = np.stack((np.full(points.shape[0], width), points[:, 0, 1]), axis=-1)[:, None, :]
+    v_1, v_2 = vertices[None, :-1], vertices[None, 1:]
+
+    crossings = ((orientations(v_1, v_2, points) != orientations(v_1, v_2, ends))
+                 & (orientations(points, ends, v_1) != orientations(points, ends, v_2)))
+    return crossings.sum(axis=1) % 2 == 1
+
+
+def clamp_points(points, width, height, rel_x=0, rel_y=0):
+    points = as_coordinates(points).reshape(-1, 2)
+    return np.stack((np.clip(points[:, 0], rel_x, width + rel_x), np.clip(points[:, 1], rel_y, height + rel_y)),
+                    axis=-1)
+
+
+# Shoelace areas of many polygons at once, given as one flat x, y buffer and the offset of each polygon in it, ending
+# with the length of the buffer
+def polygon_areas(vertices, offsets):
+    points = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64) // 2
+    starts, ends = offsets[:-1], offsets[1:]
+    areas = np.zeros(len(starts))
+    filled = ends > starts
+    if not filled.any():
+        return areas
+
+    # Each vertex is paired with the next one in its own polygon, wrapping the last back round to the first
+    following = np.arange(1, len(points) + 1)
+    following[ends[filled] - 1] = starts[filled]
+    cross = points[:, 0] * points[following, 1] - points[following, 0] * points[:, 1]
+    areas[filled] = np.abs(np.add.reduceat(cross, starts[filled])) / 2
+    return areas
+
+
+def polygon_area(vertices) -> float:
+    return float(polygon_areas(vertices, [0, len(vertices)])[0])
+
+
+# Fills a boolean mask of the given width and height with the even-odd interior of a polygon, one scanline per row.
+# Pixel (x, y) is inside when its centre (x + 0.5, y + 0.5), offset by rel_x and rel_y, lies inside the polygon
+def polygon_mask(vertices, width, height, rel_x=0, rel_y=0):
+    points = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+    mask = np.zeros((height, width), dtype=bool)
+    if len(points) < 3 or width <= 0 or height <= 0:
+        return mask
+
+    x_1, y_1 = points[:, 0], points[:, 1]
+    x_2, y_2 = np.roll(x_1, -1), np.roll(y_1, -1)
+
+    # Horizontal edges never cross a scanline, so they are dropped before broadcasting rows against edges
+    sloped = y_1 != y_2
+    x_1, y_1, x_2, y_2 = x_1[sloped], y_1[sloped], x_2[sloped], y_2[sloped]
+
+    rows = np.arange(height, dtype=np.float64)[:, None] + rel_y + 0.5
+    crosses = (y_1 <= rows) != (y_2 <= rows)
+    cross_x = x_1 + (rows - y_1) * (x_2 - x_1) / (y_2 - y_1)
+
+    # Every crossing toggles the parity of all pixels whose centre lies to its right
+    row_index, edge_index = np.nonzero(crosses)
+    columns = np.ceil(cross_x[row_index, edge_index] - rel_x - 0.5).astype(np.int64)
+    np.clip(columns, 0, width, out=columns)
+
+    toggles = np.zeros((height, width + 1), dtype=np.uint8)
+    np.add.at(toggles, (row_index, columns), 1)
+    mask[:] = np.cumsum(toggles[:, :width], axis=1, dtype=np.uint8) & 1
+
+    return mask
+
+
+# Encodes a boolean mask to uncompressed COCO RLE counts (column-major, starting with a run of zeros)
+def mask_to_rle(mask):
+    flat = np.asarray(mask, dtype=bool).ravel(order="F")
+    if flat.size == 0:
+        return []
+
+    boundaries = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], boundaries, [flat.size])))
+    if flat[0]:
+        counts = np.concatenate(([0], counts))
+
+    return counts.tolist()
+
+
+# Decodes uncompressed COCO RLE counts back to a boolean mask of the given height and width
+def rle_to_mask(counts, height, width):
+    values = np.zeros(len(counts), dtype=bool)
+    values[1::2] = True
+    flat = np.repeat(values, np.asarray(counts, dtype=np.int64))
+    return flat.reshape((width, height)).T
+
+
+# Encodes annotation vertices to RLE encoded list, covering the bbox region or, when a size is given, the full image
+def vertices_to_rle(bbox: list, vertices: list, size: list = None):
+    if size:
+        mask = polygon_mask(vertices, size[0], size[1])
+    else:
+        mask = polygon_mask(vertices, bbox[2], bbox[3], rel_x=bbox[0], rel_y=bbox[1])
+
+    return mask_to_rle(mask)
+
+
+# Encodes the union of several polygons to uncompressed RLE counts over a whole image of the given width and height.
+# The polygons are only rasterized over their own extent, and the runs of that region are placed in the image's
+# column-major order, so the full image mask is never built
+def polygons_to_rle(polygons: list, width: int, height: int) -> list:
+    points = np.concatenate([np.asarray(vertices, dtype=np.float64).reshape(-1, 2) for vertices in polygons])
+    left, top = max(int(np.floor(points[:, 0].min())), 0), max(int(np.floor(points[:, 1].min())), 0)
+    right, bottom = min(int(np.ceil(points[:, 0].max())), width), min(int(np.ceil(points[:, 1].max())), height)
+    if right <= left or bottom <= top:
+        return [width * height]
+
+    mask = np.zeros((bottom - top, right - left), dtype=bool)
+    for vertices in polygons:
+        mask |= polygon_mask(vertices, right - left, bottom - top, rel_x=left, rel_y=top)
+
+    # Runs start and end where a padded column changes value, found column by column to keep column-major order
+    padded = np.pad(mask, ((1, 1), (0, 0))).astype(np.int8)
+    columns, rows = np.nonzero(np.diff(padded, axis=0).T)
+    boundaries = (columns + left) * height + rows + top
+
+    # A run that ends at the bottom of one column and carries on at the top of the next leaves the same boundary twice
+    boundaries, repeats = np.unique(boundaries, return_counts=True)
+    boundaries = boundaries[(repeats == 1) & (boundaries < width * height)]
+
+    return np.diff(np.concatenate(([0], boundaries, [width * height]))).tolist()
+
+
+# Compresses RLE counts to the COCO string form. Each count past the second is stored as its difference from the count
+# two before it, then written five bits at a time, low bits first, as characters from "0" upwards with 0x20 set on
+# every character but the last. 0x10 of the last character holds the sign
+def rle_to_string(counts: list) -> str:
+    characters = []
+    for index, count in enumerate(counts):
+        value = count - counts[index - 2] if index > 2 else count
+        more = True
+        while more:
+            character = value & 0x1f
+            value >>= 5
+            more = value != -1 if character & 0x10 else value != 0
+            if more:
+                character |= 0x20
+            characters.append(chr(character + 48))
+
+    return "".join(characters)
+
+
+def rle_from_string(string: str) -> list:
+    counts = []
+    position = 0
+    while position < len(string):
+        value = 0
+        shift = 0
+        more = True
+        while more:
+            character = ord(string[position]) - 48
+            value |= (character & 0x1f) << shift
+            more = character & 0x20
+            position += 1
+            shift += 5
+            if not more and character & 0x10:
+                value |= -1 << shift
+        if len(counts) > 2:
+            value += counts[-2]
+        counts.append(value)
+
+    return counts
+
+
+# Encodes the crowd annotations of one image, each given as the image size, [height, width], and the vertices of its
+# polygons, to the union of its polygons as compressed RLE along with the area it covers. Takes and returns plain
+# values so it can run in a worker
+def encode_crowd_annotations(crowds: list) -> list:
+    encoded = []
+    for size, polygons in crowds:
+        counts = polygons_to_rle(polygons, size[1], size[0])
+        encoded.append((rle_to_string(counts), sum(counts[1::2])))
+
+    return encoded
+
+
+# A per-pixel reference for checking the scanline rasterizer against. Every pixel centre of the bbox is tested on its
+# own against the closed polygon, with the same even-odd rule, and the runs are counted in column-major order
+def vertices_to_rle_naive(bbox: list, vertices: list):
+    points = list(zip(vertices[::2], vertices[1::2]))
+    edges = list(zip(points, points[1:] + points[:1]))
+
     rle_list = []
     current_count = 0
     current_type = False
-    for i in range(bbox[3]):
-        for j in range(bbox[2]):
-            y = i + bbox[0]
-            x = j + bbox[1]
-            if check_inside_polygon(vertices, (x, y), bbox[2]):
-                if current_type:
-                    current_count += 1
-                else:
-                    rle_list.append(current_count)
-                    current_count = 1
-                current_type = True
+    for j in range(bbox[2]):
+        for i in range(bbox[3]):
+            x = j + bbox[0] + 0.5
+            y = i + bbox[1] + 0.5
+            crossings = 0
+            for (x_1, y_1), (x_2, y_2) in edges:
+                if (y_1 <= y) != (y_2 <= y) and x_1 + (y - y_1) * (x_2 - x_1) / (y_2 - y_1) <= x:
+                    crossings += 1
+
+            if bool(crossings % 2) == current_type:
+                current_count += 1
             else:
-                if current_type:
-                    rle_list.append(current_count)
-                    current_count = 1
-                else:
-                    current_count += 1
-                current_type = False
+                rle_list.append(current_count)
+                current_count = 1
+                current_type = not current_type
 
+    if current_count:
+        rle_list.append(current_count)
     return rle_list
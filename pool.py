@@ -0,0 +1,33 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+
+# Runs a function over items across a process pool, yielding results in item order. Only a few items per worker are in
+# flight at once, so a lazily read dataset is consumed at the pace of the workers rather than queued up front. With a
+# single worker everything runs in this process
+def map_ordered(function, items, workers: int = None, backlog: int = 2):
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        yield from map(function, items)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= workers * backlog:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+# Groups items into lists of chunk_size, for handing to workers a chunk at a time
+def iter_chunks(items, chunk_size: int):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
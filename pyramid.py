@@ -0,0 +1,300 @@
+from PIL import Image, ImageFile, ImageTk
+import hashlib
+import math
+import os
+
+from cache import CanvasPool
+from scanner import allow_large_images
+
+TILE_SIZE = 512
+# Images with a side longer than this are cut into a tile pyramid on disk rather than being decoded whole
+PYRAMID_THRESHOLD = 4096
+# Pillow keeps the parts of a file to decode as named tuples from 11 on, and plain tuples before
+Tile = getattr(ImageFile, "_Tile", lambda *fields: fields)
+
+
+# Whether an image is large enough to be shown through a TilePyramid
+def needs_pyramid(width: int, height: int) -> bool:
+    return max(width, height) > PYRAMID_THRESHOLD
+
+
+# Decodes an image at 1 / 2 ** level of its full resolution. JPEGs are decoded straight to a smaller scale through
+# draft, and whatever scaling is left is done with reduce, so a full resolution copy is only made for level 0
+def decode_level(image_path: str, level: int) -> Image.Image:
+    factor = 2 ** level
+    with allow_large_images(), Image.open(image_path) as image:
+        width = image.width
+        image.draft(image.mode, (math.ceil(image.width / factor), math.ceil(image.height / factor)))
+        remaining = factor // round(width / image.width)
+        if remaining > 1:
+            return image.reduce(remaining)
+
+        image.load()
+        return image.copy()
+
+
+# Cuts a level image into tiles of tile_size, yielding (column, row, tile)
+def cut_tiles(image: Image.Image, tile_size: int):
+    for row in range(math.ceil(image.height / tile_size)):
+        for column in range(math.ceil(image.width / tile_size)):
+            box = (column * tile_size, row * tile_size, min((column + 1) * tile_size, image.width),
+                   min((row + 1) * tile_size, image.height))
+            yield column, row, image.crop(box)
+
+
+# The bytes one row of uncompressed pixel data width pixels wide takes, or None if Pillow can't say
+def raw_line_size(image: Image.Image, width: int, rawmode: str, stride: int):
+    if stride:
+        return abs(stride)
+    try:
+        return len(Image.new(image.mode, (width, 1)).tobytes("raw", rawmode))
+    except (ValueError, OSError):
+        return None
+
+
+# The parts of an opened image's pixel data that cover rows top to bottom, as (band_top, band_bottom, tiles) with the
+# tiles moved up to start at band_top, or None when the data can't be decoded a part at a time. Uncompressed rows, as
+# in BMP and uncompressed TIFF, are cut at the band's edges. Other strips and tiles are taken whole, which can make
+# the band a little taller, unless one covers the whole image, as a JPEG, PNG or compressed TIFF does
+def band_tiles(image: Image.Image, top: int, bottom: int):
+    parts = []
+    for decoder, (x_0, y_0, x_1, y_1), offset, args in image.tile:
+        if y_1 <= top or y_0 >= bottom:
+            continue
+        if decoder == "raw" and isinstance(args, tuple) and len(args) == 3:
+            rawmode, stride, orientation = args
+            line_size = raw_line_size(image, x_1 - x_0, rawmode, stride)
+            if line_size is None:
+                return None
+            start, end = max(y_0, top), min(y_1, bottom)
+            skipped = start - y_0 if orientation >= 0 else y_1 - end
+            parts.append((decoder, (x_0, start, x_1, end), offset + skipped * line_size, args))
+        elif (y_0, y_1) == (0, image.height) and len(image.tile) == 1:
+            return None
+        else:
+            parts.append((decoder, (x_0, y_0, x_1, y_1), offset, args))
+
+    if not parts:
+        return None
+    band_top = min(extents[1] for _decoder, extents, _offset, _args in parts)
+    band_bottom = max(extents[3] for _decoder, extents, _offset, _args in parts)
+    tiles = [Tile(decoder, (x_0, y_0 - band_top, x_1, y_1 - band_top), offset, args)
+             for decoder, (x_0, y_0, x_1, y_1), offset, args in parts]
+    return band_top, band_bottom, tiles
+
+
+# Decodes rows top to bottom of an image at full resolution without the rest of it, or returns None for formats that
+# can only be decoded whole
+def read_band(image_path: str, top: int, bottom: int):
+    with allow_large_images(), Image.open(image_path) as image:
+        parts = band_tiles(image, top, bottom)
+        if parts is None:
+            return None
+
+        band_top, band_bottom, tiles = parts
+        image._size = (image.width, band_bottom - band_top)
+        if hasattr(image, "_tile_size"):
+            # TIFF allocates its whole image from this rather than from the size
+            image._tile_size = image.size
+        image.tile = tiles
+        image.load()
+        return image.crop((0, top - band_top, image.width, bottom - band_top))
+
+
+# Joins a band of rows onto the bottom of the rows above it
+def stack_bands(upper: Image.Image, lower: Image.Image) -> Image.Image:
+    image = Image.new(upper.mode, (upper.width, upper.height + lower.height))
+    image.paste(upper, (0, 0))
+    image.paste(lower, (0, upper.height))
+    return image
+
+
+# A multi-resolution pyramid of tiles for one very large image, kept in `.tiles` next to it. Level 0 is full
+# resolution and each level above halves it, up to one that fits in a single tile. Levels are built the first time
+# they are asked for, along with every coarser level that is still missing, and are reused until the image changes
+class TilePyramid:
+    def __init__(self, image_path: str, width: int, height: int, image_cache, tile_size: int = TILE_SIZE):
+        self.image_path = image_path
+        self.width = width
+        self.height = height
+        self.image_cache = image_cache
+        self.tile_size = tile_size
+        self.level_count = max(math.ceil(math.log2(max(width, height) / tile_size)), 0) + 1
+
+        stat = os.stat(image_path)
+        key = f"{os.path.basename(image_path)}:{stat.st_mtime_ns}:{stat.st_size}"
+        self.tile_dir = os.path.join(os.path.dirname(image_path), ".tiles", hashlib.sha1(key.encode()).hexdigest())
+
+    def level_dir(self, level: int) -> str:
+        return os.path.join(self.tile_dir, str(level))
+
+    def tile_path(self, level: int, column: int, row: int) -> str:
+        return os.path.join(self.level_dir(level), f"{column}_{row}.png")
+
+    # A level only counts as built once all its tiles are written, so a build cut short is redone
+    def is_built(self, level: int) -> bool:
+        return os.path.exists(os.path.join(self.level_dir(level), "complete"))
+
+    # Yields the image a row of tiles at a time, as (level, band), at full resolution where the file can be read in
+    # bands. A JPEG asked for at a coarser level is decoded straight to it through draft instead, and anything else
+    # that can only be decoded whole, such as a PNG or a compressed TIFF, is decoded whole and cut up afterwards
+    def iter_bands(self, level: int):
+        with allow_large_images(), Image.open(self.image_path) as image:
+            drafted = level > 0 and image.format == "JPEG"
+            banded = not drafted and band_tiles(image, 0, min(self.tile_size, image.height)) is not None
+
+        if banded:
+            for top in range(0, self.height, self.tile_size):
+                yield 0, read_band(self.image_path, top, min(top + self.tile_size, self.height))
+        else:
+            start = level if drafted else 0
+            image = decode_level(self.image_path, start)
+            for top in range(0, image.height, self.tile_size):
+                yield start, image.crop((0, top, image.width, min(top + self.tile_size, image.height)))
+
+    # Builds a level along with every coarser one still missing. Each band is cut into tiles and halved for the level
+    # above, which cuts a row of tiles once two halves have gathered, so only about a band of each level is held at
+    # once rather than a whole level. Levels finer than the one asked for are passed through without being written
+    def build_level(self, level: int):
+        pending = {}
+        rows = {}
+
+        def add_band(current: int, band: Image.Image, last: bool):
+            if current in pending:
+                band = stack_bands(pending.pop(current), band)
+            if band.height < self.tile_size and not last:
+                pending[current] = band
+                return
+
+            if current >= level and not self.is_built(current):
+                row = rows.get(current, 0)
+                os.makedirs(self.level_dir(current), exist_ok=True)
+                for column, _row, tile in cut_tiles(band, self.tile_size):
+                    tile.save(self.tile_path(current, column, row), compress_level=1)
+            rows[current] = rows.get(current, 0) + 1
+
+            if current + 1 < self.level_count:
+                add_band(current + 1, band.reduce(2), last)
+
+        previous = None
+        for current, band in self.iter_bands(level):
+            if previous:
+                add_band(*previous, last=False)
+            previous = (current, band)
+        if previous:
+            add_band(*previous, last=True)
+
+        for current in range(level, self.level_count):
+            os.makedirs(self.level_dir(current), exist_ok=True)
+            open(os.path.join(self.level_dir(current), "complete"), "w").close()
+
+    def get_tile(self, level: int, column: int, row: int):
+        if not self.is_built(level):
+            self.build_level(level)
+
+        path = self.tile_path(level, column, row)
+        if not os.path.exists(path):
+            return None
+        return self.image_cache.get(path)
+
+
+# The same interface for an image small enough to decode whole: a single level, cut from the cached image on demand
+class ImageTiles:
+    def __init__(self, image_path: str, width: int, height: int, image_cache, tile_size: int = TILE_SIZE):
+        self.image_path = image_path
+        self.width = width
+        self.height = height
+        self.image_cache = image_cache
+        self.tile_size = tile_size
+        self.level_count = 1
+
+    def get_tile(self, _level: int, column: int, row: int):
+        image = self.image_cache.get(self.image_path)
+        box = (column * self.tile_size, row * self.tile_size, min((column + 1) * self.tile_size, image.width),
+               min((row + 1) * self.tile_size, image.height))
+        if box[0] >= box[2] or box[1] >= box[3]:
+            return None
+        return image.crop(box)
+
+
+def make_tile_source(image_path: str, width: int, height: int, image_cache):
+    if needs_pyramid(width, height):
+        return TilePyramid(image_path, width, height, image_cache)
+    return ImageTiles(image_path, width, height, image_cache)
+
+
+# Picks the coarsest level that still has at least one pixel for each pixel on the canvas
+def choose_level(source, scale: float) -> int:
+    if scale >= 1:
+        return 0
+    return min(int(math.floor(math.log2(1 / scale))), source.level_count - 1)
+
+
+# Draws the tiles of the active image that fall inside the canvas, and hides the ones that scroll out of it. Tile items
+# come from a pool tagged "tile", are reused for whichever tile is needed next, and are kept below the annotations
+class TileLayer:
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.pool = CanvasPool(canvas, "tile")
+        self.source = None
+        self.items = {}
+        self.scale = None
+
+    def set_source(self, source):
+        self.clear()
+        self.source = source
+
+    def clear(self):
+        self.pool.release_all()
+        self.items = {}
+        self.scale = None
+
+    # Drops track of the tiles, once the canvas has deleted them itself
+    def forget(self):
+        self.pool.forget()
+        self.source = None
+        self.items = {}
+        self.scale = None
+
+    def render(self, view, canvas_width: int, canvas_height: int):
+        if not self.source:
+            return
+        if view.scale != self.scale:
+            self.clear()
+            self.scale = view.scale
+
+        level = choose_level(self.source, view.scale)
+        span = self.source.tile_size * 2 ** level
+        left, top = view.to_image(0, 0)
+        right, bottom = view.to_image(canvas_width, canvas_height)
+        columns = range(max(int(left // span), 0), min(int(right // span), math.ceil(self.source.width / span) - 1) + 1)
+        rows = range(max(int(top // span), 0), min(int(bottom // span), math.ceil(self.source.height / span) - 1) + 1)
+
+        visible = {(level, column, row) for column in columns for row in rows}
+        for key in list(self.items):
+            if key not in visible:
+                self.pool.release(self.items.pop(key)[0])
+
+        for key in visible:
+            if key in self.items:
+                x, y = view.to_canvas(key[1] * span, key[2] * span)
+                self.canvas.coords(self.items[key][0], round(x), round(y))
+            else:
+                self.draw_tile(key, view, span)
+        self.canvas.tag_lower("tile")
+
+    def draw_tile(self, key: tuple, view, span: int):
+        level, column, row = key
+        tile = self.source.get_tile(level, column, row)
+        if tile is None:
+            return
+
+        tile_scale = view.scale * 2 ** level
+        if tile_scale != 1:
+            size = (max(round(tile.width * tile_scale), 1), max(round(tile.height * tile_scale), 1))
+            tile = tile.resize(size, Image.NEAREST if tile_scale > 1 else Image.BILINEAR)
+
+        photo = ImageTk.PhotoImage(tile)
+        x, y = view.to_canvas(column * span, row * span)
+        item = self.pool.acquire("image", (round(x), round(y)), {"image": photo, "anchor": "nw"})
+        self.items[key] = (item, photo)
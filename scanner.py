@@ -0,0 +1,149 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+import os
+import threading
+from PIL import Image
+
+IMAGE_TYPES = {".jpg", ".png", ".bmp", ".tif", ".tiff"}
+DATE_TIME_ORIGINAL = 36867
+EXIF_IFD = 0x8769
+
+# Aerial images run far past Pillow's decompression bomb limit, so it is raised to this while one is opened for its
+# header or for the tile pyramid, and left as Pillow sets it everywhere else
+LARGE_IMAGE_PIXELS = 2 ** 32
+large_image_lock = threading.Lock()
+large_image_users = 0
+default_image_pixels = Image.MAX_IMAGE_PIXELS
+
+
+# Raises the limit for as long as any thread is inside, and puts it back once the last one leaves
+@contextmanager
+def allow_large_images():
+    global large_image_users, default_image_pixels
+    with large_image_lock:
+        if not large_image_users:
+            default_image_pixels = Image.MAX_IMAGE_PIXELS
+            Image.MAX_IMAGE_PIXELS = LARGE_IMAGE_PIXELS
+        large_image_users += 1
+    try:
+        yield
+    finally:
+        with large_image_lock:
+            large_image_users -= 1
+            if not large_image_users:
+                Image.MAX_IMAGE_PIXELS = default_image_pixels
+
+
+# Lists every image below a directory with os.scandir, matching extensions case-insensitively
+def find_images(directory: str, recursive: bool = True) -> list:
+    image_paths = []
+    pending = [directory]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        pending.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in IMAGE_TYPES:
+                    image_paths.append(entry.path)
+
+    image_paths.sort()
+    return image_paths
+
+
+# Reads the dimensions and capture date of an image from its header, without decoding any pixels
+def read_header(image_path: str) -> dict:
+    with allow_large_images(), Image.open(image_path) as image:
+        width, height = image.size
+        exif_data = image.getexif()
+        date_captured = exif_data.get(DATE_TIME_ORIGINAL)
+        if date_captured is None and EXIF_IFD in exif_data:
+            date_captured = exif_data.get_ifd(EXIF_IFD).get(DATE_TIME_ORIGINAL)
+
+    return {"width": width,
+            "height": height,
+            "date_captured": date_captured}
+
+
+# Reads a chunk of headers, leaving None in place of any file that Pillow can't identify or won't open
+def read_headers(image_paths: list) -> list:
+    headers = []
+    for image_path in image_paths:
+        try:
+            headers.append(read_header(image_path))
+        except (OSError, Image.DecompressionBombError):
+            headers.append(None)
+
+    return headers
+
+
+# Reads image headers across a process pool and hands them back in directory order as chunks complete. Headers that
+# are already known are passed through without touching the file. The first chunk holds a single image, so it can
+# be shown before the rest of the scan finishes
+class HeaderScanner:
+    def __init__(self, image_paths: list, chunk_size: int = 64, workers: int = None, known: dict = None):
+        self.image_paths = image_paths
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.known = known or {}
+
+        self.executor = None
+        self.chunks = []
+        self.position = 0
+
+    def start(self):
+        runs = []
+        for image_path in self.image_paths:
+            is_known = image_path in self.known
+            if runs and runs[-1][0] == is_known:
+                limit = self.chunk_size if len(runs) > 1 else 1
+                if is_known or len(runs[-1][1]) < limit:
+                    runs[-1][1].append(image_path)
+                    continue
+            runs.append((is_known, [image_path]))
+
+        stale_runs = sum(1 for is_known, _chunk in runs if not is_known)
+        if stale_runs:
+            workers = min(self.workers or os.cpu_count() or 1, stale_runs)
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+
+        for is_known, chunk in runs:
+            if is_known:
+                self.chunks.append((chunk, [self.known[image_path] for image_path in chunk]))
+            else:
+                self.chunks.append((chunk, self.executor.submit(read_headers, chunk)))
+
+    def done(self) -> bool:
+        return self.position >= len(self.chunks)
+
+    # Returns (path, header) pairs for every finished chunk that follows on from the ones already returned
+    def poll(self, wait: bool = False) -> list:
+        ready = []
+        while not self.done():
+            chunk, headers = self.chunks[self.position]
+            if isinstance(headers, Future):
+                if not (wait or headers.done()):
+                    break
+                headers = headers.result()
+            ready.extend((path, header) for path, header in zip(chunk, headers) if header)
+            self.position += 1
+            if wait and ready:
+                break
+
+        if self.done():
+            self.close()
+        return ready
+
+    def drain(self) -> list:
+        ready = []
+        while not self.done():
+            ready.extend(self.poll(wait=True))
+        return ready
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.position = len(self.chunks)
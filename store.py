@@ -0,0 +1,278 @@
+import numpy as np
+
+from operations import polygon_areas
+
+# The annotation fields held as columns, in the order they are written out
+BBOX_FIELDS = ("x", "y", "width", "height")
+KNOWN_FIELDS = {"id", "image_id", "category_id", "segmentation", "area", "bbox", "iscrowd"}
+
+
+# A column turns to floats as soon as one value in it is a float, so whole numbers are written back as ints again
+def as_number(value):
+    value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+# Holds every annotation of a dataset as columns rather than as one dict per annotation: NumPy arrays for image_id,
+# category_id, the bbox, area and iscrowd, and one flat vertex buffer with an offset per annotation for single
+# polygon segmentations, flagged where the polygon was nested in a list of its own as COCO writes it, and where it has
+# float vertices, since one float polygon turns the whole buffer to floats. Rows are grouped
+# by image and a row's position is its annotation id. Anything that doesn't fit the columns, such as RLE or
+# multi-polygon segmentations and extra keys, is kept per row on the side
+class AnnotationStore:
+    def __init__(self, columns: dict = None, vertex_offsets=None, vertices=None, segmentations: dict = None,
+                 extras: dict = None):
+        columns = columns or {}
+        self.image_id = columns.get("image_id", np.zeros(0, dtype=np.int64))
+        self.category_id = columns.get("category_id", np.zeros(0, dtype=np.int64))
+        self.x = columns.get("x", np.zeros(0))
+        self.y = columns.get("y", np.zeros(0))
+        self.width = columns.get("width", np.zeros(0))
+        self.height = columns.get("height", np.zeros(0))
+        self.area = columns.get("area", np.zeros(0))
+        self.iscrowd = columns.get("iscrowd", np.zeros(0, dtype=bool))
+
+        self.nested = columns.get("nested", np.zeros(0, dtype=bool))
+        self.float_vertices = columns.get("float_vertices", np.zeros(0, dtype=bool))
+
+        self.vertex_offsets = vertex_offsets if vertex_offsets is not None else np.zeros(1, dtype=np.int64)
+        self.vertices = vertices if vertices is not None else np.zeros(0, dtype=np.int32)
+        self.segmentations = segmentations or {}
+        self.extras = extras or {}
+
+    def __len__(self) -> int:
+        return len(self.image_id)
+
+    # Builds a store from (image_id, annotations) groups, as yielded by InfoManager.iter_annotation_groups. Values are
+    # gathered in lists and turned into arrays once, which keeps ints as ints and floats as floats when written back
+    @classmethod
+    def from_groups(cls, annotation_groups):
+        values = {field: [] for field in ("image_id", "category_id", "area", "iscrowd") + BBOX_FIELDS}
+        nested = []
+        float_vertices = []
+        vertex_offsets = [0]
+        vertices = []
+        segmentations = {}
+        extras = {}
+
+        row = 0
+        for image_id, annotations in annotation_groups:
+            for annotation in annotations:
+                values["image_id"].append(image_id)
+                values["category_id"].append(annotation["category_id"])
+                values["area"].append(annotation["area"])
+                values["iscrowd"].append(annotation["iscrowd"])
+                for field, value in zip(BBOX_FIELDS, annotation["bbox"]):
+                    values[field].append(value)
+
+                segmentation = annotation["segmentation"]
+                is_nested = (isinstance(segmentation, list) and len(segmentation) == 1
+                             and isinstance(segmentation[0], list))
+                if is_nested:
+                    segmentation = segmentation[0]
+                nested.append(is_nested)
+                if isinstance(segmentation, list) and all(not isinstance(value, list) for value in segmentation):
+                    vertices.extend(segmentation)
+                    float_vertices.append(any(isinstance(value, float) for value in segmentation))
+                else:
+                    segmentations[row] = segmentation
+                    float_vertices.append(False)
+                vertex_offsets.append(len(vertices))
+
+                extra = {key: value for key, value in annotation.items() if key not in KNOWN_FIELDS}
+                if extra:
+                    extras[row] = extra
+                row += 1
+
+        columns = {field: np.asarray(column) if column else np.zeros(0) for field, column in values.items()}
+        columns["image_id"] = columns["image_id"].astype(np.int64)
+        columns["category_id"] = columns["category_id"].astype(np.int64)
+        if not values["iscrowd"]:
+            columns["iscrowd"] = columns["iscrowd"].astype(bool)
+        columns["nested"] = np.asarray(nested, dtype=bool)
+        columns["float_vertices"] = np.asarray(float_vertices, dtype=bool)
+
+        vertices = np.asarray(vertices) if vertices else np.zeros(0, dtype=np.int32)
+        if vertices.dtype.kind == "i" and (not len(vertices) or np.abs(vertices).max() < 2 ** 31):
+            vertices = vertices.astype(np.int32)
+
+        store = cls(columns, np.asarray(vertex_offsets, dtype=np.int64), vertices, segmentations, extras)
+        if len(store) and np.any(np.diff(store.image_id) < 0):
+            raise ValueError("Annotation groups must be given in image order")
+        return store
+
+    # Builds the store for the next save out of this one. Images in reused, mapped from their new id to their id here,
+    # keep their rows as they are, gathered with array indexing, and the groups given for every other image are added
+    # as from_groups would. Only the new groups are read one annotation at a time. Category ids in category_map, such
+    # as those of merged categories, are rewritten to the id they map to
+    def rebuild(self, reused: dict, annotation_groups, category_map: dict = None):
+        fresh = AnnotationStore.from_groups(annotation_groups)
+        old_ids = np.fromiter(reused.values(), dtype=np.int64, count=len(reused))
+        new_ids = np.full(max(int(self.image_id.max()) if len(self) else -1, old_ids.max(initial=-1)) + 1, -1,
+                          dtype=np.int64)
+        new_ids[old_ids] = np.fromiter(reused.keys(), dtype=np.int64, count=len(reused))
+        kept = np.flatnonzero(new_ids[self.image_id] >= 0)
+
+        # Fresh rows come after the kept ones, and a stable sort by image puts every row at its new position
+        image_id = np.concatenate((new_ids[self.image_id[kept]], fresh.image_id))
+        order = np.argsort(image_id, kind="stable")
+
+        def gather(column: np.ndarray, fresh_column: np.ndarray) -> np.ndarray:
+            parts = [part for part in (column[kept], fresh_column) if len(part)]
+            joined = np.concatenate(parts) if len(parts) > 1 else parts[0] if parts else column[:0]
+            return joined[order]
+
+        columns = {field: gather(getattr(self, field), getattr(fresh, field))
+                   for field in ("category_id", "area", "iscrowd", "nested", "float_vertices") + BBOX_FIELDS}
+        columns["image_id"] = image_id[order]
+        for old_id, new_id in (category_map or {}).items():
+            columns["category_id"][columns["category_id"] == old_id] = new_id
+
+        # Each row's vertices are copied out of one buffer holding both stores, in the rows' new order
+        buffer = np.concatenate((self.vertices, fresh.vertices))
+        starts = np.concatenate((self.vertex_offsets[:-1][kept], fresh.vertex_offsets[:-1] + len(self.vertices)))[order]
+        lengths = np.concatenate((np.diff(self.vertex_offsets)[kept], np.diff(fresh.vertex_offsets)))[order]
+        vertex_offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        vertices = buffer[np.repeat(starts - vertex_offsets[:-1], lengths) + np.arange(vertex_offsets[-1])]
+        if vertices.dtype.kind == "f" and not columns["float_vertices"].any():
+            vertices = vertices.astype(np.int64)
+        if vertices.dtype.kind == "i" and (not len(vertices) or np.abs(vertices).max() < 2 ** 31):
+            vertices = vertices.astype(np.int32)
+
+        # The side tables are keyed by row, so their entries move to where their rows went
+        rows = np.empty(len(order), dtype=np.int64)
+        rows[order] = np.arange(len(order))
+        tables = []
+        for table, fresh_table in ((self.segmentations, fresh.segmentations), (self.extras, fresh.extras)):
+            old_rows = np.fromiter(table.keys(), dtype=np.int64, count=len(table))
+            positions = np.minimum(np.searchsorted(kept, old_rows), max(len(kept) - 1, 0))
+            moved = {rows[position].item(): value
+                     for row, position, value in zip(old_rows.tolist(), positions.tolist(), table.values())
+                     if len(kept) and kept[position] == row}
+            moved.update((rows[len(kept) + row].item(), value) for row, value in fresh_table.items())
+            tables.append(moved)
+
+        return AnnotationStore(columns, vertex_offsets, vertices, *tables)
+
+    def segmentation(self, row: int):
+        if row in self.segmentations:
+            return self.segmentations[row]
+
+        vertices = self.vertices[self.vertex_offsets[row]:self.vertex_offsets[row + 1]]
+        if vertices.dtype.kind == "f" and not self.float_vertices[row]:
+            vertices = vertices.astype(np.int64)
+        vertices = vertices.tolist()
+        return [vertices] if self.nested[row] else vertices
+
+    def bbox(self, row: int) -> list:
+        return [as_number(self.x[row]), as_number(self.y[row]), as_number(self.width[row]), as_number(self.height[row])]
+
+    # Turns a row back into a COCO annotation, with its row as its id
+    def annotation(self, row: int) -> dict:
+        annotation = {"id": row,
+                      "image_id": self.image_id[row].item(),
+                      "category_id": self.category_id[row].item(),
+                      "segmentation": self.segmentation(row),
+                      "area": as_number(self.area[row]),
+                      "bbox": self.bbox(row),
+                      "iscrowd": self.iscrowd[row].item()}
+        if row in self.extras:
+            annotation.update(self.extras[row])
+
+        return annotation
+
+    # The rows of one image, found by binary search since rows are grouped by image
+    def image_rows(self, image_id: int) -> range:
+        start, end = np.searchsorted(self.image_id, [image_id, image_id + 1])
+        return range(int(start), int(end))
+
+    def annotations_for_image(self, image_id: int) -> list:
+        return [self.annotation(row) for row in self.image_rows(image_id)]
+
+    # Yields (image_id, annotations) for every image with annotations, for write_coco_stream
+    def iter_groups(self):
+        if not len(self):
+            return
+
+        starts = np.flatnonzero(np.diff(self.image_id, prepend=self.image_id[0] - 1))
+        ends = np.append(starts[1:], len(self))
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            yield self.image_id[start].item(), [self.annotation(row) for row in range(start, end)]
+
+    # Vectorized queries
+    # Builds a row mask from any mix of filters. Sizes are the bbox sides, so max_side=32 finds boxes under 32px
+    def mask(self, category_ids=None, image_ids=None, min_area=None, max_area=None, min_side=None, max_side=None,
+             iscrowd=None) -> np.ndarray:
+        mask = np.ones(len(self), dtype=bool)
+        if category_ids is not None:
+            mask &= np.isin(self.category_id, list(category_ids))
+        if image_ids is not None:
+            mask &= np.isin(self.image_id, list(image_ids))
+        if min_area is not None:
+            mask &= self.area >= min_area
+        if max_area is not None:
+            mask &= self.area < max_area
+        if min_side is not None:
+            mask &= np.minimum(self.width, self.height) >= min_side
+        if max_side is not None:
+            mask &= np.maximum(self.width, self.height) < max_side
+        if iscrowd is not None:
+            mask &= self.iscrowd.astype(bool) == iscrowd
+
+        return mask
+
+    # Returns the rows, which are also the annotation ids, that match the filters
+    def select(self, **filters) -> np.ndarray:
+        return np.flatnonzero(self.mask(**filters))
+
+    def counts_per_image(self, image_count: int) -> np.ndarray:
+        return np.bincount(self.image_id, minlength=image_count)
+
+    def images_without_annotations(self, image_count: int) -> np.ndarray:
+        return np.flatnonzero(self.counts_per_image(image_count) == 0)
+
+    def vertex_counts(self) -> np.ndarray:
+        return np.diff(self.vertex_offsets) // 2
+
+    # Shoelace area of every row's polygon from the vertex buffer in one pass, 0 for rows without one
+    def polygon_areas(self) -> np.ndarray:
+        return polygon_areas(self.vertices, self.vertex_offsets)
+
+    # Aggregates over every row at once: overall counts and area quantiles, and count, mean area and mean box size for
+    # each category
+    def get_stats(self, image_count: int = None) -> dict:
+        if not len(self):
+            return {"annotations": 0, "images_annotated": 0, "categories": {}}
+
+        image_count = image_count or int(self.image_id.max()) + 1
+        counts_per_image = self.counts_per_image(image_count)
+        area = self.area.astype(np.float64)
+        quantiles = np.quantile(area, [0.0, 0.25, 0.5, 0.75, 1.0]).tolist()
+
+        category_ids, inverse = np.unique(self.category_id, return_inverse=True)
+        category_counts = np.bincount(inverse)
+        mean_area = np.bincount(inverse, weights=area) / category_counts
+        mean_width = np.bincount(inverse, weights=self.width.astype(np.float64)) / category_counts
+        mean_height = np.bincount(inverse, weights=self.height.astype(np.float64)) / category_counts
+
+        return {"annotations": len(self),
+                "images_annotated": int(np.count_nonzero(counts_per_image)),
+                "images_without_annotations": int(image_count - np.count_nonzero(counts_per_image)),
+                "max_per_image": int(counts_per_image.max()),
+                "crowd": int(np.count_nonzero(self.iscrowd)),
+                "vertices": int(len(self.vertices) // 2),
+                "area_quantiles": quantiles,
+                "categories": {int(category_id): {"count": int(count),
+                                                  "mean_area": float(area_mean),
+                                                  "mean_width": float(width_mean),
+                                                  "mean_height": float(height_mean)}
+                               for category_id, count, area_mean, width_mean, height_mean
+                               in zip(category_ids, category_counts, mean_area, mean_width, mean_height)}}
+
+    # Approximate bytes held by the arrays and the side tables
+    def get_nbytes(self) -> int:
+        arrays = (self.image_id, self.category_id, self.x, self.y, self.width, self.height, self.area, self.iscrowd,
+                  self.nested, self.float_vertices, self.vertex_offsets, self.vertices)
+        return sum(array.nbytes for array in arrays)
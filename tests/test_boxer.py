@@ -0,0 +1,90 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from boxer import main
+from generate import generate_dataset
+from operations import polygons_to_rle, rle_from_string
+
+
+def make_dataset(tmp_path) -> str:
+    directory = str(tmp_path / "dataset")
+    generate_dataset(directory, 6, 64, 48, annotations=(1, 3), vertices=(4, 6), category_count=3, workers=1)
+    return directory
+
+
+def read_coco(directory: str) -> dict:
+    if os.path.exists(os.path.join(directory, "coco.json.gz")):
+        with gzip.open(os.path.join(directory, "coco.json.gz"), "rt") as coco_file:
+            return json.load(coco_file)
+    with open(os.path.join(directory, "coco.json")) as coco_file:
+        return json.load(coco_file)
+
+
+def write_coco(directory: str, coco: dict):
+    with open(os.path.join(directory, "coco.json"), "w") as coco_file:
+        json.dump(coco, coco_file)
+
+
+def test_validate_reports_problems(tmp_path, capsys):
+    directory = make_dataset(tmp_path)
+    assert main(["validate", directory, "--workers", "1"]) == 0
+
+    coco = read_coco(directory)
+    coco["annotations"][0]["category_id"] = 9
+    coco["annotations"][1]["bbox"][2] = 0
+    write_coco(directory, coco)
+    capsys.readouterr()
+    assert main(["validate", directory, "--workers", "1", "--shard-size", "2"]) == 1
+
+    problems = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert {"image": "00000000.jpg", "annotation": coco["annotations"][0]["id"],
+            "problem": "unknown category 9"} in problems
+    assert {"annotation": coco["annotations"][1]["id"], "problem": "empty bbox"} in [
+        {key: problem[key] for key in ("annotation", "problem")} for problem in problems]
+
+
+# Every polygon becomes a crowd RLE over its whole image, covering the pixels the polygon did
+def test_rle_all(tmp_path):
+    directory = make_dataset(tmp_path)
+    before = read_coco(directory)
+    assert main(["rle", directory, "--all", "--workers", "1"]) == 0
+
+    after = read_coco(directory)
+    assert len(after["annotations"]) == len(before["annotations"])
+    for old, new in zip(before["annotations"], after["annotations"]):
+        assert new["iscrowd"] and new["segmentation"]["size"] == [48, 64]
+        segmentation = old["segmentation"]
+        if isinstance(segmentation, list) and segmentation:
+            polygons = segmentation if isinstance(segmentation[0], list) else [segmentation]
+            assert rle_from_string(new["segmentation"]["counts"]) == polygons_to_rle(polygons, 64, 48)
+        assert new["area"] == sum(rle_from_string(new["segmentation"]["counts"])[1::2])
+
+
+# A dataset moved into annotations.db and back out again exports the same coco file it started as
+def test_convert_and_export_round_trip(tmp_path, capsys):
+    directory = make_dataset(tmp_path)
+    before = read_coco(directory)
+
+    assert main(["convert", directory, "--to", "sqlite", "--workers", "1"]) == 0
+    assert os.path.exists(os.path.join(directory, "annotations.db"))
+    os.remove(os.path.join(directory, "coco.json"))
+    assert main(["export", directory, "--workers", "1"]) == 0
+    assert read_coco(directory) == before
+
+    assert main(["convert", directory, "--to", "gzip", "--workers", "1"]) == 0
+    assert sorted(name for name in os.listdir(directory) if "coco" in name or "annotations" in name) == [
+        "annotations.db.bak", "coco.json.gz"]
+    assert read_coco(directory) == before
+
+    capsys.readouterr()
+    assert main(["stats", directory]) == 0
+    stats = json.loads(capsys.readouterr().out)
+    assert sum(category["count"] for category in stats["categories"].values()) == len(before["annotations"])
+
+
+def test_directory_without_annotations(tmp_path):
+    with pytest.raises(SystemExit):
+        main(["stats", str(tmp_path)])
@@ -0,0 +1,164 @@
+from PIL import Image
+
+from cache import CanvasPool, DecodePrefetcher, ImageCache, image_bytes
+
+
+def save_image(tmp_path, name: str, size: tuple, mode: str = "RGB") -> str:
+    image_path = str(tmp_path / name)
+    Image.new(mode, size).save(image_path)
+    return image_path
+
+
+# Stands in for the Tk widget the prefetcher polls through, running nothing until asked
+class Widget:
+    def __init__(self):
+        self.callbacks = []
+
+    def after(self, _delay: int, callback):
+        self.callbacks.append(callback)
+
+    def run_after(self):
+        while self.callbacks:
+            self.callbacks.pop(0)()
+
+
+# Images are dropped oldest use first once their bytes pass the budget, however few of them there are
+def test_evicts_least_recently_used_by_bytes(tmp_path):
+    paths = [save_image(tmp_path, f"{index}.png", (10, 10)) for index in range(3)]
+    cache = ImageCache(max_bytes=2 * 10 * 10 * 3)
+
+    cache.get(paths[0])
+    cache.get(paths[1])
+    cache.get(paths[0])
+    cache.get(paths[2])
+
+    assert paths[1] not in cache
+    assert paths[0] in cache and paths[2] in cache
+    assert cache.current_bytes == 2 * 300
+    assert cache.get_stats()["evictions"] == 1
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+# Bytes count channels, so a greyscale image takes a third of the room of a colour one
+def test_budget_counts_bands(tmp_path):
+    grey = save_image(tmp_path, "grey.png", (10, 10), "L")
+    colour = save_image(tmp_path, "colour.png", (10, 10))
+    cache = ImageCache(max_bytes=400)
+
+    assert image_bytes(cache.get(grey)) == 100
+    cache.get(colour)
+    assert len(cache) == 2
+
+    cache.resize(300)
+    assert grey not in cache and colour in cache
+
+
+# The image about to be shown is kept even when it alone is over budget
+def test_keeps_an_image_larger_than_the_budget(tmp_path):
+    small = save_image(tmp_path, "small.png", (2, 2))
+    large = save_image(tmp_path, "large.png", (20, 20))
+    cache = ImageCache(max_bytes=100)
+
+    cache.get(small)
+    image = cache.get(large)
+    assert image.size == (20, 20)
+    assert list(cache.images) == [large]
+    assert cache.current_bytes == image_bytes(image)
+
+
+# Moving forward decodes the next images and the one behind, and a move the other way drops what isn't wanted
+def test_prefetcher_decodes_neighbours(tmp_path):
+    paths = [save_image(tmp_path, f"{index}.png", (4, 4)) for index in range(8)]
+    widget = Widget()
+    cache = ImageCache()
+    prefetcher = DecodePrefetcher(widget, cache, ahead=2, behind=1, workers=1)
+
+    prefetcher.schedule(paths, 3)
+    assert prefetcher.wanted == {paths[4], paths[5], paths[2]}
+    for future in list(prefetcher.jobs.values()):
+        future.result()
+    widget.run_after()
+    assert set(cache.images) == {paths[4], paths[5], paths[2]}
+    assert not prefetcher.polling
+
+    prefetcher.schedule(paths + [None], 7, direction=-1)
+    assert prefetcher.wanted == {paths[6], paths[5]}
+    prefetcher.cancel()
+    prefetcher.executor.shutdown()
+
+
+# Claiming an image counts as a hit when it was decoded ahead, waiting on its decode if need be, and as a miss otherwise
+def test_prefetcher_claim_and_hit_rate(tmp_path):
+    paths = [save_image(tmp_path, f"{index}.png", (4, 4)) for index in range(4)]
+    cache = ImageCache()
+    prefetcher = DecodePrefetcher(Widget(), cache, ahead=1, behind=0, workers=1)
+    assert prefetcher.hit_rate() == 0.0
+
+    prefetcher.schedule(paths, 0)
+    prefetcher.claim(paths[1])
+    assert paths[1] in cache
+    assert paths[1] not in prefetcher.jobs
+
+    prefetcher.claim(paths[3])
+    assert paths[3] not in cache
+    assert prefetcher.hit_rate() == 0.5
+    prefetcher.executor.shutdown()
+
+
+# Keeps the options of each item, and configures every item carrying a tag when given one
+class Canvas:
+    def __init__(self):
+        self.items = {}
+
+    def create(self, kind: str, coords, options: dict) -> int:
+        item = len(self.items) + 1
+        self.items[item] = dict(options, kind=kind, coords=list(coords), tags=tuple(options.get("tags", ())))
+        return item
+
+    def create_line(self, *coords, **options) -> int:
+        return self.create("line", coords, options)
+
+    def create_text(self, *coords, **options) -> int:
+        return self.create("text", coords, options)
+
+    def coords(self, item: int, *coords):
+        self.items[item]["coords"] = list(coords)
+
+    def itemconfigure(self, tag_or_item, **options):
+        for item, item_options in self.items.items():
+            if item == tag_or_item or tag_or_item in item_options["tags"]:
+                item_options.update(options)
+
+
+# Released items are hidden and handed out again for the same type, with any dash left over from before cleared
+def test_canvas_pool_reuses_hidden_items():
+    canvas = Canvas()
+    pool = CanvasPool(canvas, "pooled")
+    line = pool.acquire("line", (0, 0, 5, 5), {"dash": (2, 2), "tags": ("annotation",)})
+    text = pool.acquire("text", (1, 1), {"text": "label"})
+    assert canvas.items[line]["tags"] == ("annotation", "pooled")
+
+    pool.release(line)
+    pool.release(line)
+    assert canvas.items[line]["state"] == "hidden" and canvas.items[line]["tags"] == ("pooled",)
+    assert pool.acquire("text", (2, 2), {"text": "other"}) not in (line, text)
+
+    assert pool.acquire("line", (3, 3, 4, 4), {"fill": "red"}) == line
+    assert canvas.items[line]["state"] == "normal" and canvas.items[line]["dash"] == ""
+    assert canvas.items[line]["coords"] == [3, 3, 4, 4]
+    assert pool.get_stats() == {"shown": 3, "hidden": 0, "created": 3, "reused": 1}
+
+
+def test_canvas_pool_release_all_and_forget():
+    canvas = Canvas()
+    pool = CanvasPool(canvas, "pooled")
+    items = [pool.acquire("line", (index, 0, index, 1), {}) for index in range(3)]
+
+    pool.release_all()
+    assert all(canvas.items[item]["state"] == "hidden" for item in items)
+    assert pool.get_stats()["hidden"] == 3
+    assert pool.acquire("line", (0, 0, 1, 1), {}) in items
+
+    pool.forget()
+    assert pool.get_stats()["shown"] == pool.get_stats()["hidden"] == 0
+    assert pool.acquire("line", (0, 0, 1, 1), {}) not in items
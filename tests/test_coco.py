@@ -0,0 +1,83 @@
+import gzip
+import json
+import lzma
+import os
+import stat
+
+import pytest
+
+from coco import COCO_FILES, CocoReader, CocoScanner, get_index_path, open_coco_reader, write_coco_stream
+
+
+def file_mode(path) -> int:
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_write_keeps_file_mode(tmp_path):
+    path = str(tmp_path / "coco.json")
+    umask = os.umask(0o022)
+    try:
+        write_coco_stream(path, {}, [], [], [], [])
+        assert file_mode(path) == 0o644
+
+        os.chmod(path, 0o640)
+        write_coco_stream(path, {}, [], [], [], [])
+        assert file_mode(path) == 0o640
+    finally:
+        os.umask(umask)
+
+
+def make_foreign_coco() -> dict:
+    images = [{"id": image_id, "file_name": f"imagé {image_id}.jpg", "width": 10, "height": 10}
+              for image_id in (7, 3, 12)]
+    annotations = [{"id": annotation_id, "image_id": image_id, "category_id": 1, "bbox": [1, 2, 3, 4.5],
+                    "segmentation": [[1, 2, 3, 4, 5, 6]], "area": 12345678, "iscrowd": 0}
+                   for annotation_id, image_id in enumerate((7, 7, 3, 7, 12, 12, 3))]
+    return {"images": images, "annotations": annotations, "categories": [{"id": 1, "name": "catégorie"}]}
+
+
+def expected_groups(coco: dict) -> dict:
+    groups = {}
+    for annotation in coco["annotations"]:
+        groups.setdefault(annotation["image_id"], []).append(annotation)
+    return groups
+
+
+# A file from another tool, pretty printed, without info or licenses and with annotations spread out, is indexed on
+# its first open, through chunks small enough to cut values in two
+def test_scan_indexes_foreign_file(tmp_path):
+    coco = make_foreign_coco()
+    path = str(tmp_path / "coco.json")
+    with open(path, "w", encoding="utf-8") as coco_file:
+        coco_file.write(json.dumps(coco, indent=2, ensure_ascii=False))
+
+    with open(path, "rb") as coco_file:
+        sections, annotation_ranges = CocoScanner(coco_file, chunk_size=7).scan()
+    assert set(sections) == {"images", "categories"}
+    assert isinstance(annotation_ranges[12][0], int)
+    assert len(annotation_ranges[7]) == 2
+
+    for _open in range(2):
+        reader = open_coco_reader(path)
+        assert isinstance(reader, CocoReader)
+        header = reader.read_header()
+        assert header["images"] == coco["images"] and header["categories"] == coco["categories"]
+        assert header["info"] == {} and header["licenses"] == []
+        for image_id, annotations in expected_groups(coco).items():
+            assert reader.annotations_for_image(image_id) == annotations
+        assert os.path.exists(get_index_path(path))
+
+
+@pytest.mark.parametrize("compression", ["gzip", "lzma"])
+def test_scan_reads_compressed_file(tmp_path, compression):
+    coco = make_foreign_coco()
+    path = str(tmp_path / COCO_FILES[compression])
+    opener = gzip.open if compression == "gzip" else lzma.open
+    with opener(path, "wb") as coco_file:
+        coco_file.write(json.dumps(coco, ensure_ascii=False).encode())
+
+    reader = open_coco_reader(path)
+    assert reader.read_header()["images"] == coco["images"]
+    for image_id, annotations in expected_groups(coco).items():
+        assert reader.annotations_for_image(image_id) == annotations
+    assert reader.annotations_for_image(99) == []
@@ -0,0 +1,66 @@
+from database import AnnotationDatabase, get_database_path
+
+
+def make_annotation(image_id: int, category_id: int, **extra) -> dict:
+    return {"image_id": image_id,
+            "category_id": category_id,
+            "segmentation": [[1, 2, 3.5, 4, 5, 6]],
+            "area": 12.5,
+            "bbox": [1, 2, 4.5, 4],
+            "iscrowd": False,
+            **extra}
+
+
+def make_images(count: int) -> list:
+    return [{"id": image_id, "file_name": f"{image_id}.jpg", "width": 40, "height": 30, "license": 0,
+             "date_captured": None} for image_id in range(count)]
+
+
+# The header and every annotation come back as they went in, with ids given in insertion order and unknown fields kept
+def test_round_trip(tmp_path):
+    database = AnnotationDatabase(get_database_path(str(tmp_path)))
+    assert database.is_empty()
+
+    categories = [{"id": 0, "name": "car", "supercategory": "vehicle"}, {"id": 1, "name": "tree", "supercategory": ""}]
+    database.write_header({"year": 2024}, [{"id": 0, "name": "licence"}], categories, make_images(3))
+    crowd = dict(make_annotation(2, 1), segmentation={"counts": "abc", "size": [30, 40]}, iscrowd=True, area=7)
+    database.replace_image_annotations(0, [make_annotation(0, 0), make_annotation(0, 1, note="kept")])
+    database.replace_image_annotations(2, [crowd])
+    database.close()
+
+    database = AnnotationDatabase(get_database_path(str(tmp_path)))
+    header = database.read_header()
+    assert not database.is_empty()
+    assert header["info"] == {"year": 2024} and header["licenses"] == [{"id": 0, "name": "licence"}]
+    assert header["categories"] == categories
+    assert header["images"] == make_images(3)
+
+    assert database.annotations_for_image(0) == [dict(make_annotation(0, 0), id=1),
+                                                 dict(make_annotation(0, 1, note="kept"), id=2)]
+    assert database.annotations_for_image(1) == []
+    assert database.annotations_for_image(2) == [dict(crowd, id=3)]
+    database.close()
+
+
+def test_replace_merge_and_count(tmp_path):
+    database = AnnotationDatabase(get_database_path(str(tmp_path)))
+    database.write_header({}, [], [], make_images(5))
+    for image_id in (3, 0, 1):
+        database.replace_image_annotations(image_id, [make_annotation(image_id, image_id % 2)] * 2)
+    database.replace_image_annotations(1, [make_annotation(1, 2)])
+
+    groups = list(database.iter_annotation_groups(batch_size=2))
+    assert [(image_id, [annotation["category_id"] for annotation in annotations])
+            for image_id, annotations in groups] == [(0, [0, 0]), (1, [2]), (3, [1, 1])]
+    assert database.count_annotations() == 5
+    assert database.count_annotations(image_id=3) == 2
+    assert database.count_annotations(category_id=1) == 2
+
+    database.merge_category(1, 0)
+    assert sorted(database.category_ids()) == [0, 2]
+    assert database.count_annotations(image_id=3, category_id=0) == 2
+
+    # A shorter image list drops the rows of the images past its end
+    database.write_header({}, [], [], make_images(2))
+    assert len(database.read_header()["images"]) == 2
+    database.close()
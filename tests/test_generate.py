@@ -0,0 +1,57 @@
+import argparse
+import json
+import os
+
+import pytest
+
+from geometry import check_polygon_intersections
+from generate import generate_dataset, main, parse_range
+
+
+# Everything written, except the index of coco.json, which records when and where the file was written
+def read_files(directory: str) -> dict:
+    files = {}
+    for name in sorted(set(os.listdir(directory)) - {".coco_index.json"}):
+        with open(os.path.join(directory, name), "rb") as data_file:
+            files[name] = data_file.read()
+    return files
+
+
+# The same seed writes the same bytes, however many workers draw the images and however they are chunked
+def test_same_seed_same_dataset(tmp_path):
+    options = {"annotations": (2, 6), "vertices": (3, 12), "crowd_ratio": 0.3, "category_count": 4}
+    first = str(tmp_path / "first")
+    second = str(tmp_path / "second")
+    other = str(tmp_path / "other")
+    count = generate_dataset(first, 5, 80, 60, workers=1, **options)
+    assert generate_dataset(second, 5, 80, 60, workers=2, chunk_size=2, **options) == count
+    generate_dataset(other, 5, 80, 60, seed=1, workers=1, **options)
+
+    files = read_files(first)
+    assert set(files) == {".colour_map.json", "coco.json"} | {f"{image_id:08}.jpg" for image_id in range(5)}
+    assert read_files(second) == files
+    assert read_files(other)["coco.json"] != files["coco.json"]
+
+    coco = json.loads(files["coco.json"])
+    assert len(coco["annotations"]) == count
+    assert [annotation["id"] for annotation in coco["annotations"]] == list(range(count))
+    assert any(annotation["iscrowd"] for annotation in coco["annotations"])
+    for annotation in coco["annotations"]:
+        assert 0 <= annotation["category_id"] < 4
+        x, y, width, height = annotation["bbox"]
+        assert x >= 0 and y >= 0 and x + width <= 80 and y + height <= 60
+        if not annotation["iscrowd"]:
+            assert not check_polygon_intersections(annotation["segmentation"])
+
+
+def test_parse_range():
+    assert parse_range("8") == (8, 8)
+    assert parse_range("8-64") == (8, 64)
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_range("9-3")
+
+
+def test_refuses_a_directory_with_a_database(tmp_path):
+    (tmp_path / "annotations.db").write_bytes(b"")
+    with pytest.raises(SystemExit):
+        main([str(tmp_path), "--images", "1"])
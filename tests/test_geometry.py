@@ -0,0 +1,123 @@
+import random
+
+from geometry import (SegmentGrid, SpatialIndex, SweepStatus, ViewTransform, check_polygon_intersections,
+                      is_connected, segment_cells)
+from operations import check_intersection
+
+
+def pairwise_intersections(vertices: list) -> bool:
+    points = list(zip(vertices[::2], vertices[1::2]))
+    edges = [(points[index], points[(index + 1) % len(points)]) for index in range(len(points))]
+    return any(not is_connected(*edges[a], *edges[b]) and check_intersection(*edges[a], *edges[b])
+               for a in range(len(edges)) for b in range(a + 1, len(edges)))
+
+
+# A zigzag of edges that all span the full width, closed round the right and bottom, so all are in the sweep at once
+def comb(teeth: int, width: int = 50) -> list:
+    vertices = []
+    for tooth in range(teeth):
+        vertices += [0 if tooth % 2 == 0 else width, tooth]
+    return vertices + [width + 1, teeth - 1, width + 1, -1, 0, -1]
+
+
+def test_sweep_matches_pairwise_check():
+    generator = random.Random(0)
+    for _case in range(2000):
+        span = generator.choice((3, 10, 100))
+        vertices = [generator.randint(0, span) for _index in range(2 * generator.randint(4, 30))]
+        assert check_polygon_intersections(vertices) == pairwise_intersections(vertices), vertices
+
+
+def test_sweep_across_many_blocks(monkeypatch):
+    monkeypatch.setattr(SweepStatus.__init__, "__defaults__", (2,))
+    generator = random.Random(1)
+    for teeth in range(4, 120, 5):
+        vertices = comb(teeth)
+        assert not check_polygon_intersections(vertices)
+
+        vertices[generator.randrange(len(vertices))] += generator.choice((-3, 3))
+        assert check_polygon_intersections(vertices) == pairwise_intersections(vertices), vertices
+
+
+# Vertices clamped to a hydrated bbox can land on fractional coordinates
+def test_segment_grid_takes_float_endpoints():
+    assert list(segment_cells((1.0, 2.0), (30.5, 4.5), 8)) == [(0, 0), (1, 0), (2, 0), (3, 0)]
+
+    grid = SegmentGrid(8)
+    grid.add((1.0, 2.0), (30.5, 4.5))
+    grid.add((30.5, 4.5), (30.5, 20.25))
+    assert grid.intersects((20.5, 0.0), (20.5, 10.0))
+    assert not grid.intersects((0.5, 10.0), (20.5, 10.0))
+
+
+# Later boxes sit on top, and moving a box keeps its place in that order
+def test_spatial_index_orders_topmost_first():
+    index = SpatialIndex(cell_size=16)
+    index.insert("under", [0, 0, 40, 40])
+    index.insert("over", [30, 30, 10, 10])
+    index.insert("apart", [100, 100, 120, 120])
+
+    assert index.query_point(20, 20) == ["over", "under"]
+    assert index.query_point(5, 5) == ["under"]
+    assert index.query_point(42, 42) == []
+    assert index.query_point(42, 42, tolerance=2) == ["under"]
+
+    index.update("under", [0, 0, 25, 25])
+    assert index.query_point(20, 20) == ["over", "under"]
+    index.insert("over", [50, 50, 60, 60])
+    assert index.query_point(20, 20) == ["under"]
+    assert index.query_point(55, 55) == ["over"]
+
+    index.remove("apart")
+    assert "apart" not in index and len(index) == 2
+    assert index.query_point(110, 110) == []
+    assert all(index.cells.values())
+
+
+def test_spatial_index_matches_scan():
+    generator = random.Random(3)
+    index = SpatialIndex(cell_size=32)
+    boxes = {}
+    for step in range(400):
+        key = generator.randrange(40)
+        if key in boxes and generator.random() < 0.3:
+            index.remove(key)
+            del boxes[key]
+            continue
+        coords = [generator.uniform(-50, 250) for _axis in range(4)]
+        if key not in boxes:
+            boxes[key] = (step, None)
+        boxes[key] = (boxes[key][0], [min(coords[0], coords[2]), min(coords[1], coords[3]),
+                                      max(coords[0], coords[2]), max(coords[1], coords[3])])
+        index.insert(key, coords)
+
+    for _query in range(200):
+        x, y, tolerance = generator.uniform(-60, 260), generator.uniform(-60, 260), generator.choice((0, 3))
+        hits = sorted(((order, key) for key, (order, (min_x, min_y, max_x, max_y)) in boxes.items()
+                       if min_x - tolerance <= x <= max_x + tolerance and min_y - tolerance <= y <= max_y + tolerance),
+                      reverse=True)
+        assert index.query_point(x, y, tolerance) == [key for _order, key in hits]
+
+
+def test_view_transform_round_trip():
+    view = ViewTransform(0.25, 10, -4)
+    assert view.to_canvas(100, 40) == (15, 14)
+    assert view.to_image(15, 14) == (100, 40)
+    assert view.coords_to_canvas([100, 40, 0, 0]) == [15, 14, -10, 4]
+    assert view.coords_to_image(view.coords_to_canvas([3, 5, 7, 9])) == [3, 5, 7, 9]
+
+    copy = view.copy()
+    copy.pan(5, -2)
+    assert (view.offset_x, view.offset_y) == (10, -4)
+    assert copy.to_image(20, 12) == view.to_image(15, 14)
+
+
+# Zooming in or out keeps the point under the cursor where it was
+def test_view_transform_zoom_keeps_point():
+    view = ViewTransform()
+    for factor, x, y in ((2, 30, 40), (0.5, 0, 0), (1.25, 300, 7)):
+        before = view.to_image(x, y)
+        view.zoom_at(factor, x, y)
+        after = view.to_image(x, y)
+        assert abs(after[0] - before[0]) < 1e-9 and abs(after[1] - before[1]) < 1e-9
+    assert view.scale == 2 * 0.5 * 1.25
@@ -0,0 +1,66 @@
+import json
+import os
+
+from boxer import load_headless
+from generate import generate_dataset
+from info import InfoManager
+from objects import Annotation, BoundingBox, Label
+from operations import polygons_to_rle, rle_to_string
+
+
+class Image:
+    def __init__(self, annotations: list):
+        self.annotations = annotations
+        self.width = 40
+        self.height = 30
+
+
+# A crowd read from a coco file keeps the area of its mask when its image is saved again
+def test_preserved_rle_keeps_mask_area():
+    counts = polygons_to_rle([[5, 5, 15, 5, 15, 15, 5, 15]], 40, 30)
+    label = Label("label", "label0")
+    annotation = Annotation(None, None)
+    annotation.set_label(label, "blue")
+    annotation.set_bbox(BoundingBox(None, [0, 0, 40, 30], label, "blue"))
+
+    for rle in ({"counts": rle_to_string(counts), "size": [30, 40]}, {"counts": counts, "size": [30, 40]}):
+        annotation.rle = rle
+        coco_annotation, = InfoManager().build_annotations(Image([annotation]))
+        assert coco_annotation["iscrowd"]
+        assert coco_annotation["area"] == sum(counts[1::2]) == 100
+
+
+# A second save only reads the images that changed, and leaves out the categories no annotation uses any more
+def test_save_reuses_unchanged_images(tmp_path):
+    directory = str(tmp_path)
+    generate_dataset(directory, 8, 64, 48, annotations=(1, 3), vertices=(4, 6), category_count=3, workers=1)
+    info_manager, records = load_headless(directory)
+    info_manager.write_coco()
+    with open(os.path.join(directory, "coco.json")) as coco_file:
+        saved = json.load(coco_file)
+    assert {category["id"] for category in saved["categories"]} == {0, 1, 2}
+
+    groups = {image["id"]: [] for image in saved["images"]}
+    for annotation in saved["annotations"]:
+        groups[annotation["image_id"]].append(annotation)
+    changed = {image_id for image_id, annotations in groups.items()
+               if any(annotation["category_id"] == 2 for annotation in annotations)}
+    assert 0 < len(changed) < len(records)
+    for image_id in changed:
+        groups[image_id] = [dict(annotation, category_id=0) for annotation in groups[image_id]]
+        records[image_id].coco_annotations = [dict(annotation) for annotation in groups[image_id]]
+        info_manager.mark_changed(image_id)
+
+    read = []
+    get_image_annotations = info_manager.get_image_annotations
+    info_manager.get_image_annotations = lambda record: read.append(record) or get_image_annotations(record)
+    info_manager.write_coco()
+    info_manager.close()
+
+    with open(os.path.join(directory, "coco.json")) as coco_file:
+        resaved = json.load(coco_file)
+    assert read == [records[image_id] for image_id in sorted(changed)]
+    assert [category["id"] for category in resaved["categories"]] == [0, 1]
+    expected = [annotation for image_id in sorted(groups) for annotation in groups[image_id]]
+    assert [dict(annotation, id=None) for annotation in resaved["annotations"]] == [
+        dict(annotation, id=None) for annotation in expected]
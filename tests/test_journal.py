@@ -0,0 +1,57 @@
+import os
+
+from coco import coco_signature
+from journal import AnnotationJournal
+
+
+def test_has_ops_until_compacted(tmp_path):
+    journal = AnnotationJournal(str(tmp_path), flush_interval=0)
+    assert not journal.has_ops()
+
+    journal.record_rename("blue", "old", "new")
+    assert journal.has_ops()
+    journal.compact()
+    assert not journal.has_ops()
+    journal.close()
+
+    # Edits left behind by a session that never saved are still waiting
+    AnnotationJournal(str(tmp_path)).write([{"op": "undo", "image": "image.jpg"}])
+    assert AnnotationJournal(str(tmp_path)).has_ops()
+
+
+def write_coco(directory: str, text: str):
+    with open(os.path.join(directory, "coco.json.tmp"), "w") as coco_file:
+        coco_file.write(text)
+    os.replace(os.path.join(directory, "coco.json.tmp"), os.path.join(directory, "coco.json"))
+
+
+# A crash after a save replaced coco.json but before the journal was compacted leaves edits that are already saved
+def test_edits_saved_before_a_crash_are_not_replayed(tmp_path):
+    directory = str(tmp_path)
+    write_coco(directory, "{}")
+    journal = AnnotationJournal(directory, flush_interval=0, signature=lambda: coco_signature(directory))
+    journal.record_undo("image.jpg")
+    journal.flush()
+    assert AnnotationJournal(directory, signature=lambda: coco_signature(directory)).read_ops() == [
+        {"op": "undo", "image": "image.jpg"}]
+
+    write_coco(directory, "{}")
+    journal.close()
+    stale = AnnotationJournal(directory, signature=lambda: coco_signature(directory))
+    assert stale.read_ops() == []
+    assert not stale.has_ops()
+
+
+# Edits after a save are journaled against the coco.json that save wrote
+def test_compact_signs_later_edits_with_the_new_save(tmp_path):
+    directory = str(tmp_path)
+    write_coco(directory, "{}")
+    journal = AnnotationJournal(directory, flush_interval=0, signature=lambda: coco_signature(directory))
+    journal.record_undo("image.jpg")
+    write_coco(directory, "{}")
+    journal.compact()
+
+    journal.record_redo("image.jpg")
+    journal.close()
+    assert AnnotationJournal(directory, signature=lambda: coco_signature(directory)).read_ops() == [
+        {"op": "redo", "image": "image.jpg"}]
@@ -0,0 +1,71 @@
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+from boxer import load_headless
+from generate import generate_dataset
+from masks import MaskExporter, make_category_colours, rasterize_image
+from operations import polygons_to_rle, rle_to_string
+
+
+def make_annotation(category_id: int, segmentation, bbox: list) -> dict:
+    return {"category_id": category_id, "segmentation": segmentation, "bbox": bbox}
+
+
+# Later annotations cover earlier ones, and polygons reaching past the image are cut off at its edge
+def test_rasterize_image():
+    crowd = {"counts": rle_to_string(polygons_to_rle([[0, 0, 2, 0, 2, 2, 0, 2]], 8, 6)), "size": [6, 8]}
+    annotations = [make_annotation(0, [0, 0, 6, 0, 6, 4, 0, 4], [0, 0, 6, 4]),
+                   make_annotation(2, [[4, 2, 12, 2, 12, 9, 4, 9]], [4, 2, 8, 7]),
+                   make_annotation(1, crowd, [0, 0, 2, 2]),
+                   make_annotation(1, [], [0, 0, 0, 0])]
+    instances, classes = rasterize_image(annotations, 8, 6)
+
+    expected = np.zeros((6, 8), dtype=np.uint8)
+    expected[0:4, 0:6] = 1
+    expected[2:6, 4:8] = 2
+    expected[0:2, 0:2] = 3
+    assert instances.dtype == np.uint8
+    assert np.array_equal(instances, expected)
+    assert np.array_equal(classes, np.choose(expected, [0, 1, 3, 2]))
+
+
+def read_mask(directory: str, kind: str, file_name: str) -> Image.Image:
+    return Image.open(os.path.join(directory, ".masks", kind, os.path.splitext(file_name)[0] + ".png"))
+
+
+# Masks match the annotations and are drawn in their labels' colours, and a second export only redoes changed images
+def test_export_skips_unchanged_images(tmp_path):
+    directory = str(tmp_path)
+    generate_dataset(directory, 5, 64, 48, annotations=(1, 3), vertices=(4, 6), category_count=3, workers=1)
+    info_manager, records = load_headless(directory)
+    assert MaskExporter(info_manager, workers=1).export() == 5
+    colours = make_category_colours(info_manager.categories, info_manager.colour_map)
+
+    for record in records:
+        annotations = info_manager.get_image_annotations(record)
+        instances, classes = rasterize_image(annotations, 64, 48)
+        with read_mask(directory, "instances", record.file_name) as instance_mask:
+            assert instance_mask.mode == "P"
+            assert np.array_equal(np.asarray(instance_mask), instances)
+        with read_mask(directory, "classes", record.file_name) as class_mask:
+            assert np.array_equal(np.asarray(class_mask), classes)
+            palette = class_mask.getpalette()
+            assert all(tuple(palette[(category_id + 1) * 3:(category_id + 2) * 3]) == rgb
+                       for category_id, rgb in colours.items())
+
+    with open(os.path.join(directory, ".masks", "manifest.json")) as manifest_file:
+        manifest = json.load(manifest_file)
+    assert manifest["classes"] == {str(category["id"] + 1): category["name"] for category in info_manager.categories}
+    assert sorted(manifest["images"]) == [record.file_name for record in records]
+    assert MaskExporter(info_manager, workers=1).export() == 0
+
+    annotations = info_manager.get_image_annotations(records[2])
+    records[2].coco_annotations = [dict(annotation, category_id=(annotation["category_id"] + 1) % 3)
+                                   for annotation in annotations]
+    info_manager.mark_changed(2)
+    os.remove(os.path.join(directory, ".masks", "classes", "00000004.png"))
+    assert MaskExporter(info_manager, workers=1).export() == 2
+    info_manager.close()
@@ -0,0 +1,21 @@
+import os
+
+from PIL import Image
+
+from metadata import MetadataIndex
+
+
+def test_missing_images_are_dropped(tmp_path):
+    image_paths = [str(tmp_path / name) for name in ("a.png", "b.png")]
+    index = MetadataIndex(str(tmp_path))
+    for image_path in image_paths:
+        Image.new("RGB", (4, 3)).save(image_path)
+        index.update(image_path, {"width": 4, "height": 3, "date_captured": None})
+
+    os.remove(image_paths[1])
+    known, stale = index.partition(image_paths)
+
+    assert list(known) == [image_paths[0]]
+    assert stale == []
+    assert list(index.entries) == ["a.png"]
+    assert index.update(image_paths[1], {"width": 4, "height": 3, "date_captured": None}) is None
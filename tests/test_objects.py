@@ -0,0 +1,137 @@
+from info import InfoManager
+from objects import Annotation, BoundingBox, EditableImage, LabelIndex, Polygon
+
+HEADER = {"width": 100, "height": 100, "file_name": "image.jpg", "date_captured": "2020-01-01"}
+
+
+# Stands in for the view canvas, keeping the items that are on it
+class Canvas:
+    def __init__(self):
+        self.items = {}
+        self.counter = 0
+
+    def create_item(self, *coords, **options) -> int:
+        self.counter += 1
+        self.items[self.counter] = coords
+        return self.counter
+
+    create_line = create_rectangle = create_text = create_item
+
+    def coords(self, item, *coords):
+        self.items[item] = coords
+
+    def delete(self, item):
+        self.items.pop(item, None)
+
+    def unbind(self, sequence: str):
+        pass
+
+    def image_distance(self, distance: float) -> float:
+        return distance
+
+
+class StateManager:
+    def __init__(self):
+        self.undo_button = {}
+
+
+def make_image(canvas: Canvas = None) -> EditableImage:
+    return EditableImage("image.jpg", canvas, StateManager() if canvas else None, None, LabelIndex(), HEADER)
+
+
+# Draws a box and then a polygon in it, click by click, as the toolbar does, leaving it open unless it is closed
+def draw_annotation(image: EditableImage, canvas: Canvas, coords: list, points: list, close: bool = True):
+    label = image.label_index.get("label")
+    image.annotation = Annotation(canvas, image.state_manager)
+    image.annotation.set_label(label, "blue")
+    image.annotation.set_bbox(BoundingBox(canvas, coords, label, "blue"))
+    image.annotation.draw_bbox()
+    image.append_undo(image.annotation.bbox)
+    image.append_annotation(image.annotation)
+
+    image.annotation.set_polygon(Polygon(canvas, "blue", *points[0]))
+    image.annotation.draw_polygon_segment()
+    for x, y in points[1:] + points[:1] if close else points[1:]:
+        image.annotation.adjust_polygon_segment(x, y)
+        image.annotation.end_polygon_segment()
+        segment = image.annotation.get_segment()
+        if segment not in image.undo_stack:
+            image.append_undo(segment)
+
+
+def coco_annotation(offset: int) -> dict:
+    return {"category_id": 0,
+            "bbox": [offset, offset, 20, 20],
+            "segmentation": [[offset, offset, offset + 20, offset, offset + 20, offset + 20]],
+            "iscrowd": False}
+
+
+# Undoing past the last annotation of a hydrated image takes the polygons of the one before it from that annotation
+def test_undo_across_hydrated_annotations():
+    image = make_image()
+    image.hydrate([coco_annotation(0), coco_annotation(50)], {0: "label"}, {}, "blue")
+    first, _second = image.annotations
+    first_polygon = first.polygons[0]
+
+    assert type(image.undo()) == Polygon
+    assert type(image.undo()) == BoundingBox
+    assert image.annotations == [first]
+    assert image.annotation is first
+
+    assert image.undo() is first_polygon
+    assert first.polygons == []
+    assert type(image.undo()) == BoundingBox
+    assert image.annotations == []
+    assert image.undo_stack == []
+
+
+def test_redo_restores_annotations_in_order():
+    image = make_image()
+    image.hydrate([coco_annotation(0), coco_annotation(50)], {0: "label"}, {}, "blue")
+    first, second = image.annotations
+    for _index in range(4):
+        image.undo()
+
+    for _index in range(4):
+        image.redo()
+
+    assert image.annotations == [first, second]
+    assert image.annotation is second
+    assert len(first.polygons) == 1 and len(second.polygons) == 1
+    assert image.redo_stack == []
+
+
+# Hand drawn polygons come back from their segments, with nothing left behind on the canvas
+def test_redo_rebuilds_drawn_polygons():
+    canvas = Canvas()
+    image = make_image(canvas)
+    draw_annotation(image, canvas, [0, 0, 50, 50], [(10, 10), (30, 10), (30, 30), (10, 30)])
+    draw_annotation(image, canvas, [40, 40, 90, 90], [(50, 50), (80, 55), (60, 80)])
+    exported = InfoManager().build_annotations(image)
+    items = len(canvas.items)
+
+    while image.undo_stack:
+        image.undo().delete()
+    while image.redo_stack:
+        image.redo().draw()
+
+    assert InfoManager().build_annotations(image) == exported
+    assert exported[0]["segmentation"] == [10, 10, 30, 10, 30, 30, 10, 30]
+    assert exported[1]["area"] == 0.5 * abs(30 * 30 - 5 * 10)
+    assert len(canvas.items) == items
+
+
+# Redoing part of a polygon drops the segment that was following the cursor, and leaves the polygon ready to be resumed
+# from the end of its last segment
+def test_redo_mid_polygon_resumes_from_last_vertex():
+    canvas = Canvas()
+    image = make_image(canvas)
+    draw_annotation(image, canvas, [0, 0, 50, 50], [(10, 10), (30, 10), (30, 30)], close=False)
+    image.undo().delete()
+    image.redo().draw()
+
+    assert image.annotation.polygons == []
+    assert image.annotation.poly.get_coords() == [10, 10, 30, 10]
+    assert len(canvas.items) == 2 + 2
+    assert image.annotation.resume_polygon(30, 30)
+    assert image.annotation.poly.get_coords() == [10, 10, 30, 10, 30, 30]
@@ -0,0 +1,71 @@
+import random
+
+import numpy as np
+
+from operations import (mask_to_rle, polygon_mask, polygons_to_rle, rle_from_string, rle_to_mask, rle_to_string,
+                        vertices_to_rle, vertices_to_rle_naive)
+
+
+def random_polygon(generator: random.Random, size: int, integral: bool = True) -> list:
+    vertices = []
+    for _index in range(generator.randint(3, 8)):
+        for _axis in range(2):
+            value = generator.uniform(-2, size + 2)
+            vertices.append(round(value) if integral else value)
+
+    return vertices
+
+
+def test_vertices_to_rle_matches_per_pixel_reference():
+    generator = random.Random(0)
+    for case in range(300):
+        vertices = random_polygon(generator, 12, integral=case % 2 == 0)
+        bbox = [generator.randint(-2, 4), generator.randint(-2, 4), generator.randint(0, 12), generator.randint(0, 12)]
+        assert vertices_to_rle(bbox, vertices) == vertices_to_rle_naive(bbox, vertices), (bbox, vertices)
+
+
+def test_box_is_one_run():
+    assert vertices_to_rle([0, 0, 8, 6], [0, 0, 8, 0, 8, 6, 0, 6]) == [0, 48]
+    assert vertices_to_rle_naive([0, 0, 8, 6], [0, 0, 8, 0, 8, 6, 0, 6]) == [0, 48]
+
+
+def test_rle_string_round_trip():
+    generator = random.Random(1)
+    for _case in range(200):
+        counts = [generator.randint(0, 3)] + [generator.choice((1, 2, 31, 32, 1000, 70000)) for _index in range(20)]
+        assert rle_from_string(rle_to_string(counts)) == counts
+
+
+# 48 is 0b1_10000: the low five bits carry on with 0x20 set, as "`", and the 1 left over ends it, as "1"
+def test_rle_string_known_value():
+    assert rle_to_string([0, 48]) == "0`1"
+    assert rle_from_string("0`1") == [0, 48]
+
+
+def test_rle_mask_round_trip():
+    generator = random.Random(2)
+    for _case in range(50):
+        mask = np.array([[generator.random() < 0.3 for _column in range(7)] for _row in range(5)])
+        assert np.array_equal(rle_to_mask(mask_to_rle(mask), 5, 7), mask)
+
+
+# The union RLE matches rasterizing every polygon over the whole image and encoding the result
+def test_polygons_to_rle_matches_full_mask():
+    generator = random.Random(3)
+    cases = [[[0, 0, 10, 0, 10, 8, 0, 8]],
+             [[0, 0, 4, 0, 4, 8, 0, 8], [6, 0, 10, 0, 10, 8, 6, 8]],
+             [[-3, -3, 13, 0, 5, 11]],
+             [[20, 20, 30, 20, 25, 30]]]
+    for _case in range(200):
+        cases.append([random_polygon(generator, 10, integral=generator.random() < 0.5)
+                      for _polygon in range(generator.randint(1, 3))])
+
+    for polygons in cases:
+        mask = np.zeros((8, 10), dtype=bool)
+        for vertices in polygons:
+            mask |= polygon_mask(vertices, 10, 8)
+        counts = polygons_to_rle(polygons, 10, 8)
+
+        assert counts == mask_to_rle(mask), polygons
+        assert np.array_equal(rle_to_mask(counts, 8, 10), mask)
+        assert rle_from_string(rle_to_string(counts)) == counts
@@ -0,0 +1,105 @@
+import os
+import shutil
+
+import numpy as np
+from PIL import Image
+
+from cache import ImageCache
+from pyramid import ImageTiles, TilePyramid, choose_level, cut_tiles, read_band
+
+
+def make_image(width: int = 301, height: int = 203) -> Image.Image:
+    generator = np.random.default_rng(0)
+    return Image.fromarray(generator.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+# Every level halves the one below it, whether it was read a band at a time or decoded whole
+def expected_levels(image: Image.Image, level_count: int) -> list:
+    levels = [image]
+    for _level in range(1, level_count):
+        levels.append(levels[-1].reduce(2))
+    return levels
+
+
+def read_tiles(pyramid: TilePyramid, level: int) -> dict:
+    return {name: np.asarray(Image.open(os.path.join(pyramid.level_dir(level), name)))
+            for name in os.listdir(pyramid.level_dir(level)) if name.endswith(".png")}
+
+
+def test_band_reads_only_its_rows(tmp_path):
+    image = make_image()
+    for name, options in (("strips.tif", {"tiffinfo": {278: 7}}), ("image.tif", {}), ("image.bmp", {})):
+        image_path = str(tmp_path / name)
+        image.save(image_path, **options)
+        for top, bottom in ((0, 64), (60, 130), (200, 203)):
+            band = read_band(image_path, top, bottom)
+            assert np.array_equal(np.asarray(band), np.asarray(image)[top:bottom])
+
+    image.save(tmp_path / "image.png")
+    assert read_band(str(tmp_path / "image.png"), 0, 64) is None
+
+
+# Building from bands gives the same tiles as cutting up whole levels, and asking for a coarser level builds only it
+# and the levels above it
+def test_levels_match_whole_image(tmp_path):
+    image = make_image()
+    for name, options in (("strips.tif", {"tiffinfo": {278: 7}}), ("image.bmp", {}), ("image.png", {})):
+        image_path = str(tmp_path / name)
+        image.save(image_path, **options)
+        for level in (0, 1):
+            pyramid = TilePyramid(image_path, image.width, image.height, None, tile_size=32)
+            pyramid.build_level(level)
+            levels = expected_levels(image, pyramid.level_count)
+
+            assert [pyramid.is_built(current) for current in range(pyramid.level_count)] == [
+                current >= level for current in range(pyramid.level_count)]
+            for current in range(level, pyramid.level_count):
+                expected = {f"{column}_{row}.png": np.asarray(tile)
+                            for column, row, tile in cut_tiles(levels[current], pyramid.tile_size)}
+                tiles = read_tiles(pyramid, current)
+                assert tiles.keys() == expected.keys()
+                assert all(np.array_equal(tiles[tile_name], expected[tile_name]) for tile_name in expected)
+            shutil.rmtree(pyramid.tile_dir)
+
+
+# Tiles are built the first time they are asked for, and a level left without its marker is built again
+def test_get_tile_builds_on_demand(tmp_path):
+    image = make_image()
+    image_path = str(tmp_path / "image.png")
+    image.save(image_path)
+    pyramid = TilePyramid(image_path, image.width, image.height, ImageCache(), tile_size=64)
+    assert pyramid.level_count == 4
+    assert not os.path.exists(pyramid.tile_dir)
+
+    tile = pyramid.get_tile(1, 2, 1)
+    assert np.array_equal(np.asarray(tile), np.asarray(image.reduce(2).crop((128, 64, 151, 102))))
+    assert not pyramid.is_built(0) and all(pyramid.is_built(level) for level in range(1, 4))
+    assert pyramid.get_tile(3, 1, 0) is None
+
+    os.remove(os.path.join(pyramid.level_dir(3), "complete"))
+    os.remove(pyramid.tile_path(3, 0, 0))
+    assert pyramid.get_tile(3, 0, 0).size == (38, 26)
+    assert pyramid.is_built(3)
+
+
+def test_image_tiles_cut_from_cache(tmp_path):
+    image = make_image()
+    image_path = str(tmp_path / "image.png")
+    image.save(image_path)
+    source = ImageTiles(image_path, image.width, image.height, ImageCache(), tile_size=128)
+
+    assert source.get_tile(0, 2, 1).size == (45, 75)
+    assert source.get_tile(0, 3, 0) is None
+
+
+class Source:
+    def __init__(self, level_count: int):
+        self.level_count = level_count
+
+
+# The coarsest level with at least a pixel per canvas pixel, never past the top of the pyramid
+def test_choose_level():
+    source = Source(4)
+    assert [choose_level(source, scale) for scale in (2, 1, 0.75, 0.5, 0.3, 0.25, 0.125, 0.01)] == [
+        0, 0, 0, 1, 1, 2, 3, 3]
+    assert choose_level(Source(1), 0.1) == 0
@@ -0,0 +1,65 @@
+import os
+
+from PIL import Image
+import pytest
+
+from scanner import HeaderScanner, find_images, read_header
+
+
+# The limit is only raised while a header is read, so opening the same image anywhere else is still refused
+def test_large_image_limit_is_scoped(tmp_path, monkeypatch):
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100)
+    path = str(tmp_path / "large.png")
+    Image.new("L", (20, 20)).save(path)
+
+    assert read_header(path)["width"] == 20
+    assert Image.MAX_IMAGE_PIXELS == 100
+    with pytest.raises(Image.DecompressionBombError):
+        Image.open(path)
+
+
+def save_images(tmp_path, count: int) -> list:
+    image_paths = []
+    for index in range(count):
+        image_path = str(tmp_path / f"{index:02}.png")
+        Image.new("L", (10 + index, 20)).save(image_path)
+        image_paths.append(image_path)
+    return image_paths
+
+
+def test_find_images_skips_hidden_and_other_files(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / ".tiles").mkdir()
+    for name in ("b.JPG", "a.png", "notes.txt", ".hidden.png", "sub/c.tif", ".tiles/0.png"):
+        (tmp_path / name).write_bytes(b"")
+
+    assert find_images(str(tmp_path)) == [str(tmp_path / name) for name in ("a.png", "b.JPG", "sub/c.tif")]
+    assert find_images(str(tmp_path), recursive=False) == [str(tmp_path / name) for name in ("a.png", "b.JPG")]
+
+
+# Headers come back in directory order, the first image on its own, with files that can't be read left out and known
+# headers taken as they are without opening the file
+def test_header_scanner_order(tmp_path):
+    image_paths = save_images(tmp_path, 9)
+    (tmp_path / "03.png").write_bytes(b"not an image")
+    known = {image_paths[5]: {"width": 1, "height": 2, "date_captured": None}}
+    os.remove(image_paths[5])
+
+    scanner = HeaderScanner(image_paths, chunk_size=2, workers=2, known=known)
+    scanner.start()
+    first = scanner.poll(wait=True)
+    assert first == [(image_paths[0], {"width": 10, "height": 20, "date_captured": None})]
+
+    rest = scanner.drain()
+    assert [path for path, _header in rest] == [path for index, path in enumerate(image_paths) if index not in (0, 3)]
+    assert dict(rest)[image_paths[5]] == known[image_paths[5]]
+    assert dict(rest)[image_paths[8]]["width"] == 18
+    assert scanner.done() and scanner.executor is None
+
+
+def test_header_scanner_with_every_header_known(tmp_path):
+    known = {str(tmp_path / f"{index}.png"): {"width": index, "height": 1, "date_captured": None} for index in range(3)}
+    scanner = HeaderScanner(list(known), known=known)
+    scanner.start()
+    assert scanner.executor is None
+    assert scanner.drain() == list(known.items())
@@ -0,0 +1,74 @@
+import json
+import random
+
+from store import AnnotationStore
+
+
+def make_annotation(annotation_id: int, image_id: int, segmentation, **extra) -> dict:
+    return {"id": annotation_id,
+            "image_id": image_id,
+            "category_id": 1,
+            "segmentation": segmentation,
+            "area": 12.5 if annotation_id % 2 else 10,
+            "bbox": [1, 2, 3.5, 4],
+            "iscrowd": isinstance(segmentation, dict),
+            **extra}
+
+
+# Every segmentation and value comes back as it went in, down to ints staying ints next to float polygons
+def test_round_trip_is_lossless():
+    groups = [(0, [make_annotation(0, 0, [1, 2, 3, 4, 5, 6]),
+                   make_annotation(1, 0, [1.5, 2.0, 3.0, 4.25, 5.0, 6.0])]),
+              (2, [make_annotation(2, 2, [[1, 2, 3, 4, 5, 6]]),
+                   make_annotation(3, 2, {"counts": "abc", "size": [4, 4]}, note="kept"),
+                   make_annotation(4, 2, [[1, 2, 3, 4, 5, 6], [7, 8, 9, 10, 11, 12]]),
+                   make_annotation(5, 2, [])])]
+
+    store = AnnotationStore.from_groups(groups)
+    written = list(store.iter_groups())
+
+    assert json.dumps(written) == json.dumps(groups)
+
+
+# Rebuilding with some images kept and the rest given again matches building the store from scratch
+def test_rebuild_matches_from_groups():
+    generator = random.Random(0)
+    segmentations = ([1, 2, 3, 4, 5, 6], [1.5, 2.0, 3.0, 4.25, 5.0, 6.0], [[1, 2, 3, 4, 5, 6]],
+                     {"counts": "abc", "size": [4, 4]}, [[1, 2, 3, 4, 5, 6], [7, 8, 9, 10, 11, 12]], [])
+
+    def make_groups(image_count: int) -> list:
+        return [(image_id, [make_annotation(0, image_id, generator.choice(segmentations),
+                                            **({"note": image_id} if generator.random() < 0.2 else {}))
+                            for _index in range(generator.randint(0, 3))]) for image_id in range(image_count)]
+
+    for _case in range(50):
+        old_groups = make_groups(generator.randint(0, 8))
+        new_groups = make_groups(generator.randint(0, 10))
+        # Each kept image comes from a different old one, possibly moved to a new position
+        old_ids = list(range(len(old_groups)))
+        generator.shuffle(old_ids)
+        reused = {}
+        for new_id in range(len(new_groups)):
+            if old_ids and generator.random() < 0.6:
+                old_id = old_ids.pop()
+                reused[new_id] = old_id
+                new_groups[new_id] = (new_id, [dict(annotation, image_id=new_id)
+                                               for annotation in old_groups[old_id][1]])
+
+        store = AnnotationStore.from_groups(old_groups).rebuild(
+            reused, [group for group in new_groups if group[0] not in reused])
+        expected = AnnotationStore.from_groups(new_groups)
+
+        assert json.dumps(renumber(store.iter_groups())) == json.dumps(renumber(expected.iter_groups()))
+        assert store.vertices.dtype == expected.vertices.dtype
+
+
+def test_rebuild_rewrites_merged_categories():
+    store = AnnotationStore.from_groups([(0, [make_annotation(0, 0, [1, 2, 3, 4, 5, 6])])])
+    store = store.rebuild({0: 0}, [], {1: 7})
+    assert store.category_id.tolist() == [7]
+
+
+# Ids are positions in the store, so only what the annotations hold is compared
+def renumber(groups) -> list:
+    return [(image_id, [dict(annotation, id=None) for annotation in annotations]) for image_id, annotations in groups]
@@ -0,0 +1,102 @@
+from metadata import MetadataIndex
+from objects import LabelIndex
+from ui import ImageManager, MotionCoalescer
+
+
+class HistoryManager:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.metadata_index = MetadataIndex(directory)
+
+
+# An image manager without a window, with only what opening a directory touches
+def make_image_manager() -> ImageManager:
+    image_manager = ImageManager.__new__(ImageManager)
+    image_manager.editable_images = []
+    image_manager.active_image = None
+    image_manager.scanner = None
+    image_manager.view_canvas = None
+    image_manager.state_manager = None
+    image_manager.image_cache = None
+    image_manager.label_index = LabelIndex()
+    image_manager.set_tool_bbox = lambda: None
+    image_manager.canvas_state = lambda history_manager: setattr(image_manager, "history_manager", history_manager)
+    return image_manager
+
+
+# A directory whose images all fail to read is reported the same way as one without images
+def test_new_canvas_without_readable_images(tmp_path):
+    image_paths = []
+    for index in range(3):
+        image_path = tmp_path / f"{index}.jpg"
+        image_path.write_bytes(b"not an image")
+        image_paths.append(str(image_path))
+
+    image_manager = make_image_manager()
+    assert image_manager.new_canvas(image_paths, HistoryManager(str(tmp_path))) is False
+    assert image_manager.editable_images == []
+    assert image_manager.scanner is None
+
+
+# Stands in for the widget the coalescer schedules its frames on
+class Widget:
+    def __init__(self):
+        self.callbacks = {}
+        self.next_id = 0
+
+    def after(self, _delay: int, callback) -> str:
+        self.next_id += 1
+        self.callbacks[f"after#{self.next_id}"] = callback
+        return f"after#{self.next_id}"
+
+    def after_cancel(self, after_id: str):
+        self.callbacks.pop(after_id, None)
+
+    def run_after(self):
+        for after_id in list(self.callbacks):
+            self.callbacks.pop(after_id)()
+
+
+# A burst of motion reaches the handler once, as its latest event, on the next frame
+def test_motion_coalescer_keeps_latest_event():
+    widget = Widget()
+    coalescer = MotionCoalescer(widget)
+    seen = []
+    handler = coalescer.wrap(seen.append)
+
+    for event in range(5):
+        handler(event)
+    assert seen == []
+    assert len(widget.callbacks) == 1
+
+    widget.run_after()
+    assert seen == [4]
+    assert coalescer.after_id is None
+
+    handler(5)
+    widget.run_after()
+    assert seen == [4, 5]
+    assert (coalescer.received, coalescer.dropped) == (6, 4)
+    assert coalescer.drop_rate() == 4 / 6
+
+
+# A different handler, a flush or a cancel each settle the pending event before anything else happens
+def test_motion_coalescer_flush_and_cancel():
+    widget = Widget()
+    coalescer = MotionCoalescer(widget)
+    seen = []
+    drag = coalescer.wrap(lambda event: seen.append(("drag", event)))
+    hover = coalescer.wrap(lambda event: seen.append(("hover", event)))
+
+    drag(1)
+    hover(2)
+    assert seen == [("drag", 1)]
+    coalescer.flush()
+    assert seen == [("drag", 1), ("hover", 2)]
+    assert widget.callbacks == {}
+
+    drag(3)
+    coalescer.cancel()
+    widget.run_after()
+    assert seen == [("drag", 1), ("hover", 2)]
+    assert coalescer.pending is None and coalescer.dropped == 0
@@ -1,11 +1,13 @@
 import tkinter as tk
 import os
-from collections import defaultdict
-
 
+from cache import ImageCache, DecodePrefetcher
+from geometry import ViewTransform, normalise_extent
 from info import InfoManager, load_dir
-from objects import EditableImage, Annotation, BoundingBox, Polygon
+from objects import EditableImage, Annotation, BoundingBox, Polygon, LabelIndex, ViewCanvas
 from operations import adjust_point
+from pyramid import TileLayer, needs_pyramid
+from scanner import HeaderScanner
 
 
 def write_entry(entry, string: str):
@@ -134,7 +136,8 @@ class StateManager:
 
 # Handles function calls for the tool bar
 class ToolBar:
-    def __init__(self, image_manager, info_entry,  colour_picker, buttons: tuple, status_bar, state_handler):
+    def __init__(self, image_manager, info_entry,  colour_picker, buttons: tuple, status_bar, state_handler,
+                 autosave_ms=5 * 60 * 1000):
         self.image_manager = image_manager
         self.info_entry = info_entry
         self.colour_picker = colour_picker
@@ -157,30 +160,62 @@ class ToolBar:
         self.next_button = buttons[4]
         self.next_button.configure(command=self.next_pressed, state=tk.DISABLED)
 
-    def on_quit(self):
-        if self.info_manager:
-            self.info_manager.bulk_populate_fields(self.image_manager.editable_images)
+        self.autosave_ms = autosave_ms
+        self.image_manager.canvas.after(self.autosave_ms, self.autosave)
+
+    # Writes everything to disk, after which the journal of edits since the last save is no longer needed
+    def save(self):
+        if self.info_manager.directory and self.info_manager.valid:
+            self.image_manager.finish_scan()
+            self.info_manager.bulk_populate_fields(self.image_manager.editable_images, self.save_progress)
             self.info_entry.save_entries(self.info_manager)
-            self.info_manager.write_coco()
+            self.info_manager.save_annotations()
             self.info_manager.write_colour_map()
+            self.info_manager.write_metadata_index()
+            self.info_manager.journal.compact()
+
+    # Only redraws the window, without handling any input. Letting clicks through mid-save would let Open switch the
+    # directory, the window close and shut the pool down, or edits be journaled only to be compacted away
+    def save_progress(self, done: int, total: int):
+        self.status_bar.update_action(f"Encoding crowd masks: {done} of {total} images")
+        self.image_manager.canvas.update_idletasks()
+
+    # Whether anything needs writing: an edited image, or edits and label renames waiting in the journal
+    def has_changes(self) -> bool:
+        return (self.info_manager.journal.has_ops()
+                or any(editable_image.dirty for editable_image in self.image_manager.editable_images))
+
+    # Compacts the journal into coco.json every so often, skipping a round while images are still being scanned or
+    # when nothing has changed since the last save
+    def autosave(self):
+        if (not self.image_manager.scanner and self.info_manager.directory and self.info_manager.valid
+                and self.has_changes()):
+            self.save()
+            self.status_bar.update_action("Autosaved.")
+        self.image_manager.canvas.after(self.autosave_ms, self.autosave)
+
+    def on_quit(self):
+        if self.info_manager:
+            self.save()
+            self.info_manager.close()
+
+    def show_invalid(self):
+        self.info_manager.set_valid(False)
+        self.state_handler.colour_picker_state(False)
+        self.state_handler.info_entry_state(False)
+        self.state_handler.deactivate_tool_buttons()
+
+        self.image_manager.draw_invalid()
 
     # Button pressed events
     def open_pressed(self):
-        if self.info_manager.directory:
-            self.info_manager.bulk_populate_fields(self.image_manager.editable_images)
-            self.info_manager.write_coco()
-            self.info_manager.write_colour_map()
+        self.save()
 
         dir_info = load_dir(self.info_manager)
         if dir_info == "cancelled":
             print("The `🔍 Open` action was cancelled")
         elif dir_info == "invalid":
-            self.info_manager.set_valid(False)
-            self.state_handler.colour_picker_state(False)
-            self.state_handler.info_entry_state(False)
-            self.state_handler.deactivate_tool_buttons()
-
-            self.image_manager.draw_invalid()
+            self.show_invalid()
         elif dir_info == "read":
             self.info_manager.set_valid(True)
             self.info_entry.set_info(self.info_manager.info)
@@ -197,7 +232,9 @@ class ToolBar:
             self.status_bar.update_action(f"Opened {self.info_manager.directory} containing {len(dir_info)} valid images.")
         elif type(dir_info) == list:
             self.info_manager.set_valid(True)
-            self.image_manager.new_canvas(dir_info, self.info_manager)
+            if not self.image_manager.new_canvas(dir_info, self.info_manager):
+                self.show_invalid()
+                return
             self.state_handler.colour_picker_state(True)
             self.state_handler.info_entry_state(True)
             self.colour_picker.remap_colour_picker(self.info_manager)
@@ -290,9 +327,58 @@ class StatusBar:
         self.info_bar.configure(text=info_string)
 
 
+# Keeps only the latest of a burst of motion events and hands it on once per frame, so that slow redraws never leave
+# events queued up behind the pointer. Events replaced before they were handled are counted as dropped
+class MotionCoalescer:
+    def __init__(self, widget, frame_ms: int = 16):
+        self.widget = widget
+        self.frame_ms = frame_ms
+        self.pending = None
+        self.after_id = None
+
+        self.received = 0
+        self.dropped = 0
+
+    # Wraps a motion handler for binding, so that it only ever sees the latest event
+    def wrap(self, handler):
+        return lambda event: self.push(handler, event)
+
+    def push(self, handler, event: tk.Event):
+        self.received += 1
+        if self.pending and self.pending[0] is not handler:
+            self.flush()
+        elif self.pending:
+            self.dropped += 1
+
+        self.pending = (handler, event)
+        if not self.after_id:
+            self.after_id = self.widget.after(self.frame_ms, self.flush)
+
+    # Handles the pending event straight away, for a press or release that has to see the pointer where it is
+    def flush(self):
+        if self.after_id:
+            self.widget.after_cancel(self.after_id)
+            self.after_id = None
+        if self.pending:
+            handler, event = self.pending
+            self.pending = None
+            handler(event)
+
+    def cancel(self):
+        if self.after_id:
+            self.widget.after_cancel(self.after_id)
+            self.after_id = None
+        self.pending = None
+
+    def drop_rate(self) -> float:
+        if not self.received:
+            return 0.0
+        return self.dropped / self.received
+
+
 # Manages the image on the canvas and the actions that can be performed on it
 class ImageManager:
-    def __init__(self, canvas: tk.Canvas, colour_picker, status_bar, state_manager):
+    def __init__(self, canvas: tk.Canvas, colour_picker, status_bar, state_manager, cache_bytes=512 * 1024 ** 2):
         self.canvas = canvas
         self.colour_picker = colour_picker
         self.status_bar = status_bar
@@ -305,6 +391,31 @@ class ImageManager:
         self.image_pointer = 0
         self.editable_images = []
         self.active_image = None
+        self.image_cache = ImageCache(cache_bytes)
+        self.prefetcher = DecodePrefetcher(canvas, self.image_cache)
+        self.scanner = None
+        self.label_index = LabelIndex()
+
+        # Annotations are kept in full resolution image space, and are drawn through the view's zoom and pan
+        self.view = ViewTransform()
+        self.view_canvas = ViewCanvas(canvas, self.view)
+        self.tile_layer = TileLayer(canvas)
+        self.view_width = self.width
+        self.view_height = self.height
+        self.fit_scale = 1.0
+        self.pan_point = None
+        self.motion = MotionCoalescer(canvas)
+        self.canvas.bind("<MouseWheel>", self.zoom_on_mouse_wheel)
+        self.canvas.bind("<Button-4>", self.zoom_on_mouse_wheel)
+        self.canvas.bind("<Button-5>", self.zoom_on_mouse_wheel)
+        self.canvas.bind("<ButtonPress-2>", self.pan_on_mouse_press)
+        self.canvas.bind("<B2-Motion>", self.motion.wrap(self.pan_on_mouse_move))
+
+        # The existing annotation under the cursor and the one picked with shift-click, which can be dragged or deleted
+        self.hovered = None
+        self.selected = None
+        self.drag_point = None
+        self.drag_delta = [0, 0]
 
         self.draw_startup()
 
@@ -327,24 +438,43 @@ class ImageManager:
     def draw_invalid(self):
         title = "Boxer 🥊"
         subtitle = "The simple bounding box tool"
-        description = "Sorry, the directory that you picked is invalid,\nit needs to contain either `.jpg`, `.png` or\n`.bmp` images. If you need any help, please\nreference the docs. Enjoy!"
+        description = "Sorry, the directory that you picked is invalid,\nit needs to contain either `.jpg`, `.png`,\n`.bmp` or `.tif` images. If you need any help,\nplease reference the docs. Enjoy!"
         self.draw_placeholder(title, subtitle, description)
-        self.status_bar.update_action("Sorry, the directory needs to contain `.jpg`, `.png` or `.bmp` images.")
+        self.status_bar.update_action("Sorry, the directory needs to contain `.jpg`, `.png`, `.bmp` or `.tif` images.")
         self.status_bar.update_info("")
 
     def reset_canvas(self):
-        self.canvas.delete("all")
+        self.clear_canvas()
         self.active_image = None
         self.editable_images = []
         self.image_pointer = 0
+        self.prefetcher.cancel()
+        self.motion.cancel()
+        self.clear_selection()
+        if self.scanner:
+            self.scanner.close()
+            self.scanner = None
+        self.image_cache.clear()
+        self.label_index.clear()
 
         self.state_manager.deactivate_tool_buttons()
 
+    # Deletes every item for good, including the hidden ones kept for reuse
+    def clear_canvas(self):
+        self.canvas.delete("all")
+        self.view_canvas.pool.forget()
+        self.tile_layer.forget()
+
     def deactivate_canvas(self):
+        self.motion.cancel()
         self.canvas.unbind("<ButtonPress-1>")
         self.canvas.unbind("<B1-Motion>")
         self.canvas.unbind("<ButtonRelease-1>")
         self.canvas.unbind("<ButtonPress-3>")
+        self.canvas.unbind("<Shift-ButtonPress-1>")
+        self.canvas.unbind("<Motion>")
+        self.canvas.unbind("<Delete>")
+        self.canvas.unbind("<BackSpace>")
         self.colour_picker.entry.unbind("<KeyRelease>")
 
     # FIXME: This can probably be dropped
@@ -354,69 +484,224 @@ class ImageManager:
         if self.active_image:
             self.reset_canvas()
         else:
-            self.canvas.delete("all")
+            self.clear_canvas()
 
     def set_canvas(self):
         self.active_image = self.editable_images[self.image_pointer]
-        self.active_image.activate_image()
+        self.hydrate_image(self.active_image)
+        self.show_active_image()
+        self.record_thumbnail()
+        self.prefetch_images(1)
 
-        filename = os.path.basename(self.active_image.image_path)
-        file_ratio = f"{self.image_pointer}/{len(self.editable_images)}"
-        self.status_bar.update_info(f"{filename}    {file_ratio}")
+        self.update_image_info()
 
         self.state_manager.undo_state(self.active_image.undo_stack)
         self.state_manager.redo_state(self.active_image.redo_stack)
         self.state_manager.prev_state(self.image_pointer)
         self.state_manager.next_state(self.image_pointer, len(self.editable_images))
 
-    def new_canvas(self, image_paths: list, history_manager):
+    # Thumbnails are only made from images that have already been decoded for display
+    def record_thumbnail(self):
+        image_path = self.active_image.image_path
+        image = self.image_cache.images.get(image_path)
+        if image is not None:
+            self.history_manager.metadata_index.add_thumbnail(image_path, image)
+
+    # Images shown through a tile pyramid are never decoded whole, so they are left out of the prefetch
+    def prefetch_images(self, direction: int):
+        image_paths = [None if needs_pyramid(editable_image.width, editable_image.height) else editable_image.image_path
+                       for editable_image in self.editable_images]
+        self.prefetcher.schedule(image_paths, self.image_pointer, direction)
+
+    def update_image_info(self):
+        filename = os.path.basename(self.active_image.image_path)
+        file_ratio = f"{self.image_pointer}/{len(self.editable_images)}"
+        zoom = f"zoom {self.view.scale:.0%}"
+        hit_rate = f"decode-ahead {self.prefetcher.hit_rate():.0%}"
+        dropped = f"motion coalesced {self.motion.drop_rate():.0%}"
+        self.status_bar.update_info(f"{filename}    {file_ratio}    {zoom}    {hit_rate}    {dropped}")
+
+    # View changes
+    # Fits the active image into the canvas, at full size where it fits, and draws its tiles and annotations
+    def show_active_image(self):
+        max_width = int(self.canvas.winfo_screenwidth() * 0.75)
+        max_height = int(self.canvas.winfo_screenheight() * 0.75)
+        self.fit_scale = min(1.0, max_width / self.active_image.width, max_height / self.active_image.height)
+        self.view.scale = self.fit_scale
+        self.view.offset_x = 0
+        self.view.offset_y = 0
+        self.view_width = round(self.active_image.width * self.fit_scale)
+        self.view_height = round(self.active_image.height * self.fit_scale)
+        self.canvas.configure(width=self.view_width, height=self.view_height)
+
+        self.active_image.activate_image(self.tile_layer)
+        self.tile_layer.render(self.view, self.view_width, self.view_height)
+
+    # Keeps the image covering the canvas, so that panning can't scroll past its edges
+    def clamp_view(self):
+        max_x = self.active_image.width * self.view.scale - self.view_width
+        max_y = self.active_image.height * self.view.scale - self.view_height
+        self.view.offset_x = min(max(self.view.offset_x, 0), max_x)
+        self.view.offset_y = min(max(self.view.offset_y, 0), max_y)
+
+    def apply_view(self, old: ViewTransform):
+        self.clamp_view()
+        self.view_canvas.apply_view(old)
+        self.tile_layer.render(self.view, self.view_width, self.view_height)
+        self.update_image_info()
+
+    # Zooms around the cursor, from the whole image fitting the canvas up to 8 canvas pixels for each image pixel
+    def zoom_on_mouse_wheel(self, event: tk.Event):
+        if not self.active_image:
+            return
+
+        factor = 1.25 if event.num == 4 or event.delta > 0 else 0.8
+        factor = min(max(self.view.scale * factor, self.fit_scale), 8.0) / self.view.scale
+        if factor != 1:
+            old = self.view.copy()
+            self.view.zoom_at(factor, event.x, event.y)
+            self.apply_view(old)
+
+    def pan_on_mouse_press(self, event: tk.Event):
+        self.pan_point = [event.x, event.y]
+
+    def pan_on_mouse_move(self, event: tk.Event):
+        if not self.active_image or not self.pan_point:
+            return
+
+        old = self.view.copy()
+        self.view.pan(event.x - self.pan_point[0], event.y - self.pan_point[1])
+        self.pan_point = [event.x, event.y]
+        self.apply_view(old)
+
+    # Where an event happened in full resolution image coordinates
+    def event_point(self, event: tk.Event) -> tuple:
+        x, y = self.view.to_image(event.x, event.y)
+        return round(x), round(y)
+
+    # Starts a directory without a coco file, returning whether any of its images could be read
+    def new_canvas(self, image_paths: list, history_manager) -> bool:
         self.canvas_state(history_manager)
+        self.set_tool_bbox()
 
-        for image_path in image_paths:
-            editable_image = EditableImage(image_path, self.canvas, self.state_manager)
-            self.editable_images.append(editable_image)
-            self.set_tool_bbox()
+        known, _stale = self.history_manager.metadata_index.partition(image_paths)
+        self.scanner = HeaderScanner(image_paths, known=known)
+        self.scanner.start()
+        self.add_scanned_images(self.scanner.poll(wait=True))
 
-        self.set_canvas()
+        # When no header could be read there is nothing to show, the same as a directory without images
+        if not self.editable_images:
+            self.scanner = None
+            return False
 
-    def load_canvas(self, history_manager):
-        self.canvas_state(history_manager)
+        # Edits left in the journal by a crash can touch any image, so they wait for the whole scan
+        if os.path.exists(self.history_manager.journal.path):
+            self.finish_scan()
+            self.replay_journal()
+        self.set_canvas()
+        self.canvas.after(50, self.poll_scanner)
+        return True
 
+    # Adds images to the end of the list as their headers arrive from the scanner, recording new ones in the index
+    def add_scanned_images(self, scanned: list):
         directory = self.history_manager.directory
-        images = self.history_manager.images
-        annotations = self.history_manager.annotations
+        metadata_index = self.history_manager.metadata_index
+        for image_path, header in scanned:
+            if image_path not in self.scanner.known:
+                metadata_index.update(image_path, header)
+
+            header = dict(header, file_name=os.path.relpath(image_path, directory))
+            editable_image = EditableImage(image_path, self.view_canvas, self.state_manager, self.image_cache,
+                                           self.label_index, header)
+            self.editable_images.append(editable_image)
 
-        bbox_dict = defaultdict(list)
-        id_category_map = self.history_manager.make_id_category_map()
-        id_colour_map = self.history_manager.make_id_colour_map()
+    def poll_scanner(self):
+        if not self.scanner:
+            return
+
+        scanned = self.scanner.poll()
+        if scanned:
+            self.add_scanned_images(scanned)
+            self.update_image_info()
+            self.state_manager.next_state(self.image_pointer, len(self.editable_images))
 
-        # FIXME: This needs to be updated for the new annotation model
-        for annotation in annotations:
-            coords = [annotation["bbox"][0], annotation["bbox"][1], annotation["bbox"][0]+annotation["bbox"][2],
-                      annotation["bbox"][1]+annotation["bbox"][3]]
-            label = id_category_map[annotation["category_id"]]
-            colour = id_colour_map[label]
+        if self.scanner.done():
+            self.scanner = None
+        else:
+            self.canvas.after(50, self.poll_scanner)
+
+    # Blocks until every image has been scanned, so that saving never misses any
+    def finish_scan(self):
+        if self.scanner:
+            self.add_scanned_images(self.scanner.drain())
+            self.scanner = None
 
-            bbox_dict[annotation["image_id"]].append(BoundingBox(self.canvas, coords, label, colour))
+    # Lists the images of an opened coco file. Their annotations are only read once each image is shown
+    def load_canvas(self, history_manager):
+        self.canvas_state(history_manager)
+        self.set_tool_bbox()
 
-        for image in images:
+        directory = self.history_manager.directory
+        for image in self.history_manager.images:
             path = os.path.join(directory, image["file_name"])
-            editable_image = EditableImage(path, self.canvas)
-            editable_image.undo_stack = bbox_dict[image["id"]]
+            editable_image = EditableImage(path, self.view_canvas, self.state_manager, self.image_cache,
+                                           self.label_index, image)
+            editable_image.coco_id = image["id"]
+            editable_image.coco_annotations = None
+            editable_image.dirty = False
             self.editable_images.append(editable_image)
 
+        self.replay_journal()
         self.set_canvas()
 
+    # Replays the edits that reached the journal but not coco.json, hydrating the images they touch
+    def replay_journal(self):
+        ops = self.history_manager.journal.read_ops()
+        if not ops:
+            return
+
+        images = {editable_image.file_name: editable_image for editable_image in self.editable_images}
+        touched = {}
+        for op in ops:
+            if op["op"] == "rename":
+                self.history_manager.colour_map[op["colour"]] = op["new"]
+                self.history_manager.rename_category(op["old"], op["new"])
+                self.label_index.rename(op["old"], op["new"], None)
+            elif op["image"] in images:
+                editable_image = images[op["image"]]
+                self.hydrate_image(editable_image)
+                editable_image.apply_journal_op(op)
+                touched[op["image"]] = editable_image
+
+        for editable_image in touched.values():
+            editable_image.rebuild_annotations()
+
+        print(f"Recovered {len(ops)} unsaved edits from the journal")
+
+    def hydrate_image(self, editable_image: EditableImage):
+        if editable_image.is_hydrated():
+            return
+
+        coco_annotations = self.history_manager.get_image_annotations(editable_image)
+        id_category_map = self.history_manager.make_id_category_map()
+        id_colour_map = self.history_manager.make_id_colour_map()
+        editable_image.hydrate(coco_annotations, id_category_map, id_colour_map, self.colour_picker.colour)
+
     def shift_image(self, delta: int):
+        self.motion.cancel()
         self.image_pointer += delta
+        self.clear_selection()
         self.active_image.deactivate_image()
         self.active_image = self.editable_images[self.image_pointer]
-        self.active_image.activate_image()
+        if not needs_pyramid(self.active_image.width, self.active_image.height):
+            self.prefetcher.claim(self.active_image.image_path)
+        self.hydrate_image(self.active_image)
+        self.show_active_image()
+        self.record_thumbnail()
+        self.prefetch_images(delta)
 
         self.status_bar.update_action(f"Moved to image {self.image_pointer+1} out of {len(self.editable_images)}.")
-        filename = os.path.basename(self.active_image.image_path)
-        file_ratio = f"{self.image_pointer}/{len(self.editable_images)}"
-        self.status_bar.update_info(f"{filename}    {file_ratio}")
+        self.update_image_info()
 
         self.state_manager.undo_state(self.active_image.undo_stack)
         self.state_manager.redo_state(self.active_image.redo_stack)
@@ -425,34 +710,42 @@ class ImageManager:
 
     # Undo and redo events
     def undo_action(self):
-        undo = self.active_image.pop_undo()
-        self.state_manager.undo_state(self.active_image.undo_stack)
+        self.motion.cancel()
+        self.clear_selection()
+        self.history_manager.journal.record_undo(self.active_image.file_name)
+        undo = self.active_image.undo()
         undo.delete()
-        self.active_image.append_redo(undo)
+        self.state_manager.undo_state(self.active_image.undo_stack)
         self.state_manager.redo_state(self.active_image.redo_stack)
-        self.active_image.annotation.update_annotation_after_undo()
-
-        if type(undo) != BoundingBox:
-            self.canvas.bind("<Motion>", self.poly_on_mouse_move)
 
-        if not self.active_image.annotation.is_active_bbox():
+        if type(undo) == BoundingBox:
             self.set_tool_bbox()
-            self.active_image.annotations.pop()
+        else:
+            self.canvas.bind("<Motion>", self.motion.wrap(self.poly_on_mouse_move))
 
     def redo_action(self):
-        redo = self.active_image.pop_redo()
-        self.state_manager.redo_state(self.active_image.redo_stack)
+        self.motion.cancel()
+        self.clear_selection()
+        self.history_manager.journal.record_redo(self.active_image.file_name)
+        redo = self.active_image.redo()
         redo.draw()
-        self.active_image.append_undo(redo)
+        self.state_manager.redo_state(self.active_image.redo_stack)
         self.state_manager.undo_state(self.active_image.undo_stack)
-        self.active_image.annotation.update_annotation_after_redo(redo)
+
+        # A box that comes back is an annotation again, and the next click draws its polygons
+        if type(redo) == BoundingBox:
+            self.set_tool_polygon()
 
     # Tool changes
     def set_tool_bbox(self):
         self.deactivate_canvas()
         self.canvas.bind("<ButtonPress-1>", self.bbox_on_mouse_press)
-        self.canvas.bind("<B1-Motion>", self.bbox_on_mouse_move)
+        self.canvas.bind("<B1-Motion>", self.motion.wrap(self.bbox_on_mouse_move))
         self.canvas.bind("<ButtonRelease-1>", self.bbox_on_mouse_release)
+        self.canvas.bind("<Shift-ButtonPress-1>", self.select_on_mouse_press)
+        self.canvas.bind("<Motion>", self.motion.wrap(self.hover_on_mouse_move))
+        self.canvas.bind("<Delete>", self.delete_selected)
+        self.canvas.bind("<BackSpace>", self.delete_selected)
         self.colour_picker.entry.bind("<KeyRelease>", self.update_labels)
 
     def set_tool_polygon(self):
@@ -462,31 +755,32 @@ class ImageManager:
         self.colour_picker.entry.bind("<KeyRelease>", self.update_labels)
 
     # Event Bindings
+    # Runs on every key press in the label entry, so it only touches the shared label and its tagged canvas items
     def update_labels(self, _event: tk.Event):
         old_label = self.colour_picker.label
         self.colour_picker.on_entry_edit()
         new_label = self.colour_picker.label
+        if old_label == new_label:
+            return
 
-        for image in self.editable_images:
-            for undo in image.undo_stack:
-                if undo.get_label() == old_label:
-                    undo.change_label(new_label)
-            for redo in image.redo_stack:
-                if redo.get_label() == old_label:
-                    redo.change_label(new_label)
+        self.history_manager.rename_category(old_label, new_label)
+        self.history_manager.journal.record_rename(self.colour_picker.colour, old_label, new_label)
+        self.label_index.rename(old_label, new_label, self.canvas)
 
         self.status_bar.update_action(f"Changed {self.colour_picker.colour} label to `{new_label}`.")
 
     # Bounding box actions
     def bbox_on_mouse_press(self, event: tk.Event):
-        self.active_image.annotation = Annotation(self.canvas, self.state_manager)
-        self.active_image.annotation.set_label(self.colour_picker.label, self.colour_picker.colour)
-        self.active_image.annotation.set_bbox(BoundingBox(self.canvas, [event.x, event.y, event.x, event.y],
-                                                          self.colour_picker.label, self.colour_picker.colour))
+        x, y = self.event_point(event)
+        label = self.label_index.get(self.colour_picker.label)
+        self.active_image.annotation = Annotation(self.view_canvas, self.state_manager)
+        self.active_image.annotation.set_label(label, self.colour_picker.colour)
+        self.active_image.annotation.set_bbox(BoundingBox(self.view_canvas, [x, y, x, y], label,
+                                                          self.colour_picker.colour))
         self.active_image.annotation.draw_bbox()
 
     def bbox_on_mouse_move(self, event: tk.Event):
-        x, y = adjust_point((event.x, event.y), self.active_image.width, self.active_image.height)
+        x, y = adjust_point(self.event_point(event), self.active_image.width, self.active_image.height)
         start_x, start_y = self.active_image.annotation.bbox.get_coords()[:2]
         if x < start_x and y < start_y:
             self.active_image.annotation.bbox.start_x = x
@@ -498,7 +792,11 @@ class ImageManager:
         self.active_image.annotation.adjust_bbox(x, y)
 
     def bbox_on_mouse_release(self, _event: tk.Event):
-        self.active_image.append_undo(self.active_image.annotation.get_bbox())
+        self.motion.flush()
+        bbox = self.active_image.annotation.get_bbox()
+        self.history_manager.journal.record_bbox(self.active_image.file_name, bbox.get_coords(), bbox.get_label(),
+                                                 bbox.colour)
+        self.active_image.append_undo(bbox)
         self.active_image.append_annotation(self.active_image.annotation)
 
         self.set_tool_polygon()
@@ -509,29 +807,111 @@ class ImageManager:
         self.state_manager.undo_state(self.active_image.undo_stack)
         self.state_manager.redo_state(self.active_image.redo_stack)
 
+    # Selection actions
+    def refresh_highlight(self, annotation: Annotation):
+        if annotation and annotation.bbox:
+            annotation.bbox.highlight(annotation is self.hovered, annotation is self.selected)
+
+    def clear_selection(self):
+        hovered, selected = self.hovered, self.selected
+        self.hovered = None
+        self.selected = None
+        self.refresh_highlight(hovered)
+        self.refresh_highlight(selected)
+
+    def hover_on_mouse_move(self, event: tk.Event):
+        found = self.active_image.find_annotations(*self.event_point(event))
+        hovered = found[0] if found else None
+        if hovered is not self.hovered:
+            previous = self.hovered
+            self.hovered = hovered
+            self.refresh_highlight(previous)
+            self.refresh_highlight(hovered)
+
+    # Shift-click picks the topmost annotation under the cursor, which then follows the mouse until it is released
+    def select_on_mouse_press(self, event: tk.Event):
+        x, y = self.event_point(event)
+        found = self.active_image.find_annotations(x, y)
+        previous = self.selected
+        self.selected = found[0] if found else None
+        self.refresh_highlight(previous)
+        self.refresh_highlight(self.selected)
+        if not self.selected:
+            return
+
+        self.canvas.focus_set()
+        self.drag_point = [x, y]
+        self.drag_delta = [0, 0]
+        self.canvas.bind("<B1-Motion>", self.motion.wrap(self.select_on_mouse_move))
+        self.canvas.bind("<ButtonRelease-1>", self.select_on_mouse_release)
+        self.status_bar.update_action(f"Selected `{self.selected.get_label()}` bounding box at {self.selected.get_bbox_coords()}")
+
+    # Drags the selection by however far the mouse moved, keeping its box inside the image
+    def select_on_mouse_move(self, event: tk.Event):
+        x, y = self.event_point(event)
+        min_x, min_y, max_x, max_y = normalise_extent(self.selected.get_bbox_coords())
+        delta_x = max(-min_x, min(x - self.drag_point[0], self.active_image.width - max_x))
+        delta_y = max(-min_y, min(y - self.drag_point[1], self.active_image.height - max_y))
+        if delta_x or delta_y:
+            self.selected.move(delta_x, delta_y)
+            self.drag_point = [self.drag_point[0] + delta_x, self.drag_point[1] + delta_y]
+            self.drag_delta = [self.drag_delta[0] + delta_x, self.drag_delta[1] + delta_y]
+
+    def select_on_mouse_release(self, _event: tk.Event):
+        self.motion.flush()
+        self.set_tool_bbox()
+        self.drag_point = None
+        if self.drag_delta == [0, 0]:
+            return
+
+        position = self.active_image.annotations.index(self.selected)
+        self.history_manager.journal.record_move(self.active_image.file_name, position, self.drag_delta)
+        self.active_image.update_annotation_extent(self.selected)
+        self.state_manager.redo_state(self.active_image.redo_stack)
+
+        self.status_bar.update_action(f"Moved `{self.selected.get_label()}` bounding box to {self.selected.get_bbox_coords()}")
+
+    def delete_selected(self, _event: tk.Event):
+        if not self.selected:
+            return
+
+        annotation = self.selected
+        self.clear_selection()
+        position = self.active_image.annotations.index(annotation)
+        self.history_manager.journal.record_delete(self.active_image.file_name, position)
+        self.active_image.delete_annotation(annotation)
+        self.state_manager.undo_state(self.active_image.undo_stack)
+        self.state_manager.redo_state(self.active_image.redo_stack)
+
+        self.status_bar.update_action(f"Deleted `{annotation.get_label()}` bounding box at {annotation.get_bbox_coords()}")
+
     # Polygon actions
     def adjust_poly_point(self, event: tk.Event):
         bbox = self.active_image.annotation.bbox.get_coords()
         width = bbox[2] - bbox[0]
         height = bbox[3] - bbox[1]
-        return adjust_point((event.x, event.y), width, height, rel_x=bbox[0], rel_y=bbox[1])
+        return adjust_point(self.event_point(event), width, height, rel_x=bbox[0], rel_y=bbox[1])
 
     def poly_on_mouse_press(self, event: tk.Event):
+        self.motion.flush()
         if not self.active_image.annotation.bbox:
             self.set_tool_bbox()
             self.bbox_on_mouse_press(event)
         else:
             if self.active_image.annotation.is_active_polygon():
-                if not self.active_image.annotation.resume_polygon(event.x, event.y):
+                if not self.active_image.annotation.resume_polygon(*self.event_point(event)):
                     self.active_image.annotation.end_polygon_segment()
-                    if self.active_image.annotation.get_segment() not in self.active_image.undo_stack:
-                        self.active_image.append_undo(self.active_image.annotation.get_segment())
+                    segment = self.active_image.annotation.get_segment()
+                    if segment not in self.active_image.undo_stack:
+                        self.history_manager.journal.record_segment(self.active_image.file_name, segment.get_start(),
+                                                                    segment.get_coords())
+                        self.active_image.append_undo(segment)
             else:
                 x, y = self.adjust_poly_point(event)
-                if x == event.x and y == event.y:
-                    self.active_image.annotation.set_polygon(Polygon(self.canvas, self.active_image.annotation.get_colour(), x, y))
+                if (x, y) == self.event_point(event):
+                    self.active_image.annotation.set_polygon(Polygon(self.view_canvas, self.active_image.annotation.get_colour(), x, y))
                     self.active_image.annotation.draw_polygon_segment()
-                    self.canvas.bind("<Motion>", self.poly_on_mouse_move)
+                    self.canvas.bind("<Motion>", self.motion.wrap(self.poly_on_mouse_move))
 
         self.active_image.redo_stack = []
         self.state_manager.undo_state(self.active_image.undo_stack)